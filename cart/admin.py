@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Cart, CartItem, Order, OrderItem
+from .models import Cart, CartItem, Order, OrderItem, StockHold
 
 
 class OrderItemInline(admin.TabularInline):
@@ -20,3 +20,14 @@ class OrderAdmin(admin.ModelAdmin):
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'session_key', 'created_at']
+
+
+@admin.register(StockHold)
+class StockHoldAdmin(admin.ModelAdmin):
+    list_display = ['watch', 'cart', 'quantity', 'expires_at']
+    list_select_related = ['watch__brand', 'cart__user']
+    readonly_fields = ['cart', 'watch', 'quantity', 'expires_at']
+
+    def has_delete_permission(self, request, obj=None):
+        # Deleting a hold here would strand its units in Watch.reserved; release them through the cart
+        return False
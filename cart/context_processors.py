@@ -1,17 +1,11 @@
-from .models import Cart
+from django.utils.functional import SimpleLazyObject
+from .counts import get_cart_count
 
 
 def cart_processor(request):
-    cart_count = 0
-    try:
-        if request.user.is_authenticated:
-            cart = Cart.objects.filter(user=request.user).first()
-        else:
-            session_key = request.session.session_key
-            cart = Cart.objects.filter(session_key=session_key).first() if session_key else None
-
-        if cart:
-            cart_count = cart.total_items
-    except Exception:
-        pass
-    return {'cart_count': cart_count}
+    def cart_count():
+        try:
+            return get_cart_count(request)
+        except Exception:
+            return 0
+    return {'cart_count': SimpleLazyObject(cart_count)}
@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from .models import CartItem, CartSummary
+
+CART_COUNT_TIMEOUT = 60 * 60 * 24
+
+
+def cache_key(request):
+    if request.user.is_authenticated:
+        return f'cart:count:user:{request.user.pk}'
+    session_key = request.session.session_key
+    return f'cart:count:session:{session_key}' if session_key else None
+
+
+def count_items(request):
+    if request.user.is_authenticated:
+        items = CartItem.objects.filter(cart__user=request.user)
+    else:
+        items = CartItem.objects.filter(cart__session_key=request.session.session_key)
+    return CartSummary.for_items(items).total_items
+
+
+def get_cart_count(request):
+    """Item count for the navbar badge, memoized on the request and cached between requests."""
+    if hasattr(request, '_cart_count'):
+        return request._cart_count
+    key = cache_key(request)
+    count = 0
+    if key:
+        count = cache.get(key)
+        if count is None:
+            count = count_items(request)
+            cache.set(key, count, CART_COUNT_TIMEOUT)
+    request._cart_count = count
+    return count
+
+
+def set_cart_count(request, count):
+    request._cart_count = count
+    key = cache_key(request)
+    if key:
+        cache.set(key, count, CART_COUNT_TIMEOUT)
+
+
+def forget_cart_count(request):
+    request.__dict__.pop('_cart_count', None)
+    key = cache_key(request)
+    if key:
+        cache.delete(key)
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from cart import reservations
+from cart.models import StockHold
+from store.models import Watch
+
+
+class Command(BaseCommand):
+    help = 'Releases expired cart stock holds in batches; run it every minute or so from cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=reservations.SWEEP_BATCH_SIZE)
+        parser.add_argument(
+            '--reconcile', action='store_true',
+            help='Also recompute every watch\'s reserved count from the remaining holds',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        released = reservations.sweep_expired(options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired holds in {elapsed:.2f}s.'))
+
+        if options['reconcile']:
+            held = (
+                StockHold.objects.filter(watch=OuterRef('pk')).order_by().values('watch')
+                .annotate(total=Sum('quantity')).values('total')
+            )
+            updated = Watch.objects.update(reserved=Coalesce(Subquery(held, output_field=IntegerField()), 0))
+            self.stdout.write(self.style.SUCCESS(f'Reconciled reserved stock for {updated} watches.'))
@@ -0,0 +1,55 @@
+from django.db import IntegrityError, connection, transaction
+from .models import Cart, CartItem, StockHold
+
+CART_SESSION_KEY = 'cart_id'
+
+ITEMS = CartItem._meta.db_table
+HOLDS = StockHold._meta.db_table
+
+# Both statements move every row of one cart into another, adding quantities
+# where the target already has a line for the same watch.
+MERGE_ITEMS_SQL = f"""
+INSERT INTO {ITEMS} (cart_id, watch_id, quantity)
+SELECT %s, watch_id, quantity FROM {ITEMS} WHERE cart_id = %s
+ON CONFLICT (cart_id, watch_id) DO UPDATE SET quantity = {ITEMS}.quantity + excluded.quantity
+"""
+
+MERGE_HOLDS_SQL = f"""
+INSERT INTO {HOLDS} (cart_id, watch_id, quantity, expires_at)
+SELECT %s, watch_id, quantity, expires_at FROM {HOLDS} WHERE cart_id = %s
+ON CONFLICT (cart_id, watch_id) DO UPDATE SET
+    quantity = {HOLDS}.quantity + excluded.quantity,
+    expires_at = CASE WHEN excluded.expires_at > {HOLDS}.expires_at
+                      THEN excluded.expires_at ELSE {HOLDS}.expires_at END
+"""
+
+
+def _user_cart(user):
+    try:
+        with transaction.atomic():
+            return Cart.objects.get_or_create(user=user)[0]
+    except IntegrityError:
+        # Another login created it first
+        return Cart.objects.get(user=user)
+
+
+def merge_carts(anonymous_cart_id, user):
+    """
+    Fold an anonymous cart into the user's cart and delete it. Stock holds move
+    with their lines, so Watch.reserved is untouched. The anonymous cart row is
+    locked and re-checked first, so two logins racing on the same session merge
+    it exactly once. Returns the user's cart, or None if there was nothing to
+    merge.
+    """
+    with transaction.atomic():
+        source = Cart.objects.select_for_update().filter(pk=anonymous_cart_id, user__isnull=True).first()
+        if source is None:
+            return None
+        target = _user_cart(user)
+        with connection.cursor() as cursor:
+            cursor.execute(MERGE_ITEMS_SQL, [target.pk, source.pk])
+            cursor.execute(MERGE_HOLDS_SQL, [target.pk, source.pk])
+        # The units now belong to the target's holds, so these go without a release
+        StockHold.objects.filter(cart=source).delete()
+        source.delete()
+    return target
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+        ('store', '0004_watch_reserved'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='cart.cart')),
+                ('watch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='store.watch')),
+            ],
+            options={
+                'unique_together': {('cart', 'watch')},
+            },
+        ),
+    ]
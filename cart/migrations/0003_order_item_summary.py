@@ -0,0 +1,48 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_item_summaries(apps, schema_editor):
+    Order = apps.get_model('cart', 'Order')
+    OrderItem = apps.get_model('cart', 'OrderItem')
+    lines = {}
+    for order_id, name, quantity in OrderItem.objects.order_by('order_id', 'pk').values_list(
+        'order_id', 'watch_name', 'quantity',
+    ):
+        lines.setdefault(order_id, []).append((name, quantity))
+    orders = list(Order.objects.filter(pk__in=lines).only('pk'))
+    for order in orders:
+        order.item_count = sum(quantity for _, quantity in lines[order.pk])
+        summary = ', '.join(f'{name} × {quantity}' for name, quantity in lines[order.pk][:2])
+        if len(lines[order.pk]) > 2:
+            summary += f' and {len(lines[order.pk]) - 2} more'
+        order.item_summary = summary[:300]
+    Order.objects.bulk_update(orders, ['item_count', 'item_summary'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_stock_hold'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_summary',
+            field=models.CharField(blank=True, max_length=300),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_history_idx'),
+        ),
+        migrations.RunPython(backfill_item_summaries, migrations.RunPython.noop),
+    ]
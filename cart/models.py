@@ -1,35 +1,83 @@
 from django.db import models
+from django.db.models import DecimalField, F, Sum
 from django.contrib.auth.models import User
+from django.utils.functional import cached_property
 from store.models import Watch
+from decimal import Decimal, ROUND_HALF_UP
 import uuid
 
+TAX_RATE = Decimal('0.18')
+CENTS = Decimal('0.01')
+SUMMARY_LINES = 2
+
+
+class CartSummary:
+    def __init__(self, total_items=0, subtotal=Decimal('0')):
+        self.total_items = total_items
+        self.subtotal = subtotal.quantize(CENTS)
+        self.tax = (self.subtotal * TAX_RATE).quantize(CENTS, rounding=ROUND_HALF_UP)
+        self.total = self.subtotal + self.tax
+
+    @classmethod
+    def for_items(cls, items):
+        totals = items.aggregate(
+            total_items=Sum('quantity'),
+            subtotal=Sum(F('quantity') * F('watch__price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+        return cls(totals['total_items'] or 0, totals['subtotal'] or Decimal('0'))
+
+    @classmethod
+    def for_cart(cls, cart):
+        return cls.for_items(CartItem.objects.filter(cart=cart))
+
+    def as_json(self):
+        return {
+            'cart_count': self.total_items,
+            'subtotal': str(self.subtotal),
+            'tax': str(self.tax),
+            'total': str(self.total),
+        }
+
 
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
-    session_key = models.CharField(max_length=255, null=True, blank=True)
+    session_key = models.CharField(max_length=255, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], condition=models.Q(user__isnull=True), name='anonymous_cart_idx'),
+        ]
+
     def __str__(self):
         if self.user:
             return f"Cart - {self.user.username}"
         return f"Cart - {self.session_key}"
 
+    @cached_property
+    def summary(self):
+        return CartSummary.for_cart(self)
+
+    def refresh_summary(self):
+        self.__dict__.pop('summary', None)
+        return self.summary
+
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.summary.total_items
 
     @property
     def subtotal(self):
-        return sum(item.line_total for item in self.items.all())
+        return self.summary.subtotal
 
     @property
     def tax(self):
-        return round(float(self.subtotal) * 0.18, 2)
+        return self.summary.tax
 
     @property
     def total(self):
-        return round(float(self.subtotal) + self.tax, 2)
+        return self.summary.total
 
 
 class CartItem(models.Model):
@@ -48,6 +96,24 @@ class CartItem(models.Model):
         return self.watch.price * self.quantity
 
 
+class StockHold(models.Model):
+    """
+    A time-limited claim on stock for one cart line. The total held per watch is
+    mirrored in Watch.reserved by cart.reservations, so availability never has
+    to be computed from this table.
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='holds')
+    watch = models.ForeignKey(Watch, on_delete=models.CASCADE, related_name='holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('cart', 'watch')
+
+    def __str__(self):
+        return f"{self.quantity}x {self.watch_id} until {self.expires_at:%H:%M}"
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -73,6 +139,10 @@ class Order(models.Model):
     tax = models.DecimalField(max_digits=12, decimal_places=2)
     total = models.DecimalField(max_digits=12, decimal_places=2)
 
+    # Written at checkout so order lists never have to load OrderItem rows
+    item_count = models.PositiveIntegerField(default=0)
+    item_summary = models.CharField(max_length=300, blank=True)
+
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=50, default='cod')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -80,10 +150,20 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='order_history_idx')]
 
     def __str__(self):
         return self.order_number
 
+    @staticmethod
+    def summarize(lines):
+        """[('Rolex Submariner', 2), ...] -> 'Rolex Submariner × 2, ... and 3 more'"""
+        lines = list(lines)
+        summary = ', '.join(f'{label} × {quantity}' for label, quantity in lines[:SUMMARY_LINES])
+        if len(lines) > SUMMARY_LINES:
+            summary += f' and {len(lines) - SUMMARY_LINES} more'
+        return summary[:300]
+
     def save(self, *args, **kwargs):
         if not self.order_number:
             self.order_number = f"LW-{uuid.uuid4().hex[:8].upper()}"
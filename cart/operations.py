@@ -0,0 +1,87 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from store.models import Watch
+from .models import CartItem
+from .reservations import hold
+
+MAX_OPERATIONS = 50
+
+
+class InvalidOperations(ValueError):
+    pass
+
+
+def _int(value, name):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise InvalidOperations(f'{name} must be an integer.')
+    return value
+
+
+def parse_operations(payload):
+    """
+    Validate ``[{'watch_id': 1, 'quantity': 2}, {'watch_id': 3, 'delta': -1}, ...]``
+    into ``{watch_id: ('set' | 'add', value)}``. Several operations on the same
+    watch fold into one, in order.
+    """
+    if not isinstance(payload, list) or not payload:
+        raise InvalidOperations('Expected a non-empty list of operations.')
+    if len(payload) > MAX_OPERATIONS:
+        raise InvalidOperations(f'At most {MAX_OPERATIONS} operations per request.')
+
+    operations = {}
+    for op in payload:
+        if not isinstance(op, dict) or ('quantity' in op) == ('delta' in op):
+            raise InvalidOperations('Each operation needs a watch_id and either quantity or delta.')
+        watch_id = _int(op.get('watch_id'), 'watch_id')
+        if 'quantity' in op:
+            quantity = _int(op['quantity'], 'quantity')
+            if quantity < 0:
+                raise InvalidOperations('quantity cannot be negative.')
+            operations[watch_id] = ('set', quantity)
+        else:
+            mode, value = operations.get(watch_id, ('add', 0))
+            value += _int(op['delta'], 'delta')
+            # A delta on a set quantity stops at zero, as an UPDATE of quantity + delta does
+            operations[watch_id] = (mode, max(value, 0) if mode == 'set' else value)
+    return operations
+
+
+def apply_operations(cart, operations):
+    """
+    Apply parsed operations to the cart in one transaction and return the
+    resulting ``{watch_id: quantity}`` for the watches touched (0 = removed).
+
+    Each line is written with an UPDATE computed in the database
+    (quantity = quantity + delta), falling back to an INSERT for new lines, so
+    concurrent requests on the same cart add up instead of overwriting each
+    other. Stock holds are then set to the final quantities; if any of them
+    cannot be met the whole batch is rolled back.
+    """
+    with transaction.atomic():
+        watches = Watch.objects.select_related('brand').in_bulk(list(operations))
+        for watch_id, (mode, value) in operations.items():
+            watch = watches.get(watch_id)
+            if watch is None or (not watch.is_active and value > 0):
+                raise InvalidOperations(f'Watch {watch_id} is not available.')
+
+            lines = CartItem.objects.filter(cart=cart, watch_id=watch_id)
+            quantity = Value(value) if mode == 'set' else Greatest(F('quantity') + value, Value(0))
+            if lines.update(quantity=quantity) or value <= 0:
+                continue
+            try:
+                with transaction.atomic():
+                    CartItem.objects.create(cart=cart, watch=watch, quantity=value)
+            except IntegrityError:
+                # A concurrent request inserted the line first
+                lines.update(quantity=quantity)
+
+        quantities = dict(
+            CartItem.objects.filter(cart=cart, watch_id__in=operations).values_list('watch_id', 'quantity')
+        )
+        for watch_id in operations:
+            hold(cart, watches[watch_id], quantities.get(watch_id, 0))
+        emptied = [watch_id for watch_id, quantity in quantities.items() if quantity == 0]
+        if emptied:
+            CartItem.objects.filter(cart=cart, watch_id__in=emptied).delete()
+    return {watch_id: quantities.get(watch_id, 0) for watch_id in operations}
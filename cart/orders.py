@@ -0,0 +1,93 @@
+from django.db import transaction
+from django.db.models import F, Value
+from store.models import Watch
+from .models import CartItem, CartSummary, Order, OrderItem, StockHold
+from .reservations import per_watch
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    def __init__(self):
+        super().__init__('Your cart is empty.')
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, lines):
+        self.lines = lines
+        names = ', '.join(f'{line.watch.brand.name} {line.watch.name}' for line in lines)
+        super().__init__(f'Not enough stock left for: {names}.')
+
+
+def place_order(cart, user, address):
+    """
+    Turn the cart into an order in one transaction. Stock for every line is
+    decremented by a single conditional UPDATE, so concurrent checkouts can
+    never oversell; if any line falls short, nothing is written. Units this
+    cart holds are converted into the sale, while units other carts hold are
+    off limits.
+    """
+    lines = []
+    try:
+        with transaction.atomic():
+            lines = list(cart.items.select_related('watch', 'watch__brand').order_by('watch_id'))
+            if not lines:
+                raise EmptyCart()
+
+            holds = StockHold.objects.filter(cart=cart)
+            quantity = per_watch({line.watch_id: line.quantity for line in lines})
+            held = per_watch(dict(holds.values_list('watch_id', 'quantity')), default=Value(0))
+            decremented = Watch.objects.filter(
+                pk__in=[line.watch_id for line in lines], stock__gte=F('reserved') - held + quantity,
+            ).update(stock=F('stock') - quantity, reserved=F('reserved') - held)
+            if decremented != len(lines):
+                raise OutOfStock([])
+            holds.delete()
+
+            summary = CartSummary(
+                sum(line.quantity for line in lines),
+                sum(line.watch.price * line.quantity for line in lines),
+            )
+            order = Order.objects.create(
+                user=user,
+                full_name=address.full_name,
+                email=user.email,
+                phone=address.phone,
+                address_line1=address.address_line1,
+                address_line2=address.address_line2,
+                city=address.city,
+                state=address.state,
+                postal_code=address.postal_code,
+                country=address.country,
+                subtotal=summary.subtotal,
+                tax=summary.tax,
+                total=summary.total,
+                item_count=summary.total_items,
+                item_summary=Order.summarize(
+                    (f'{line.watch.brand.name} {line.watch.name}', line.quantity) for line in lines
+                ),
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    watch=line.watch,
+                    watch_name=f"{line.watch.brand.name} {line.watch.name}",
+                    watch_brand=line.watch.brand.name,
+                    price=line.watch.price,
+                    quantity=line.quantity,
+                )
+                for line in lines
+            ])
+            CartItem.objects.filter(cart=cart).delete()
+    except OutOfStock:
+        # The transaction has rolled back; report which lines were short
+        held = dict(StockHold.objects.filter(cart=cart).values_list('watch_id', 'quantity'))
+        watches = Watch.objects.filter(pk__in=[line.watch_id for line in lines]).in_bulk()
+        raise OutOfStock([
+            line for line in lines
+            if line.watch_id not in watches
+            or watches[line.watch_id].available_stock + held.get(line.watch_id, 0) < line.quantity
+        ])
+    return order
@@ -0,0 +1,126 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from store.models import Watch
+from .models import StockHold
+
+HOLD_TTL = timedelta(minutes=15)
+SWEEP_BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+    def __init__(self, watch, available):
+        self.watch = watch
+        self.available = available
+        if available:
+            message = f'Only {available} of the {watch} can be reserved right now.'
+        else:
+            message = f'The {watch} is currently reserved by other shoppers.'
+        super().__init__(message)
+
+
+def per_watch(quantities, default=None):
+    """CASE expression mapping watch pk -> quantity, for multi-row UPDATEs."""
+    return Case(
+        *[When(pk=watch_id, then=Value(quantity)) for watch_id, quantity in quantities.items()],
+        default=default,
+        output_field=IntegerField(),
+    )
+
+
+def _take(watch_id, quantity):
+    return Watch.objects.filter(pk=watch_id, stock__gte=F('reserved') + quantity).update(
+        reserved=F('reserved') + quantity,
+    ) == 1
+
+
+def _release(holds):
+    """Delete (pk, watch_id, quantity) holds and give their units back."""
+    if not holds:
+        return
+    totals = Counter()
+    for _, watch_id, quantity in holds:
+        totals[watch_id] += quantity
+    Watch.objects.filter(pk__in=totals).update(reserved=F('reserved') - per_watch(totals))
+    StockHold.objects.filter(pk__in=[pk for pk, _, _ in holds]).delete()
+
+
+def _expired(now=None):
+    return StockHold.objects.filter(expires_at__lte=now or timezone.now()).order_by('expires_at')
+
+
+def hold(cart, watch, quantity):
+    """
+    Set the cart's hold on ``watch`` to ``quantity`` units and push its expiry
+    out by HOLD_TTL. Growing a hold claims only the extra units, with a single
+    conditional UPDATE on the watch row, so two carts can never hold the same
+    unit. Raises InsufficientStock if the extra units are not available.
+    """
+    with transaction.atomic():
+        holds = StockHold.objects.filter(cart=cart, watch=watch)
+        existing = holds.values_list('quantity', flat=True).first()
+        current = existing or 0
+        extra = quantity - current
+        if extra > 0 and not _take(watch.pk, extra):
+            # Under contention, free anything other carts let lapse before giving up
+            lapsed = list(_expired().filter(watch=watch).exclude(cart=cart).values_list('pk', 'watch_id', 'quantity'))
+            _release(lapsed)
+            if not (lapsed and _take(watch.pk, extra)):
+                watch.refresh_from_db(fields=['stock', 'reserved'])
+                raise InsufficientStock(watch, watch.available_stock + current)
+        elif extra < 0:
+            Watch.objects.filter(pk=watch.pk).update(reserved=F('reserved') + extra)
+
+        expires_at = timezone.now() + HOLD_TTL
+        if quantity <= 0:
+            holds.delete()
+        elif existing is None:
+            StockHold.objects.create(cart=cart, watch=watch, quantity=quantity, expires_at=expires_at)
+        else:
+            holds.update(quantity=quantity, expires_at=expires_at)
+
+
+def hold_cart(cart):
+    """
+    Reserve every line in the cart for another HOLD_TTL, as checkout starts.
+    Lines whose hold already covers them are just extended; the rest are
+    re-held individually. Raises InsufficientStock for the first short line.
+    """
+    with transaction.atomic():
+        StockHold.objects.filter(cart=cart).update(expires_at=timezone.now() + HOLD_TTL)
+        held = dict(cart.holds.values_list('watch_id', 'quantity'))
+        for item in cart.items.select_related('watch', 'watch__brand'):
+            if held.get(item.watch_id) != item.quantity:
+                hold(cart, item.watch, item.quantity)
+
+
+def release(cart, watch_id=None):
+    holds = cart.holds.all()
+    if watch_id is not None:
+        holds = holds.filter(watch_id=watch_id)
+    with transaction.atomic():
+        _release(list(holds.values_list('pk', 'watch_id', 'quantity')))
+
+
+def release_carts(cart_ids):
+    with transaction.atomic():
+        _release(list(StockHold.objects.filter(cart_id__in=cart_ids).values_list('pk', 'watch_id', 'quantity')))
+
+
+def sweep_expired(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Release lapsed holds oldest first, batch_size at a time, each batch in its
+    own short transaction. Returns the number of holds released.
+    """
+    released = 0
+    now = timezone.now()
+    while True:
+        with transaction.atomic():
+            batch = list(_expired(now).select_for_update().values_list('pk', 'watch_id', 'quantity')[:batch_size])
+            _release(batch)
+        released += len(batch)
+        if len(batch) < batch_size:
+            return released
@@ -0,0 +1,25 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from .counts import forget_cart_count
+from .merge import CART_SESSION_KEY, merge_carts
+from .models import Cart
+from .reservations import release
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    # login() rotates the session key but keeps its data, so the anonymous
+    # cart is found through the id stored when it was created
+    if request is None or not hasattr(request, 'session'):
+        return
+    cart_id = request.session.pop(CART_SESSION_KEY, None)
+    if cart_id is not None and merge_carts(cart_id, user) is not None:
+        forget_cart_count(request)
+
+
+@receiver(pre_delete, sender=Cart)
+def release_deleted_cart(sender, instance, **kwargs):
+    # Holds cascade with the cart (a deleted user, the admin); give their units back first
+    release(instance)
@@ -7,6 +7,7 @@ urlpatterns = [
     path('', views.cart_view, name='cart'),
     path('add/<int:watch_id>/', views.add_to_cart, name='add_to_cart'),
     path('update/<int:item_id>/', views.update_cart, name='update_cart'),
+    path('update/', views.update_cart_batch, name='update_cart_batch'),
     path('remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('order/<str:order_number>/', views.order_confirmation, name='order_confirmation'),
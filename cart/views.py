@@ -1,12 +1,31 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
-from .models import Cart, CartItem, Order, OrderItem
+from .models import Cart, CartItem, CartSummary, Order
+from .counts import set_cart_count
+from .merge import CART_SESSION_KEY
+from .operations import InvalidOperations, apply_operations, parse_operations
+from .orders import CheckoutError, place_order
+from .reservations import InsufficientStock, hold_cart, release
 from store.models import Watch
+from store.pagination import InvalidCursor, KeysetPaginator
 from accounts.models import Address
-from decimal import Decimal
+
+ORDERS_PER_PAGE = 10
+
+
+def get_cart(request):
+    """The visitor's cart, or None if they have never added anything."""
+    if request.user.is_authenticated:
+        return Cart.objects.filter(user=request.user).first()
+    session_key = request.session.session_key
+    if not session_key:
+        return None
+    return Cart.objects.filter(session_key=session_key, user__isnull=True).first()
 
 
 def get_or_create_cart(request):
@@ -18,33 +37,49 @@ def get_or_create_cart(request):
             request.session.create()
             session_key = request.session.session_key
         cart, _ = Cart.objects.get_or_create(session_key=session_key)
+        if request.session.get(CART_SESSION_KEY) != cart.pk:
+            request.session[CART_SESSION_KEY] = cart.pk
     return cart
 
 
 def cart_view(request):
-    cart = get_or_create_cart(request)
-    items = cart.items.select_related('watch', 'watch__brand')
-    context = {'cart': cart, 'items': items}
+    cart = get_cart(request)
+    if cart is None:
+        items, summary = CartItem.objects.none(), CartSummary()
+    else:
+        items = cart.items.select_related('watch', 'watch__brand')
+        summary = cart.summary
+    set_cart_count(request, summary.total_items)
+    context = {'cart': cart, 'items': items, 'summary': summary}
     return render(request, 'cart/cart.html', context)
 
 
+def cart_error(request, error, redirect_to, status):
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': False, 'message': str(error)}, status=status)
+    messages.error(request, str(error))
+    return redirect(redirect_to)
+
+
 @require_POST
 def add_to_cart(request, watch_id):
     watch = get_object_or_404(Watch, pk=watch_id, is_active=True)
     cart = get_or_create_cart(request)
     quantity = int(request.POST.get('quantity', 1))
 
-    cart_item, created = CartItem.objects.get_or_create(cart=cart, watch=watch)
-    if not created:
-        cart_item.quantity += quantity
-    else:
-        cart_item.quantity = quantity
-    cart_item.save()
+    try:
+        apply_operations(cart, {watch.pk: ('add', quantity)})
+    except InvalidOperations as e:
+        return cart_error(request, e, watch.get_absolute_url(), status=400)
+    except InsufficientStock as e:
+        return cart_error(request, e, watch.get_absolute_url(), status=409)
+    cart_count = cart.summary.total_items
+    set_cart_count(request, cart_count)
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
-            'cart_count': cart.total_items,
+            'cart_count': cart_count,
             'message': f'{watch.name} added to cart!'
         })
     messages.success(request, f'{watch.brand.name} {watch.name} added to cart!')
@@ -53,40 +88,77 @@ def add_to_cart(request, watch_id):
 
 @require_POST
 def update_cart(request, item_id):
-    cart = get_or_create_cart(request)
-    item = get_object_or_404(CartItem, pk=item_id, cart=cart)
-    quantity = int(request.POST.get('quantity', 1))
-
-    if quantity <= 0:
-        item.delete()
-    else:
-        item.quantity = quantity
-        item.save()
+    cart = get_cart(request)
+    item = get_object_or_404(CartItem.objects.select_related('watch'), pk=item_id, cart=cart)
+    quantity = max(int(request.POST.get('quantity', 1)), 0)
+
+    try:
+        apply_operations(cart, {item.watch_id: ('set', quantity)})
+    except InvalidOperations as e:
+        # The watch was taken off sale after it went into the cart
+        return cart_error(request, e, 'cart:cart', status=400)
+    except InsufficientStock as e:
+        return cart_error(request, e, 'cart:cart', status=409)
+    summary = cart.summary
+    set_cart_count(request, summary.total_items)
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
             'success': True,
-            'cart_count': cart.total_items,
-            'subtotal': str(cart.subtotal),
-            'tax': str(cart.tax),
-            'total': str(cart.total),
-            'line_total': str(item.line_total) if quantity > 0 else '0',
+            **summary.as_json(),
+            'line_total': str(item.watch.price * quantity),
         })
     return redirect('cart:cart')
 
 
+@require_POST
+def update_cart_batch(request):
+    """
+    Apply several quantity changes in one round trip. The body is JSON:
+    ``{"operations": [{"watch_id": 1, "quantity": 2}, {"watch_id": 3, "delta": -1}]}``.
+    """
+    try:
+        operations = parse_operations(json.loads(request.body).get('operations'))
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    cart = get_or_create_cart(request) if any(value > 0 for _, value in operations.values()) else get_cart(request)
+    if cart is None:
+        return JsonResponse({'success': True, **CartSummary().as_json(), 'lines': {}})
+    try:
+        quantities = apply_operations(cart, operations)
+    except InvalidOperations as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except InsufficientStock as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=409)
+
+    prices = dict(Watch.objects.filter(pk__in=quantities).values_list('pk', 'price'))
+    summary = cart.summary
+    set_cart_count(request, summary.total_items)
+    return JsonResponse({
+        'success': True,
+        **summary.as_json(),
+        'lines': {
+            str(watch_id): {'quantity': quantity, 'line_total': str(prices[watch_id] * quantity)}
+            for watch_id, quantity in quantities.items()
+        },
+    })
+
+
 def remove_from_cart(request, item_id):
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
     item = get_object_or_404(CartItem, pk=item_id, cart=cart)
+    release(cart, item.watch_id)
     item.delete()
+    set_cart_count(request, cart.summary.total_items)
     messages.success(request, 'Item removed from cart.')
     return redirect('cart:cart')
 
 
 @login_required
 def checkout(request):
-    cart = get_or_create_cart(request)
-    items = cart.items.select_related('watch', 'watch__brand')
+    cart = get_cart(request)
+    items = cart.items.select_related('watch', 'watch__brand') if cart else CartItem.objects.none()
 
     if not items.exists():
         messages.warning(request, 'Your cart is empty.')
@@ -94,6 +166,13 @@ def checkout(request):
 
     addresses = Address.objects.filter(user=request.user)
 
+    if request.method == 'GET':
+        try:
+            hold_cart(cart)
+        except InsufficientStock as e:
+            messages.error(request, str(e))
+            return redirect('cart:cart')
+
     if request.method == 'POST':
         address_id = request.POST.get('address_id')
         if not address_id:
@@ -102,45 +181,20 @@ def checkout(request):
 
         address = get_object_or_404(Address, pk=address_id, user=request.user)
 
-        subtotal = cart.subtotal
-        tax = Decimal(str(cart.tax))
-        total = Decimal(str(cart.total))
-
-        order = Order.objects.create(
-            user=request.user,
-            full_name=address.full_name,
-            email=request.user.email,
-            phone=address.phone,
-            address_line1=address.address_line1,
-            address_line2=address.address_line2,
-            city=address.city,
-            state=address.state,
-            postal_code=address.postal_code,
-            country=address.country,
-            subtotal=subtotal,
-            tax=tax,
-            total=total,
-        )
-
-        for item in items:
-            OrderItem.objects.create(
-                order=order,
-                watch=item.watch,
-                watch_name=f"{item.watch.brand.name} {item.watch.name}",
-                watch_brand=item.watch.brand.name,
-                price=item.watch.price,
-                quantity=item.quantity,
-            )
-            item.watch.stock -= item.quantity
-            item.watch.save()
-
-        cart.items.all().delete()
+        try:
+            order = place_order(cart, request.user, address)
+        except CheckoutError as e:
+            messages.error(request, str(e))
+            return redirect('cart:cart')
+
+        set_cart_count(request, 0)
         messages.success(request, 'Order placed successfully!')
         return redirect('cart:order_confirmation', order_number=order.order_number)
 
     context = {
         'cart': cart,
         'items': items,
+        'summary': cart.summary,
         'addresses': addresses,
     }
     return render(request, 'cart/checkout.html', context)
@@ -148,17 +202,21 @@ def checkout(request):
 
 @login_required
 def order_confirmation(request, order_number):
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
+    order = get_object_or_404(Order.objects.prefetch_related('items'), order_number=order_number, user=request.user)
     return render(request, 'cart/order_confirm.html', {'order': order})
 
 
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user)
+    paginator = KeysetPaginator(Order.objects.filter(user=request.user), ('-created_at', '-pk'), ORDERS_PER_PAGE)
+    try:
+        orders = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        orders = paginator.page()
     return render(request, 'cart/order_history.html', {'orders': orders})
 
 
 @login_required
 def order_detail(request, order_number):
-    order = get_object_or_404(Order, order_number=order_number, user=request.user)
+    order = get_object_or_404(Order.objects.prefetch_related('items'), order_number=order_number, user=request.user)
     return render(request, 'cart/order_detail.html', {'order': order})
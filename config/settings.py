@@ -23,6 +23,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.metrics.MetricsMiddleware',
+    'store.profiler.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -36,7 +38,7 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'store.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -58,6 +60,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock at BEGIN so concurrent checkouts queue on the
+            # busy timeout instead of failing on a read-to-write lock upgrade.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+}
+
+# The catalog version counter and cached fragments live here; multi-process
+# deployments need a shared backend (Redis/Memcached) so a bump reaches every worker.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'luxwatch',
     }
 }
 
@@ -80,8 +97,35 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    # Uploads are stored once per distinct content under media/blobs/
+    'default': {'BACKEND': 'store.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+
+# /metrics accepts 'Authorization: Bearer <METRICS_TOKEN>' or a staff session
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Worker processes sharing this directory report combined counters
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 1.0
+# Snapshots not rewritten for this many seconds belong to dead (or long idle) workers and are dropped
+METRICS_SNAPSHOT_MAX_AGE = 3600
+
+# Queries slower than this many milliseconds are sampled to SLOW_QUERY_LOG; 0 disables sampling
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100') or 0) or None
+SLOW_QUERY_SAMPLE_RATE = 1.0
+SLOW_QUERY_LOG = BASE_DIR / 'logs' / 'slow_queries.jsonl'
+SLOW_QUERY_LOG_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+
+# Requests with a signed X-Profile token (manage.py profile_token) are profiled into PROFILE_DIR
+PROFILE_DIR = BASE_DIR / 'logs' / 'profiles'
+PROFILE_KEEP = 50
+PROFILE_INTERVAL = 0.001
+PROFILE_TOKEN_MAX_AGE = 60 * 60
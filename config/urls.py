@@ -1,15 +1,24 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
+from store.metrics import metrics_view
+from store.views import immutable_media, profile_download, profile_list
 
 urlpatterns = [
+    path('admin/profiles/', profile_list, name='profile_list'),
+    path('admin/profiles/<str:name>.<str:suffix>', profile_download, name='profile_download'),
     path('admin/', admin.site.urls),
     path('', include('store.urls')),
     path('accounts/', include('accounts.urls')),
     path('cart/', include('cart.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
+    # Content-addressed files get far-future caching; the web server should do the same in production
+    urlpatterns += [
+        re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>(?:blobs|derivatives)/.+)$', immutable_media),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
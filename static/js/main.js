@@ -28,8 +28,210 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 4000);
     });
 
-    // AJAX add to cart
-    document.querySelectorAll('.add-to-cart-form').forEach(form => {
+    // Forms inside cached fragments are rendered without a CSRF token, so no
+    // visitor's token is ever cached; give them this visitor's from the page.
+    const csrfMeta = document.querySelector('meta[name="csrf-token"]');
+    if (csrfMeta) {
+        document.querySelectorAll('form[method="POST"]').forEach(form => {
+            if (!form.querySelector('input[name="csrfmiddlewaretoken"]')) {
+                const input = document.createElement('input');
+                input.type = 'hidden';
+                input.name = 'csrfmiddlewaretoken';
+                input.value = csrfMeta.content;
+                form.appendChild(input);
+            }
+        });
+    }
+
+    bindAddToCart(document);
+
+    // Infinite scroll for paginated watch grids
+    const watchGrid = document.getElementById('watchGrid');
+    if (watchGrid && watchGrid.dataset.nextUrl && 'IntersectionObserver' in window) {
+        const pagination = document.querySelector('.pagination');
+        if (pagination) pagination.style.display = 'none';
+        const sentinel = document.createElement('div');
+        watchGrid.after(sentinel);
+        let loading = false;
+
+        const observer = new IntersectionObserver(entries => {
+            if (!entries[0].isIntersecting || loading || !watchGrid.dataset.nextUrl) return;
+            loading = true;
+            fetch(watchGrid.dataset.nextUrl, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(res => res.json())
+            .then(data => {
+                const holder = document.createElement('div');
+                holder.innerHTML = data.html;
+                bindAddToCart(holder);
+                watchGrid.append(...holder.children);
+                if (data.next_url) {
+                    watchGrid.dataset.nextUrl = data.next_url;
+                } else {
+                    delete watchGrid.dataset.nextUrl;
+                    observer.disconnect();
+                }
+                loading = false;
+            })
+            .catch(() => {
+                observer.disconnect();
+                if (pagination) pagination.style.display = '';
+            });
+        }, { rootMargin: '600px' });
+        observer.observe(sentinel);
+    }
+
+    // Cart quantity changes are collected for a moment and sent as one batch
+    const cartItems = document.querySelector('.cart-items[data-batch-url]');
+    if (cartItems) {
+        const pending = new Map();
+        let timer = null;
+        const money = value => '₹' + Math.round(Number(value)).toLocaleString('en-US');
+
+        const flush = () => {
+            const operations = [...pending].map(([watchId, quantity]) => ({ watch_id: Number(watchId), quantity }));
+            pending.clear();
+            fetch(cartItems.dataset.batchUrl, {
+                method: 'POST',
+                body: JSON.stringify({ operations }),
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': csrfMeta ? csrfMeta.content : '',
+                    'X-Requested-With': 'XMLHttpRequest'
+                }
+            })
+            .then(res => res.json())
+            .then(data => {
+                if (!data.success) {
+                    showToast(data.message, 'error');
+                    setTimeout(() => window.location.reload(), 1500);
+                    return;
+                }
+                if (data.cart_count === 0) return window.location.reload();
+                Object.entries(data.lines).forEach(([watchId, line]) => {
+                    const row = cartItems.querySelector(`.cart-item[data-watch-id="${watchId}"]`);
+                    if (!row) return;
+                    if (line.quantity === 0) return row.remove();
+                    row.querySelector('.qty-input').value = line.quantity;
+                    row.querySelector('.line-total').textContent = money(line.line_total);
+                });
+                document.getElementById('cartSubtotal').textContent = money(data.subtotal);
+                document.getElementById('cartTax').textContent = money(data.tax);
+                document.getElementById('cartTotal').textContent = money(data.total);
+                document.getElementById('cartItemCount').textContent =
+                    `${data.cart_count} item${data.cart_count === 1 ? '' : 's'} in your cart`;
+                const badge = document.getElementById('cartBadge');
+                if (badge) badge.textContent = data.cart_count;
+            })
+            .catch(() => window.location.reload());
+        };
+
+        const queue = input => {
+            const max = parseInt(input.max) || Infinity;
+            const quantity = Math.min(Math.max(parseInt(input.value) || 1, 1), max);
+            input.value = quantity;
+            pending.set(input.closest('.cart-item').dataset.watchId, quantity);
+            clearTimeout(timer);
+            timer = setTimeout(flush, 400);
+        };
+
+        cartItems.querySelectorAll('.qty-form').forEach(form => {
+            const input = form.querySelector('.qty-input');
+            form.querySelectorAll('.qty-btn').forEach(btn => {
+                btn.addEventListener('click', () => {
+                    input.value = (parseInt(input.value) || 1) + Number(btn.dataset.delta);
+                    queue(input);
+                });
+            });
+            input.addEventListener('change', () => queue(input));
+            form.addEventListener('submit', e => {
+                e.preventDefault();
+                queue(input);
+            });
+        });
+    }
+
+    // Search suggestions
+    const searchInput = document.getElementById('searchInput');
+    const suggestionBox = document.getElementById('searchSuggestions');
+    if (searchInput && suggestionBox) {
+        let timer = null;
+        let controller = null;
+
+        const closeSuggestions = () => {
+            suggestionBox.classList.remove('open');
+            suggestionBox.innerHTML = '';
+        };
+
+        searchInput.addEventListener('input', () => {
+            clearTimeout(timer);
+            const q = searchInput.value.trim();
+            if (!q) return closeSuggestions();
+            timer = setTimeout(() => {
+                if (controller) controller.abort();
+                controller = new AbortController();
+                const url = `${searchInput.dataset.suggestUrl}?q=${encodeURIComponent(q)}`;
+                fetch(url, { signal: controller.signal })
+                .then(res => res.json())
+                .then(data => {
+                    if (!data.suggestions.length) return closeSuggestions();
+                    suggestionBox.innerHTML = '';
+                    data.suggestions.forEach(s => {
+                        const link = document.createElement('a');
+                        link.href = s.url;
+                        const label = document.createElement('span');
+                        label.textContent = s.label;
+                        const type = document.createElement('span');
+                        type.className = 'suggestion-type';
+                        type.textContent = s.type;
+                        link.append(label, type);
+                        suggestionBox.appendChild(link);
+                    });
+                    suggestionBox.classList.add('open');
+                })
+                .catch(() => {});
+            }, 120);
+        });
+
+        searchInput.addEventListener('keydown', e => {
+            const links = [...suggestionBox.querySelectorAll('a')];
+            if (!links.length) return;
+            const current = links.findIndex(a => a.classList.contains('active'));
+            if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                e.preventDefault();
+                const next = e.key === 'ArrowDown' ? (current + 1) % links.length : (current - 1 + links.length) % links.length;
+                links.forEach(a => a.classList.remove('active'));
+                links[next].classList.add('active');
+            } else if (e.key === 'Enter' && current >= 0) {
+                e.preventDefault();
+                window.location.href = links[current].href;
+            } else if (e.key === 'Escape') {
+                closeSuggestions();
+            }
+        });
+
+        document.addEventListener('click', e => {
+            if (!suggestionBox.contains(e.target) && e.target !== searchInput) closeSuggestions();
+        });
+    }
+
+    // Payment option selection
+    document.querySelectorAll('.payment-option').forEach(opt => {
+        opt.addEventListener('click', function() {
+            document.querySelectorAll('.payment-option').forEach(o => o.classList.remove('selected'));
+            this.classList.add('selected');
+            this.querySelector('input').checked = true;
+        });
+    });
+});
+
+function csrfToken() {
+    const meta = document.querySelector('meta[name="csrf-token"]');
+    return meta ? meta.content : '';
+}
+
+// AJAX add to cart
+function bindAddToCart(root) {
+    root.querySelectorAll('.add-to-cart-form').forEach(form => {
         form.addEventListener('submit', function(e) {
             e.preventDefault();
             const url = this.action;
@@ -42,7 +244,7 @@ document.addEventListener('DOMContentLoaded', function() {
             fetch(url, {
                 method: 'POST',
                 body: formData,
-                headers: { 'X-Requested-With': 'XMLHttpRequest' }
+                headers: { 'X-CSRFToken': csrfToken(), 'X-Requested-With': 'XMLHttpRequest' }
             })
             .then(res => res.json())
             .then(data => {
@@ -77,6 +279,10 @@ document.addEventListener('DOMContentLoaded', function() {
                         btn.style.color = '';
                         btn.style.borderColor = '';
                     }, 2000);
+                } else {
+                    btn.innerHTML = originalHTML;
+                    btn.disabled = false;
+                    showToast(data.message, 'error');
                 }
             })
             .catch(() => {
@@ -86,22 +292,13 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         });
     });
-
-    // Payment option selection
-    document.querySelectorAll('.payment-option').forEach(opt => {
-        opt.addEventListener('click', function() {
-            document.querySelectorAll('.payment-option').forEach(o => o.classList.remove('selected'));
-            this.classList.add('selected');
-            this.querySelector('input').checked = true;
-        });
-    });
-});
+}
 
 // Toast notification
-function showToast(message) {
+function showToast(message, level = 'success') {
     const container = document.querySelector('.messages-container') || createToastContainer();
     const toast = document.createElement('div');
-    toast.className = 'message message-success';
+    toast.className = `message message-${level}`;
     toast.innerHTML = `<span>${message}</span><button class="message-close" onclick="this.parentElement.remove()"><i class="fas fa-times"></i></button>`;
     container.appendChild(toast);
     setTimeout(() => {
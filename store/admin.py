@@ -16,7 +16,7 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Watch)
 class WatchAdmin(admin.ModelAdmin):
-    list_display = ['name', 'brand', 'category', 'price', 'stock', 'is_featured', 'is_active']
+    list_display = ['name', 'brand', 'category', 'price', 'stock', 'avg_rating', 'review_count', 'is_featured', 'is_active']
     list_filter = ['brand', 'category', 'is_featured', 'is_new_arrival', 'is_bestseller', 'is_active']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name', 'brand__name', 'description']
@@ -0,0 +1,331 @@
+"""
+Hot-path benchmarks: the main views through the test client, the Cart summary
+properties and the store_tags filters, each timed over many iterations with
+its query count and peak Python memory, plus the orders/s of concurrent
+checkouts through place_order against the per-item loop it replaced. Run them
+with ``manage.py benchmark``.
+"""
+import itertools
+import math
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+
+from accounts.models import Address
+from cart.models import Cart, CartItem, Order, OrderItem
+from cart.orders import place_order
+from cart.reservations import per_watch
+from .models import Brand, Category, Watch
+from .templatetags import store_tags
+from .views import SORT_ORDERS
+
+# generate_catalog options per dataset size
+SIZES = {
+    'small': {'brands': 6, 'categories': 5, 'watches': 200, 'users': 50, 'reviews': 1_000,
+              'wishlists': 200, 'carts': 20, 'orders': 200},
+    'medium': {'brands': 20, 'categories': 8, 'watches': 2_000, 'users': 500, 'reviews': 10_000,
+               'wishlists': 2_000, 'carts': 200, 'orders': 2_000},
+    'large': {'brands': 50, 'categories': 12, 'watches': 20_000, 'users': 5_000, 'reviews': 100_000,
+              'wishlists': 20_000, 'carts': 2_000, 'orders': 20_000},
+}
+PREFIX = 'bench'
+USERNAME = 'bench_shopper'
+WARMUP = 2
+# p50 differences below this many milliseconds are treated as noise
+NOISE_MS = 0.5
+# Orders each shopper places, and watches per cart, in checkout_throughput()
+CHECKOUT_ORDERS = 10
+CHECKOUT_LINES = 4
+
+_checkout_runs = itertools.count()
+
+
+def populate(size, seed=42, stdout=None):
+    call_command(
+        'generate_catalog', f'--prefix={PREFIX}', f'--seed={seed}',
+        *[f'--{key}={value}' for key, value in size.items()], stdout=stdout,
+    )
+
+
+@contextmanager
+def throwaway_database(size, seed=42, stdout=None):
+    """
+    A populated file-backed test database for the duration of the block, so
+    timings reflect real SQLite I/O rather than :memory: and the development
+    database is never touched.
+    """
+    handle, path = tempfile.mkstemp(suffix='.sqlite3', prefix=f'benchmark-{size}-')
+    os.close(handle)
+    connection.settings_dict['TEST']['NAME'] = path
+    setup_test_environment(debug=False)
+    databases = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+    try:
+        populate(SIZES[size], seed, stdout=stdout)
+        yield
+    finally:
+        teardown_databases(databases, verbosity=0)
+        teardown_test_environment()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def measure(func, iterations, cold=False, setup=None):
+    """
+    Time ``func`` over ``iterations`` runs after a warm-up. Queries and memory
+    are measured on separate runs, so neither the debug cursor nor tracemalloc
+    inflates the timings. ``cold`` clears the cache before every run, and
+    ``setup``, if given, is called untimed before every run.
+    """
+    def prepare():
+        if setup is not None:
+            setup()
+        if cold:
+            cache.clear()
+
+    for _ in range(WARMUP):
+        prepare()
+        func()
+
+    prepare()
+    with CaptureQueriesContext(connection) as captured:
+        func()
+    # Read now: the next request resets the connection's query log
+    queries = len(captured)
+
+    prepare()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = []
+    for _ in range(iterations):
+        prepare()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'max_ms': round(timings[-1], 3),
+        'queries': queries,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def _get(client, url, expected=200, **params):
+    response = client.get(url, params)
+    if response.status_code != expected:
+        raise AssertionError(f'GET {url} {params} returned {response.status_code}, expected {expected}')
+    return response
+
+
+def cases():
+    """(name, callable, setup or None) against the current database, which must have been populated."""
+    watch = Watch.objects.filter(is_active=True, stock__gte=5, reviews__isnull=False).order_by('pk').first()
+    if watch is None:
+        raise ValueError('The database has no reviewed, in-stock watch; populate it first.')
+    brand = Brand.objects.filter(slug__startswith=f'{PREFIX}-').order_by('pk').first()
+    category = Category.objects.filter(slug__startswith=f'{PREFIX}-').order_by('pk').first()
+    query = watch.name.split()[0]
+
+    user = User.objects.filter(username=USERNAME).first() or User.objects.create_user(USERNAME, password='pw')
+    cart, _ = Cart.objects.get_or_create(user=user)
+    lines = list(Watch.objects.filter(is_active=True, stock__gte=F('reserved') + 5).order_by('pk')[:3])
+    for line in lines:
+        CartItem.objects.get_or_create(cart=cart, watch=line)
+    item = cart.items.order_by('pk').first()
+    address = user.addresses.first() or Address.objects.create(
+        user=user, full_name='Bench Shopper', phone='9800000000', address_line1='1 Bench Street',
+        city='Mumbai', state='Maharashtra', postal_code='400001',
+    )
+
+    anonymous = Client()
+    shopper = Client()
+    shopper.force_login(user)
+
+    watch_list = reverse('store:watch_list')
+    yield 'home', lambda: _get(anonymous, reverse('store:home')), None
+    for sort in SORT_ORDERS:
+        yield f'watch_list sort={sort}', lambda sort=sort: _get(anonymous, watch_list, sort=sort), None
+    yield 'watch_list brand', lambda: _get(anonymous, watch_list, brand=brand.slug), None
+    yield 'watch_list category', lambda: _get(anonymous, watch_list, category=category.slug), None
+    yield 'watch_list price', lambda: _get(anonymous, watch_list, min_price=100000, max_price=1000000), None
+    yield 'watch_detail', lambda: _get(anonymous, watch.get_absolute_url()), None
+    yield 'search', lambda: _get(anonymous, reverse('store:search'), q=query), None
+    yield 'cart_view', lambda: _get(shopper, reverse('cart:cart')), None
+
+    quantity = [1]
+
+    def update_cart():
+        # Alternate between 1 and 2 so every run really changes the line and its hold
+        quantity[0] = 3 - quantity[0]
+        response = shopper.post(reverse('cart:update_cart', args=[item.pk]), {'quantity': quantity[0]})
+        if response.status_code != 302:
+            raise AssertionError(f'update_cart returned {response.status_code}')
+    yield 'update_cart', update_cart, None
+    yield 'checkout', lambda: _get(shopper, reverse('cart:checkout')), None
+
+    def cart_properties():
+        cart.refresh_summary()
+        return cart.total_items, cart.subtotal, cart.tax, cart.total
+    yield 'Cart summary properties', cart_properties, None
+
+    stock = {line.pk: line.stock for line in lines}
+
+    def refill():
+        # Every order buys the same cart: put the lines back and return the stock the last one took
+        CartItem.objects.bulk_create([CartItem(cart=cart, watch_id=pk) for pk in stock], ignore_conflicts=True)
+        Watch.objects.filter(pk__in=stock).update(stock=per_watch(stock))
+
+    def checkout_post():
+        response = shopper.post(reverse('cart:checkout'), {'address_id': address.pk})
+        if response.status_code != 302 or response.url == reverse('cart:cart'):
+            raise AssertionError(f'checkout POST returned {response.status_code} to {response.get("Location")}')
+    yield 'checkout POST', checkout_post, refill
+
+    values = [0, 999, 45_000, 250_000, 3_250_000, 48_500_000, 'n/a', None]
+
+    def filters():
+        for value in values:
+            store_tags.currency_inr(value)
+            store_tags.star_range(4)
+            store_tags.empty_star_range(4)
+            store_tags.mul(value, 2)
+    yield 'store_tags filters', filters, None
+
+
+def per_item_checkout(cart, user, address):
+    """Checkout as the view did before cart.orders.place_order: a save() per line, outside a transaction."""
+    items = list(cart.items.select_related('watch', 'watch__brand'))
+    summary = cart.summary
+    order = Order.objects.create(
+        user=user, full_name=address.full_name, email=user.email, phone=address.phone,
+        address_line1=address.address_line1, address_line2=address.address_line2, city=address.city,
+        state=address.state, postal_code=address.postal_code, country=address.country,
+        subtotal=summary.subtotal, tax=summary.tax, total=summary.total,
+    )
+    for item in items:
+        OrderItem.objects.create(
+            order=order, watch=item.watch, watch_name=f'{item.watch.brand.name} {item.watch.name}',
+            watch_brand=item.watch.brand.name, price=item.watch.price, quantity=item.quantity,
+        )
+        item.watch.stock -= item.quantity
+        item.watch.save()
+    cart.items.all().delete()
+    return order
+
+
+def checkout_throughput(place, threads, orders=CHECKOUT_ORDERS, lines=CHECKOUT_LINES):
+    """
+    Orders per second with ``threads`` shoppers checking out at once through
+    ``place``, each refilling a cart of ``lines`` shared watches and placing
+    ``orders`` orders. Returns (orders/s, the watches), so callers can check
+    the stock that was sold.
+    """
+    run = next(_checkout_runs)
+    brand, _ = Brand.objects.get_or_create(name=f'{PREFIX} checkout', defaults={'slug': f'{PREFIX}-checkout'})
+    watches = [
+        Watch.objects.create(brand=brand, name=f'Checkout {run}-{i}', description='Checkout throughput.',
+                             price=100000 + i, stock=threads * orders)
+        for i in range(lines)
+    ]
+    shoppers = []
+    for i in range(threads):
+        user = User.objects.create_user(f'{PREFIX}_checkout_{run}_{i}', email=f'checkout{i}@example.com')
+        address = Address.objects.create(user=user, full_name='Checkout Shopper', phone='9800000000',
+                                         address_line1='1 Bench Street', city='Mumbai', state='Maharashtra',
+                                         postal_code='400001')
+        shoppers.append((Cart.objects.create(user=user), user, address))
+
+    barrier = threading.Barrier(threads + 1)
+
+    def shopper(cart, user, address):
+        try:
+            barrier.wait()
+            for _ in range(orders):
+                while True:
+                    try:
+                        CartItem.objects.bulk_create([CartItem(cart=cart, watch=watch) for watch in watches],
+                                                     ignore_conflicts=True)
+                        place(cart, user, address)
+                        break
+                    except DatabaseError:
+                        # Lock errors on the shared in-memory test database, and the per-item loop's
+                        # races on the search index; either way the order is tried again
+                        time.sleep(0.001)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=shopper, args=args) for args in shoppers]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return threads * orders / (time.perf_counter() - started), watches
+
+
+def throughput(threads):
+    """{checkout: orders/s} for place_order and the per-item loop it replaced, under the same threads."""
+    return {
+        name: round(checkout_throughput(place, threads)[0], 1)
+        for name, place in (('place_order', place_order), ('per-item save() loop', per_item_checkout))
+    }
+
+
+def run(iterations, cold=False, only=None):
+    """{case name: stats} for every case, or just those whose name contains ``only``."""
+    return {
+        name: measure(func, iterations, cold, setup)
+        for name, func, setup in cases() if only is None or only in name
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Regressions of ``results`` against ``baseline`` (both {size: {case: stats}}):
+    any extra query, or a p50 more than ``threshold`` (a fraction) slower.
+    """
+    regressions = []
+    for size, current in results.items():
+        for name, stats in current.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            if stats['queries'] > before['queries']:
+                regressions.append(f'{size} / {name}: {before["queries"]} -> {stats["queries"]} queries')
+            slower = stats['p50_ms'] - before['p50_ms']
+            if slower > NOISE_MS and stats['p50_ms'] > before['p50_ms'] * (1 + threshold):
+                regressions.append(
+                    f'{size} / {name}: p50 {before["p50_ms"]:.2f} -> {stats["p50_ms"]:.2f} ms '
+                    f'(+{slower / before["p50_ms"]:.0%})'
+                )
+    return regressions
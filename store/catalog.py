@@ -0,0 +1,26 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'catalog:version'
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a lost key never reuses an old version number
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+        return cache.get(VERSION_KEY)
+
+
+def versioned_key(*parts):
+    return ':'.join(['catalog', str(get_version()), *map(str, parts)])
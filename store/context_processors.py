@@ -1,7 +1,15 @@
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
 from .models import Category
 
+CATEGORIES_CACHE_KEY = 'nav:categories'
+
+
+def get_nav_categories():
+    return cache.get_or_set(CATEGORIES_CACHE_KEY, lambda: list(Category.objects.all()), None)
+
 
 def categories_processor(request):
     return {
-        'all_categories': Category.objects.all(),
+        'all_categories': SimpleLazyObject(get_nav_categories),
     }
@@ -0,0 +1,142 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .catalog import versioned_key
+from .models import Watch
+
+# Upper bounds of the price histogram buckets, in rupees; the last bucket is open-ended
+PRICE_BUCKETS = [
+    Decimal('500000'),
+    Decimal('1000000'),
+    Decimal('2500000'),
+    Decimal('5000000'),
+    Decimal('10000000'),
+]
+
+# Prices are stored to the paisa, so a bucket [lower, upper) is the range lower..upper - PRICE_STEP
+PRICE_STEP = Decimal('0.01')
+
+FACET_TIMEOUT = 60 * 60
+
+
+def parse_price(value):
+    try:
+        price = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return price if price.is_finite() and price >= 0 else None
+
+
+def get_cube():
+    """
+    Active watch counts grouped by (brand, category, price bucket). Every facet
+    for every filter combination whose price range is a run of whole buckets
+    can be derived from this one grouped query, and it only has to be
+    recomputed when the catalog version changes.
+    """
+    def build():
+        bucket = Case(
+            *[When(price__lt=upper, then=Value(i)) for i, upper in enumerate(PRICE_BUCKETS)],
+            default=Value(len(PRICE_BUCKETS)),
+            output_field=IntegerField(),
+        )
+        rows = (
+            Watch.objects.filter(is_active=True)
+            .order_by()
+            .annotate(bucket=bucket)
+            .values_list('brand_id', 'category_id', 'bucket')
+            .annotate(count=Count('id'))
+        )
+        return list(rows)
+    return cache.get_or_set(versioned_key('facets', 'cube'), build, FACET_TIMEOUT)
+
+
+def price_counts(min_price, max_price):
+    """(brand, category, count) for an arbitrary price range, straight from the database."""
+    watches = Watch.objects.filter(is_active=True)
+    if min_price is not None:
+        watches = watches.filter(price__gte=min_price)
+    if max_price is not None:
+        watches = watches.filter(price__lte=max_price)
+    return list(watches.order_by().values_list('brand_id', 'category_id').annotate(count=Count('id')))
+
+
+def bucket_span(min_price, max_price):
+    """
+    (first, last) bucket indexes when [min_price, max_price] covers exactly
+    those buckets, as the histogram links do; None for any other range.
+    """
+    lowers = [Decimal('0')] + PRICE_BUCKETS
+    if min_price is None:
+        first = 0
+    elif min_price in lowers:
+        first = lowers.index(min_price)
+    else:
+        return None
+    if max_price is None:
+        last = len(PRICE_BUCKETS)
+    elif max_price + PRICE_STEP in PRICE_BUCKETS:
+        last = PRICE_BUCKETS.index(max_price + PRICE_STEP)
+    else:
+        return None
+    return (first, last) if first <= last else None
+
+
+def price_buckets():
+    lower = Decimal('0')
+    buckets = []
+    for upper in PRICE_BUCKETS + [None]:
+        buckets.append({'min': lower, 'max': upper, 'max_price': upper - PRICE_STEP if upper else None})
+        lower = upper
+    return buckets
+
+
+def compute_facets(brand_id=None, category_id=None, min_price=None, max_price=None):
+    """
+    Counts for the sidebar. Each facet ignores its own filter so shoppers can
+    see how many watches the other options would give them.
+    """
+    brands, categories = {}, {}
+    histogram = [0] * (len(PRICE_BUCKETS) + 1)
+    total = 0
+
+    cube = get_cube()
+    span = bucket_span(min_price, max_price)
+    if span is None:
+        # A free-form range cuts through buckets, so the priced counts need the exact prices
+        priced = price_counts(min_price, max_price)
+    else:
+        priced = [(row_brand, row_category, count) for row_brand, row_category, bucket, count in cube
+                  if span[0] <= bucket <= span[1]]
+
+    for row_brand, row_category, count in priced:
+        brand_ok = brand_id is None or row_brand == brand_id
+        category_ok = category_id is None or row_category == category_id
+        if category_ok:
+            brands[row_brand] = brands.get(row_brand, 0) + count
+        if brand_ok and row_category is not None:
+            categories[row_category] = categories.get(row_category, 0) + count
+        if brand_ok and category_ok:
+            total += count
+
+    for row_brand, row_category, bucket, count in cube:
+        if (brand_id is None or row_brand == brand_id) and (category_id is None or row_category == category_id):
+            histogram[bucket] += count
+
+    buckets = price_buckets()
+    for bucket, count in zip(buckets, histogram):
+        bucket['count'] = count
+    return {'brands': brands, 'categories': categories, 'price': buckets, 'total': total}
+
+
+def get_facets(brand_id=None, category_id=None, min_price=None, max_price=None):
+    span = bucket_span(min_price, max_price)
+    if span is None:
+        # Not cached: free-form prices would make a new key for almost every request
+        return compute_facets(brand_id, category_id, min_price, max_price)
+    key = versioned_key('facets', brand_id, category_id, *span)
+    return cache.get_or_set(
+        key, lambda: compute_facets(brand_id, category_id, min_price, max_price), FACET_TIMEOUT,
+    )
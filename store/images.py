@@ -0,0 +1,249 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from PIL import Image, ImageFilter, ImageOps
+
+WIDTHS = (240, 480, 800)
+
+# Pillow format name, file extension, save options
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+# Catalog image fields, by model label: previews and blob references are tracked for these
+IMAGE_FIELDS = {
+    'store.Watch': ('image', 'image_2', 'image_3'),
+    'store.Brand': ('logo',),
+    'store.Category': ('image',),
+}
+PLACEHOLDER_WIDTH = 16
+PALETTE_SIZE = 6
+
+DERIVATIVES_DIR = 'derivatives'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_CHECK_INTERVAL = 5
+
+
+def derivatives_root():
+    return os.path.join(settings.MEDIA_ROOT, DERIVATIVES_DIR)
+
+
+def manifest_path():
+    return os.path.join(derivatives_root(), MANIFEST_NAME)
+
+
+def derivative_name(digest, width, fmt):
+    """Content-hashed path relative to MEDIA_ROOT, so the files never change once written."""
+    return f'{DERIVATIVES_DIR}/{digest[:2]}/{digest[:20]}-{width}.{FORMATS[fmt][1]}'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def target_widths(width):
+    """Every standard width narrower than the original, plus the original if it is narrower than the largest."""
+    widths = [w for w in WIDTHS if w < width]
+    if width <= WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+
+def derivatives_exist(entry):
+    return all(
+        os.path.exists(os.path.join(settings.MEDIA_ROOT, derivative_name(entry['hash'], w, fmt)))
+        for w in entry['widths'] for fmt in FORMATS
+    )
+
+
+def build_derivatives(name, previous=None):
+    """
+    Write every width/format of the MEDIA_ROOT-relative image ``name`` and
+    return its manifest entry. If the source hashes the same as ``previous``
+    and those files are all present, nothing is decoded. Runs in worker
+    processes, so it only touches the filesystem.
+    """
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    stat = os.stat(path)
+    digest = file_digest(path)
+    if previous and previous['hash'] == digest and derivatives_exist(previous):
+        return dict(previous, size=stat.st_size, mtime=stat.st_mtime_ns)
+    with Image.open(path) as source:
+        source = ImageOps.exif_transpose(source)
+        has_alpha = source.mode in ('RGBA', 'LA') or (source.mode == 'P' and 'transparency' in source.info)
+        source = source.convert('RGBA' if has_alpha else 'RGB')
+        width, height = source.size
+        widths = target_widths(width)
+        for w in widths:
+            resized = source if w == width else source.resize((w, round(height * w / width)), Image.LANCZOS)
+            for fmt, (pil_format, _, options) in FORMATS.items():
+                out = os.path.join(settings.MEDIA_ROOT, derivative_name(digest, w, fmt))
+                if os.path.exists(out):
+                    continue
+                os.makedirs(os.path.dirname(out), exist_ok=True)
+                image = resized
+                if pil_format == 'JPEG' and image.mode == 'RGBA':
+                    image = Image.new('RGB', image.size, 'white')
+                    image.paste(resized, mask=resized.getchannel('A'))
+                tmp = f'{out}.{os.getpid()}.tmp'
+                image.save(tmp, pil_format, **options)
+                os.replace(tmp, out)
+    return {
+        'hash': digest,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'width': width,
+        'height': height,
+        'widths': widths,
+    }
+
+
+def source_images():
+    """MEDIA_ROOT-relative paths of every original image, skipping derivatives."""
+    root = settings.MEDIA_ROOT
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.abspath(dirpath) == os.path.abspath(root):
+            dirnames[:] = [d for d in dirnames if d != DERIVATIVES_DIR]
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in SOURCE_EXTENSIONS:
+                yield os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, '/')
+
+
+def read_manifest():
+    try:
+        with open(manifest_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest):
+    os.makedirs(derivatives_root(), exist_ok=True)
+    tmp = f'{manifest_path()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, sort_keys=True, separators=(',', ':'))
+    os.replace(tmp, manifest_path())
+    reset_manifest_cache()
+
+
+_cache = {'manifest': {}, 'mtime': None, 'checked': 0.0, 'path': None}
+_cache_lock = threading.Lock()
+
+
+def get_manifest():
+    """The manifest, re-read only when the file has changed (checked at most every few seconds)."""
+    now = time.monotonic()
+    path = manifest_path()
+    if _cache['path'] == path and now - _cache['checked'] < MANIFEST_CHECK_INTERVAL:
+        return _cache['manifest']
+    with _cache_lock:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != _cache['mtime'] or _cache['path'] != path:
+            _cache['manifest'] = read_manifest() if mtime else {}
+            _cache['mtime'] = mtime
+            _cache['path'] = path
+        _cache['checked'] = now
+    return _cache['manifest']
+
+
+def reset_manifest_cache():
+    with _cache_lock:
+        _cache.update(manifest={}, mtime=None, checked=0.0, path=None)
+
+
+def srcsets(name):
+    """{'webp': 'url 240w, ...', 'jpeg': ..., 'fallback': url} for a stored image, or None if not built yet."""
+    entry = get_manifest().get(name)
+    if not entry:
+        return None
+    result = {}
+    for fmt in FORMATS:
+        result[fmt] = ', '.join(
+            f'{settings.MEDIA_URL}{derivative_name(entry["hash"], w, fmt)} {w}w' for w in entry['widths']
+        )
+    result['fallback'] = f'{settings.MEDIA_URL}{derivative_name(entry["hash"], entry["widths"][-1], "jpeg")}'
+    result['width'] = entry['width']
+    result['height'] = entry['height']
+    return result
+
+
+def compute_preview(fileobj):
+    """
+    A blurred ~16px WebP as a data URI, small enough to inline in every card,
+    and the most common colour of a reduced palette.
+    """
+    with Image.open(fileobj) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode in ('RGBA', 'LA', 'P'):
+            rgba = source.convert('RGBA')
+            source = Image.new('RGB', rgba.size, 'white')
+            source.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            source = source.convert('RGB')
+        source.thumbnail((64, 64))
+
+    palette = source.quantize(colors=PALETTE_SIZE)
+    _, index = max(palette.getcolors())
+    r, g, b = palette.getpalette()[index * 3:index * 3 + 3]
+
+    width, height = source.size
+    tiny = source.resize((PLACEHOLDER_WIDTH, max(1, round(height * PLACEHOLDER_WIDTH / width))), Image.BILINEAR)
+    buffer = io.BytesIO()
+    tiny.filter(ImageFilter.GaussianBlur(1)).save(buffer, 'WEBP', quality=40)
+    return {
+        'color': f'#{r:02x}{g:02x}{b:02x}',
+        'placeholder': 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode(),
+    }
+
+
+def refresh_previews(instance, force=False):
+    """
+    Recompute previews for image fields whose file has changed since the
+    stored preview was made. Returns True if ``instance.image_previews`` was
+    modified. Missing or unreadable files just drop their preview.
+    """
+    previews = dict(instance.image_previews or {})
+    changed = False
+    for name in IMAGE_FIELDS.get(instance._meta.label, ()):
+        fieldfile = getattr(instance, name)
+        if not fieldfile:
+            changed |= previews.pop(name, None) is not None
+            continue
+        if not force and previews.get(name, {}).get('source') == fieldfile.name:
+            continue
+        try:
+            with fieldfile.open('rb') as f:
+                preview = compute_preview(f)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            changed |= previews.pop(name, None) is not None
+            continue
+        previews[name] = {'source': fieldfile.name, **preview}
+        changed = True
+    if changed:
+        instance.image_previews = previews
+    return changed
+
+
+def preview_for(fieldfile):
+    instance = getattr(fieldfile, 'instance', None)
+    previews = getattr(instance, 'image_previews', None) or {}
+    preview = previews.get(fieldfile.field.name)
+    if preview and preview.get('source') == fieldfile.name:
+        return preview
+    return None
@@ -0,0 +1,316 @@
+"""
+An in-process load generator: shopper journeys run against the WSGI
+application from many threads (optionally in several forked processes), each
+journey with its own cookie jar, so sessions, CSRF and carts behave as they
+would behind a real server. Used by ``manage.py loadtest``.
+"""
+import logging
+import multiprocessing
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from importlib import import_module
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.signals import got_request_exception
+from django.db import connection, connections
+from django.dispatch import receiver
+from django.urls import Resolver404, resolve
+
+from accounts.models import Address
+from .benchmarks import percentile
+from .models import Brand, Watch
+from .views import SORT_ORDERS
+
+SHOPPER_PREFIX = 'load_shopper'
+# 'database is locked', or 'database table is locked' on shared-cache databases
+LOCKED = 'is locked'
+# A BEGIN that takes longer than this was waiting for another writer
+LOCK_WAIT_MS = 1.0
+
+_local = threading.local()
+
+
+@receiver(got_request_exception)
+def _remember_exception(sender, **kwargs):
+    # The handler turns exceptions into 500s; keep the cause for the report
+    if getattr(_local, 'recording', False):
+        _local.exception = sys.exc_info()[1]
+
+
+class _RememberLoggedException(logging.Handler):
+    """Keeps exceptions Django answers with a 4xx and only logs, such as SessionInterrupted after a locked session save."""
+
+    def emit(self, record):
+        if getattr(_local, 'recording', False) and record.exc_info and _local.exception is None:
+            _local.exception = record.exc_info[1]
+
+
+_request_logger = logging.getLogger('django.request')
+_logged_exceptions = _RememberLoggedException()
+
+
+def _is_locked(exc):
+    """Whether ``exc`` or anything in its cause chain is a lock error."""
+    while exc is not None:
+        if LOCKED in str(exc):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def _time_begin(execute, sql, params, many, context):
+    if not sql.startswith('BEGIN'):
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _local.lock_wait += (time.perf_counter() - started) * 1000
+
+
+class Session:
+    """One visitor's cookie jar, sending requests straight to the WSGI app."""
+
+    def __init__(self, app, samples, cookies=None):
+        self.app = app
+        self.samples = samples
+        self.cookies = SimpleCookie(cookies or {})
+
+    def request(self, method, path, data=None, ajax=False):
+        url = urlsplit(path)
+        body = urlencode(data or {}).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'localhost',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'HTTP_COOKIE': '; '.join(f'{key}={morsel.value}' for key, morsel in self.cookies.items()),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if 'csrftoken' in self.cookies:
+            environ['HTTP_X_CSRFTOKEN'] = self.cookies['csrftoken'].value
+        if ajax:
+            environ['HTTP_X_REQUESTED_WITH'] = 'XMLHttpRequest'
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = headers
+
+        # Attached here rather than at import: configuring logging drops handlers from django.request
+        if _logged_exceptions not in _request_logger.handlers:
+            _request_logger.addHandler(_logged_exceptions)
+        _local.exception, _local.lock_wait, _local.recording = None, 0.0, True
+        started = time.perf_counter()
+        result = self.app(environ, start_response)
+        try:
+            b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        elapsed = (time.perf_counter() - started) * 1000
+        _local.recording = False
+
+        for name, value in response['headers']:
+            if name.lower() == 'set-cookie':
+                jar = SimpleCookie(value)
+                for key, morsel in jar.items():
+                    if morsel['max-age'] == '0' or morsel.value == '':
+                        self.cookies.pop(key, None)
+                    else:
+                        self.cookies[key] = morsel.value
+
+        status = response['status']
+        error = None
+        if _local.exception is not None:
+            error = 'locked' if _is_locked(_local.exception) else type(_local.exception).__name__
+        elif status >= 400:
+            error = f'HTTP {status}'
+        try:
+            name = resolve(url.path).view_name
+        except Resolver404:
+            name = url.path
+        self.samples.append((name, elapsed, error, _local.lock_wait))
+        return status, dict(response['headers'])
+
+
+class Catalog:
+    """What journeys pick from, loaded once before the run."""
+
+    def __init__(self):
+        self.brands = list(Brand.objects.values_list('slug', flat=True))
+        self.watches = list(
+            Watch.objects.filter(is_active=True, stock__gt=0).values_list('pk', 'slug', 'name')
+        )
+        if not self.watches:
+            raise ValueError('No active watches in stock to shop for.')
+        self.terms = sorted({word for _, _, name in self.watches for word in name.split() if word.isalpha()})
+
+
+def prepare_shoppers(count):
+    """One user with a delivery address per concurrent worker, so carts are never shared."""
+    shoppers = []
+    for i in range(count):
+        user, created = User.objects.get_or_create(username=f'{SHOPPER_PREFIX}{i}')
+        if created:
+            user.set_unusable_password()
+            user.save(update_fields=['password'])
+        address = Address.objects.filter(user=user).first() or Address.objects.create(
+            user=user, full_name=f'Shopper {i}', phone='9800000000', address_line1='1 Load Street',
+            city='Mumbai', state='Maharashtra', postal_code='400001', is_default=True,
+        )
+        shoppers.append({'user_id': user.pk, 'auth_hash': user.get_session_auth_hash(), 'address_id': address.pk})
+    return shoppers
+
+
+def login_cookies(shopper):
+    """A fresh authenticated session for the shopper, without going through password hashing."""
+    store = import_module(settings.SESSION_ENGINE).SessionStore()
+    store[SESSION_KEY] = str(shopper['user_id'])
+    store[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    store[HASH_SESSION_KEY] = shopper['auth_hash']
+    store.save()
+    return {settings.SESSION_COOKIE_NAME: store.session_key}
+
+
+def browse(session, rng, catalog):
+    session.request('GET', '/')
+    params = {'sort': rng.choice(list(SORT_ORDERS))}
+    if catalog.brands and rng.random() < 0.5:
+        params['brand'] = rng.choice(catalog.brands)
+    session.request('GET', f'/watches/?{urlencode(params)}')
+    watch_id, slug, _ = rng.choice(catalog.watches)
+    session.request('GET', f'/watches/{slug}/')
+    if catalog.terms:
+        session.request('GET', f'/search/?{urlencode({"q": rng.choice(catalog.terms)})}')
+    session.request('POST', f'/cart/add/{watch_id}/', {'quantity': 1}, ajax=True)
+    session.request('GET', '/cart/')
+
+
+def purchase(session, rng, catalog, shopper):
+    browse(session, rng, catalog)
+    session.request('GET', '/cart/checkout/')
+    session.request('POST', '/cart/checkout/', {'address_id': shopper['address_id']})
+
+
+def worker(app, catalog, shopper, seed, deadline, journeys, checkout_ratio):
+    """Run journeys back to back on this thread; returns (samples, journeys completed)."""
+    rng = random.Random(seed)
+    samples = []
+    done = 0
+    _local.lock_wait, _local.recording = 0.0, False
+    with connection.execute_wrapper(_time_begin):
+        try:
+            while (journeys is None or done < journeys) and (deadline is None or time.monotonic() < deadline):
+                if rng.random() < checkout_ratio:
+                    purchase(Session(app, samples, login_cookies(shopper)), rng, catalog, shopper)
+                else:
+                    browse(Session(app, samples), rng, catalog)
+                done += 1
+        finally:
+            connection.close()
+    return samples, done
+
+
+def run_threads(app, catalog, shoppers, seed, threads, duration, journeys, checkout_ratio):
+    deadline = time.monotonic() + duration if duration else None
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [
+            pool.submit(worker, app, catalog, shoppers[i], seed + i, deadline, journeys, checkout_ratio)
+            for i in range(threads)
+        ]
+        results = [future.result() for future in futures]
+    return [sample for samples, _ in results for sample in samples], sum(done for _, done in results)
+
+
+def _process_main(index, catalog, shoppers, seed, threads, duration, journeys, checkout_ratio):
+    # The parent closed its connections before forking; start clean regardless
+    connections.close_all()
+    from config.wsgi import application
+    return run_threads(application, catalog, shoppers[index * threads:(index + 1) * threads],
+                       seed + index * 1000, threads, duration, journeys, checkout_ratio)
+
+
+def run(threads=8, processes=1, duration=10.0, journeys=None, seed=1, checkout_ratio=0.3):
+    """Drive the site and return a report dict; ``journeys`` (per thread) overrides ``duration``."""
+    from config.wsgi import application
+
+    catalog = Catalog()
+    shoppers = prepare_shoppers(threads * processes)
+    if journeys:
+        duration = None
+    started = time.perf_counter()
+    if processes <= 1:
+        samples, completed = run_threads(application, catalog, shoppers, seed, threads, duration, journeys,
+                                         checkout_ratio)
+    else:
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+            futures = [
+                pool.submit(_process_main, i, catalog, shoppers, seed, threads, duration, journeys, checkout_ratio)
+                for i in range(processes)
+            ]
+            results = [future.result() for future in futures]
+        samples = [sample for process_samples, _ in results for sample in process_samples]
+        completed = sum(done for _, done in results)
+    return summarize(samples, completed, time.perf_counter() - started, threads * processes)
+
+
+def summarize(samples, journeys, elapsed, concurrency):
+    by_url = defaultdict(list)
+    for sample in samples:
+        by_url[sample[0]].append(sample)
+
+    urls = {}
+    for name, rows in sorted(by_url.items()):
+        timings = sorted(row[1] for row in rows)
+        urls[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[2]),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'lock_wait_ms': round(sum(row[3] for row in rows), 1),
+        }
+
+    errors = defaultdict(int)
+    for sample in samples:
+        if sample[2]:
+            errors[sample[2]] += 1
+    lock_waits = sorted(sample[3] for sample in samples if sample[3] > LOCK_WAIT_MS)
+    return {
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 2),
+        'journeys': journeys,
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+        'error_rate': round(sum(errors.values()) / len(samples), 4) if samples else 0,
+        'errors': dict(errors),
+        'locked_errors': errors.get('locked', 0),
+        'lock_waits': len(lock_waits),
+        'lock_wait_p95_ms': round(percentile(lock_waits, 95), 2) if lock_waits else 0,
+        'urls': urls,
+    }
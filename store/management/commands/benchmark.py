@@ -0,0 +1,99 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from store import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Times the hot views, Cart properties and template filters against generated datasets '
+            'in a throwaway database, and compares the results with a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='small', help=f'Comma-separated: {", ".join(benchmarks.SIZES)}')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every timed run')
+        parser.add_argument('--only', help='Run only the cases whose name contains this')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Results JSON from an earlier run to compare against')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed p50 slowdown against the baseline, as a fraction')
+        parser.add_argument('--checkout-threads', type=int, default=8,
+                            help='Shoppers checking out at once in the checkout throughput comparison (0 skips it)')
+
+    def handle(self, *args, **options):
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()]
+        unknown = set(sizes) - benchmarks.SIZES.keys()
+        if unknown:
+            raise CommandError(f'Unknown sizes: {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Cannot read baseline {options["baseline"]}: {e}')
+
+        results = {}
+        throughput = {}
+        for size in sizes:
+            self.stdout.write(f'Generating the {size} dataset...')
+            results[size], throughput[size] = self.run_size(size, options)
+            self.print_table(size, results[size], throughput[size], options['checkout_threads'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'created_at': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'iterations': options['iterations'],
+                    'cold': options['cold'],
+                    'seed': options['seed'],
+                    'checkout_threads': options['checkout_threads'],
+                    'results': results,
+                    'throughput': throughput,
+                }, f, indent=2)
+            self.stdout.write(f'Wrote {options["output"]}')
+
+        # The bulk checkout has to beat the per-item loop it replaced, baseline or not
+        slower = [
+            f'{size} / checkout: place_order {rates["place_order"]} orders/s, '
+            f'per-item save() loop {rates["per-item save() loop"]} orders/s'
+            for size, rates in throughput.items()
+            if rates and rates['place_order'] <= rates['per-item save() loop']
+        ]
+        for line in slower:
+            self.stderr.write(f'  {line}')
+        if baseline is not None:
+            regressions = benchmarks.compare(results, baseline, options['threshold'])
+            if regressions:
+                for line in regressions:
+                    self.stderr.write(f'  {line}')
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
+        if slower:
+            raise CommandError('place_order is not faster than the per-item checkout loop.')
+
+    def run_size(self, size, options):
+        with benchmarks.throwaway_database(size, options['seed'], stdout=self.stdout):
+            results = benchmarks.run(options['iterations'], options['cold'], options['only'])
+            threads = options['checkout_threads']
+            return results, benchmarks.throughput(threads) if threads > 0 else {}
+
+    def print_table(self, size, results, throughput, threads):
+        self.stdout.write(f'\n{size}:')
+        self.stdout.write(f'  {"case":32} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak KiB":>9}')
+        for name, stats in results.items():
+            self.stdout.write(
+                f'  {name:32} {stats["p50_ms"]:9.2f} {stats["p95_ms"]:9.2f} {stats["p99_ms"]:9.2f} '
+                f'{stats["queries"]:8} {stats["peak_kib"]:9.1f}'
+            )
+        if throughput:
+            self.stdout.write(f'\n  checkout throughput, {threads} threads:')
+            for name, rate in throughput.items():
+                self.stdout.write(f'  {name:32} {rate:9.1f} orders/s')
+        self.stdout.write('')
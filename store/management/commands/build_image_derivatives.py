@@ -0,0 +1,92 @@
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from store import images
+from store.catalog import bump_version
+
+
+class Command(BaseCommand):
+    help = 'Builds resized WebP/JPEG derivatives for every image under MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 1 builds in this process')
+        parser.add_argument('--force', action='store_true', help='Rebuild even if the source is unchanged')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete derivatives no longer referenced by the manifest')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        previous = {} if options['force'] else images.read_manifest()
+        manifest, jobs, unchanged = {}, [], 0
+
+        for name in images.source_images():
+            entry = previous.get(name)
+            stat = os.stat(os.path.join(settings.MEDIA_ROOT, name))
+            if entry and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime_ns) \
+                    and images.derivatives_exist(entry):
+                # Same size and mtime as last time: not even worth hashing
+                manifest[name] = entry
+                unchanged += 1
+            else:
+                jobs.append((name, entry))
+
+        built = failed = 0
+        for name, result in self.run(jobs, options['workers']):
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write(f'{name}: {result}')
+                continue
+            if previous.get(name, {}).get('hash') == result['hash'] and not options['force']:
+                unchanged += 1
+            else:
+                built += 1
+            manifest[name] = result
+
+        images.write_manifest(manifest)
+        if built:
+            # Cached page fragments still point at the originals
+            bump_version()
+        if options['prune']:
+            self.prune(manifest)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Built {built} images, {unchanged} unchanged, {failed} failed in {elapsed:.2f}s '
+            f'({(built + unchanged) / elapsed if elapsed else 0:.1f} images/s).'
+        ))
+
+    def run(self, jobs, workers):
+        if workers <= 1 or len(jobs) <= 1:
+            for name, entry in jobs:
+                try:
+                    yield name, images.build_derivatives(name, entry)
+                except Exception as e:
+                    yield name, e
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(images.build_derivatives, name, entry): name for name, entry in jobs}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
+
+    def prune(self, manifest):
+        keep = {entry['hash'][:20] for entry in manifest.values()}
+        root = images.derivatives_root()
+        removed = 0
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename != images.MANIFEST_NAME and filename.split('-')[0] not in keep:
+                    os.remove(os.path.join(dirpath, filename))
+                    removed += 1
+        for entry in os.listdir(root):
+            path = os.path.join(root, entry)
+            if os.path.isdir(path) and not os.listdir(path):
+                shutil.rmtree(path)
+        self.stdout.write(f'Pruned {removed} stale derivative files.')
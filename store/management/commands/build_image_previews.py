@@ -0,0 +1,43 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from store import images
+from store.catalog import bump_version
+
+
+class Command(BaseCommand):
+    help = 'Computes blurred placeholders and dominant colours for catalog images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true', help='Recompute even if the image is unchanged')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        updated = scanned = 0
+
+        for label, fields in images.IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            rows = model.objects.only('pk', 'image_previews', *fields).order_by('pk')
+            changed = []
+            for instance in rows.iterator(chunk_size=batch_size):
+                scanned += 1
+                if images.refresh_previews(instance, force=options['force']):
+                    changed.append(instance)
+                if len(changed) >= batch_size:
+                    model.objects.bulk_update(changed, ['image_previews'])
+                    updated += len(changed)
+                    changed = []
+            if changed:
+                model.objects.bulk_update(changed, ['image_previews'])
+                updated += len(changed)
+
+        if updated:
+            # Cached page fragments were rendered without the placeholders
+            bump_version()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated previews for {updated} of {scanned} rows in {elapsed:.2f}s.'
+        ))
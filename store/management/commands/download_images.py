@@ -1,95 +1,194 @@
+import json
 import os
+import shutil
+import tempfile
+import time
+import urllib.error
 import urllib.request
-from django.core.management.base import BaseCommand
-from django.core.files import File
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from store import images
+from store.catalog import bump_version
 from store.models import Watch
 
+# High-quality watch images from Unsplash (free to use), by watch slug
+WATCH_IMAGES = {
+    'rolex-submariner-date-41': 'https://images.unsplash.com/photo-1622434641406-a158123450f9?w=800&q=90',
+    'rolex-daytona-cosmograph': 'https://images.unsplash.com/photo-1548171915-e79a380a2a4b?w=800&q=90',
+    'rolex-datejust-36': 'https://images.unsplash.com/photo-1627037558426-c2d07beda3af?w=800&q=90',
+    'patek-philippe-nautilus-5711': 'https://images.unsplash.com/photo-1594534475808-b18fc33b045e?w=800&q=90',
+    'patek-philippe-calatrava-5227r': 'https://images.unsplash.com/photo-1612817159949-195b6eb9e31a?w=800&q=90',
+    'audemars-piguet-royal-oak-15500': 'https://images.unsplash.com/photo-1618220179428-22790b461013?w=800&q=90',
+    'omega-speedmaster-moonwatch': 'https://images.unsplash.com/photo-1614164185128-e4ec99c436d7?w=800&q=90',
+    'omega-seamaster-planet-ocean': 'https://images.unsplash.com/photo-1585123334904-845d60e97b29?w=800&q=90',
+    'tag-heuer-monaco-heuer-02': 'https://images.unsplash.com/photo-1524592094714-0f0654e20314?w=800&q=90',
+    'tag-heuer-carrera-chronograph': 'https://images.unsplash.com/photo-1533139502658-0198f920d8e8?w=800&q=90',
+    'cartier-santos-medium': 'https://images.unsplash.com/photo-1509941943102-10c232fc1571?w=800&q=90',
+    'cartier-tank-francaise': 'https://images.unsplash.com/photo-1639037687665-8ff2d73f467a?w=800&q=90',
+    'rolex-gmt-master-ii': 'https://images.unsplash.com/photo-1547996160-81dfa63595aa?w=800&q=90',
+    'ap-royal-oak-offshore-diver': 'https://images.unsplash.com/photo-1612817288484-6f916006741a?w=800&q=90',
+    'patek-philippe-aquanaut-5168g': 'https://images.unsplash.com/photo-1606744888344-493238951221?w=800&q=90',
+}
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+}
+CHUNK_SIZE = 64 * 1024
+MANIFEST_NAME = '.downloads.json'
+
+
+def read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(path, manifest):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def fetch(url, path, entry=None, timeout=15):
+    """
+    Download ``url`` to ``path`` unless the server says the copy we fetched
+    last time (``entry``) is still current. The body is streamed to a temp
+    file next to ``path`` and moved into place only once complete, so an
+    interrupted run never leaves a truncated image behind. Returns
+    ``(changed, manifest entry, bytes written)``.
+    """
+    headers = dict(HEADERS)
+    if entry and entry.get('url') == url:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return False, entry, 0
+        raise
+
+    with response:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(response, f, CHUNK_SIZE)
+                size = f.tell()
+            expected = response.headers.get('Content-Length')
+            if expected is not None and int(expected) != size:
+                raise OSError(f'expected {expected} bytes, got {size}')
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    return True, {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }, size
+
 
 class Command(BaseCommand):
     help = 'Downloads high-quality watch images and assigns them to watches'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent downloads')
+        parser.add_argument('--timeout', type=float, default=15)
+        parser.add_argument('--force', action='store_true', help='Ignore the manifest and download everything')
+        parser.add_argument('--urls', help='JSON file of {watch slug: image url} to use instead of the built-in list')
+
     def handle(self, *args, **options):
-        # High-quality watch images from Unsplash (free to use)
-        watch_images = {
-            'rolex-submariner-date-41': [
-                'https://images.unsplash.com/photo-1622434641406-a158123450f9?w=800&q=90',
-            ],
-            'rolex-daytona-cosmograph': [
-                'https://images.unsplash.com/photo-1548171915-e79a380a2a4b?w=800&q=90',
-            ],
-            'rolex-datejust-36': [
-                'https://images.unsplash.com/photo-1627037558426-c2d07beda3af?w=800&q=90',
-            ],
-            'patek-philippe-nautilus-5711': [
-                'https://images.unsplash.com/photo-1594534475808-b18fc33b045e?w=800&q=90',
-            ],
-            'patek-philippe-calatrava-5227r': [
-                'https://images.unsplash.com/photo-1612817159949-195b6eb9e31a?w=800&q=90',
-            ],
-            'audemars-piguet-royal-oak-15500': [
-                'https://images.unsplash.com/photo-1618220179428-22790b461013?w=800&q=90',
-            ],
-            'omega-speedmaster-moonwatch': [
-                'https://images.unsplash.com/photo-1614164185128-e4ec99c436d7?w=800&q=90',
-            ],
-            'omega-seamaster-planet-ocean': [
-                'https://images.unsplash.com/photo-1585123334904-845d60e97b29?w=800&q=90',
-            ],
-            'tag-heuer-monaco-heuer-02': [
-                'https://images.unsplash.com/photo-1524592094714-0f0654e20314?w=800&q=90',
-            ],
-            'tag-heuer-carrera-chronograph': [
-                'https://images.unsplash.com/photo-1533139502658-0198f920d8e8?w=800&q=90',
-            ],
-            'cartier-santos-medium': [
-                'https://images.unsplash.com/photo-1509941943102-10c232fc1571?w=800&q=90',
-            ],
-            'cartier-tank-francaise': [
-                'https://images.unsplash.com/photo-1639037687665-8ff2d73f467a?w=800&q=90',
-            ],
-            'rolex-gmt-master-ii': [
-                'https://images.unsplash.com/photo-1547996160-81dfa63595aa?w=800&q=90',
-            ],
-            'ap-royal-oak-offshore-diver': [
-                'https://images.unsplash.com/photo-1612817288484-6f916006741a?w=800&q=90',
-            ],
-            'patek-philippe-aquanaut-5168g': [
-                'https://images.unsplash.com/photo-1606744888344-493238951221?w=800&q=90',
-            ],
-        }
+        started = time.perf_counter()
+        sources = WATCH_IMAGES
+        if options['urls']:
+            try:
+                with open(options['urls']) as f:
+                    sources = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot read {options["urls"]}: {e}')
 
         watches_dir = os.path.join(settings.MEDIA_ROOT, 'watches')
         os.makedirs(watches_dir, exist_ok=True)
+        manifest_path = os.path.join(watches_dir, MANIFEST_NAME)
+        manifest = {} if options['force'] else read_manifest(manifest_path)
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        }
-
-        for slug, urls in watch_images.items():
-            try:
-                watch = Watch.objects.get(slug=slug)
-            except Watch.DoesNotExist:
+        watches = {w.slug: w for w in Watch.objects.filter(slug__in=sources)}
+        for slug in sources:
+            if slug not in watches:
                 self.stdout.write(self.style.WARNING(f'Watch not found: {slug}'))
-                continue
 
-            for i, url in enumerate(urls):
-                filename = f'{slug}.jpg'
-                filepath = os.path.join(watches_dir, filename)
+        downloaded, unchanged, failed = [], 0, 0
+        try:
+            with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as pool:
+                futures = {
+                    pool.submit(self.download, sources[slug], slug, watches_dir, self.stored(manifest.get(slug)),
+                                options['timeout']): slug
+                    for slug in watches
+                }
+                for future in as_completed(futures):
+                    slug = futures[future]
+                    name = watches[slug].name
+                    try:
+                        changed, entry, size, elapsed = future.result()
+                    except Exception as e:
+                        failed += 1
+                        self.stdout.write(self.style.ERROR(f'  ✗ {name}: {e}'))
+                        continue
+                    # Recorded as each one finishes, so an interrupted run resumes where it stopped
+                    manifest[slug] = entry
+                    if changed:
+                        downloaded.append(slug)
+                        self.stdout.write(self.style.SUCCESS(f'  ✓ {name} ({size / 1024:.0f} KB in {elapsed:.2f}s)'))
+                    else:
+                        unchanged += 1
+                        self.stdout.write(f'  = {name} unchanged ({elapsed:.2f}s)')
+        finally:
+            write_manifest(manifest_path, manifest)
 
-                self.stdout.write(f'Downloading image for {watch.name}...')
-                try:
-                    req = urllib.request.Request(url, headers=headers)
-                    with urllib.request.urlopen(req, timeout=15) as response:
-                        with open(filepath, 'wb') as f:
-                            f.write(response.read())
+        assigned = self.assign(watches, {slug: manifest[slug]['name'] for slug in watches if slug in manifest})
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Downloaded {len(downloaded)}, {unchanged} unchanged, {failed} failed, '
+            f'{assigned} watches updated in {elapsed:.2f}s.'
+        ))
 
-                    # Assign to watch model
-                    watch.image = f'watches/{filename}'
-                    watch.save()
-                    self.stdout.write(self.style.SUCCESS(f'  ✓ {watch.name}'))
+    def stored(self, entry):
+        """The manifest entry, if the file it describes is still in storage."""
+        if entry and entry.get('name') and default_storage.exists(entry['name']):
+            return entry
+        return None
 
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'  ✗ Failed: {e}'))
+    def download(self, url, slug, watches_dir, entry, timeout):
+        started = time.perf_counter()
+        path = os.path.join(watches_dir, f'.{slug}.download')
+        changed, entry, size = fetch(url, path, entry, timeout)
+        if changed:
+            try:
+                with open(path, 'rb') as f:
+                    entry['name'] = default_storage.save(f'watches/{slug}.jpg', File(f))
+            finally:
+                os.remove(path)
+        return changed, entry, size, time.perf_counter() - started
 
-        self.stdout.write(self.style.SUCCESS(f'\nDone! Images assigned to watches.'))
+    def assign(self, watches, available):
+        """Point watches at their stored files and refresh previews, in one bulk update."""
+        changed = []
+        for slug in sorted(available):
+            watch = watches[slug]
+            if watch.image.name != available[slug]:
+                watch.image = available[slug]
+                images.refresh_previews(watch)
+                changed.append(watch)
+        if changed:
+            Watch.objects.bulk_update(changed, ['image', 'image_previews'])
+            bump_version()
+        return len(changed)
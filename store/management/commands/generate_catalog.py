@@ -0,0 +1,254 @@
+import random
+import time
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from accounts.models import UserProfile
+from cart.models import CENTS, Cart, CartItem, CartSummary, Order, OrderItem
+from store import search, suggest
+from store.catalog import bump_version
+from store.models import Brand, Category, Review, Watch, Wishlist
+
+FAMILIES = [
+    'Oyster', 'Heritage', 'Aqua', 'Chrono', 'Pilot', 'Regatta', 'Tonneau', 'Meridian', 'Atlas', 'Vanguard',
+    'Classic', 'Skeleton', 'Lunar', 'Polar', 'Field', 'Reverso', 'Monarch', 'Equinox', 'Tempest', 'Orbit',
+]
+MATERIALS = ['Stainless steel', 'Titanium', '18 ct yellow gold', '18 ct rose gold', 'Platinum', 'Ceramic', 'Bronze']
+MOVEMENTS = ['Automatic', 'Manual winding', 'Quartz', 'Automatic chronograph', 'Spring drive']
+STRAPS = ['Steel bracelet', 'Alligator leather', 'Rubber strap', 'NATO strap', 'Titanium bracelet']
+DIALS = ['Black', 'Blue', 'Silver', 'White', 'Green', 'Champagne', 'Meteorite', 'Salmon']
+CRYSTALS = ['Sapphire', 'Sapphire with Cyclops lens', 'Hesalite']
+WATER_RESISTANCE = ['30 metres', '50 metres', '100 metres', '200 metres', '300 metres', '1,000 metres']
+COUNTRIES = ['Switzerland', 'Germany', 'Japan', 'France', 'United Kingdom', 'Italy', 'United States']
+CITIES = [('Mumbai', 'Maharashtra'), ('Delhi', 'Delhi'), ('Bengaluru', 'Karnataka'), ('Chennai', 'Tamil Nadu'),
+          ('Hyderabad', 'Telangana'), ('Pune', 'Maharashtra'), ('Kolkata', 'West Bengal')]
+REVIEW_TITLES = ['Superb finishing', 'Worth every rupee', 'Daily wearer', 'Not for me', 'Grail watch',
+                 'Beautiful dial', 'Heavier than expected', 'Keeps perfect time']
+STATUSES = [status for status, _ in Order.STATUS_CHOICES]
+# Log-uniform between ₹50,000 and ₹2 crore, so every price bucket gets watches
+MIN_PRICE, MAX_PRICE = 50_000, 20_000_000
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def spread(total, buckets):
+    """``total`` split as evenly as possible over ``buckets`` slots."""
+    base, extra = divmod(total, buckets) if buckets else (0, 0)
+    for i in range(buckets):
+        yield base + (i < extra)
+
+
+class Command(BaseCommand):
+    help = 'Generates a large, reproducible synthetic catalog with users, reviews, carts and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='gen', help='Prepended to slugs, usernames and order numbers')
+        parser.add_argument('--brands', type=int, default=50)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--watches', type=int, default=10_000)
+        parser.add_argument('--users', type=int, default=5_000)
+        parser.add_argument('--reviews', type=int, default=50_000)
+        parser.add_argument('--wishlists', type=int, default=20_000)
+        parser.add_argument('--carts', type=int, default=5_000)
+        parser.add_argument('--orders', type=int, default=20_000)
+        parser.add_argument('--batch-size', type=int, default=2_000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.prefix = prefix = options['prefix']
+        self.batch_size = options['batch_size']
+        if Brand.objects.filter(slug__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Rows with prefix "{prefix}" already exist; pass a different --prefix.')
+        if options['brands'] < 1 or (options['watches'] and options['categories'] < 1):
+            raise CommandError('At least one brand and one category are needed.')
+        if options['users'] < 1 and (options['reviews'] or options['wishlists'] or options['orders']):
+            raise CommandError('Reviews, wishlists and orders need at least one user.')
+        if options['watches'] < 1 and (options['reviews'] or options['wishlists'] or options['carts'] or options['orders']):
+            raise CommandError('Reviews, wishlists, carts and orders need at least one watch.')
+
+        started = time.perf_counter()
+        self.total = 0
+        brand_ids = self.insert(Brand, self.brands(options['brands']))
+        category_ids = self.insert(Category, self.categories(options['categories']))
+        watch_ids = self.insert(Watch, self.watches(options['watches'], brand_ids, category_ids))
+        user_ids = self.insert(User, self.users(options['users']))
+        self.insert(UserProfile, (UserProfile(user_id=pk) for pk in user_ids), ids=False)
+        self.insert(Review, self.reviews(options['reviews'], user_ids, watch_ids), ids=False)
+        self.insert(Wishlist, self.wishlists(options['wishlists'], user_ids, watch_ids), ids=False)
+        self.carts(options['carts'], user_ids, watch_ids)
+        self.orders(options['orders'], user_ids, watch_ids)
+
+        self.step('Aggregating ratings', lambda: call_command('recompute_ratings', stdout=self.stdout))
+        if search.is_available():
+            self.step('Rebuilding the search index', search.rebuild_index)
+        suggest.reset_index()
+        bump_version()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {self.total:,} rows in {elapsed:.2f}s ({self.total / elapsed if elapsed else 0:,.0f} rows/s).'
+        ))
+
+    def insert(self, model, rows, ids=True):
+        """bulk_create ``rows`` one transaction per batch; returns the new pks if ``ids``."""
+        started = time.perf_counter()
+        pks, count = [], 0
+        for batch in batched(rows, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            count += len(batch)
+            if ids:
+                pks.extend(obj.pk for obj in batch)
+        self.report(model._meta.verbose_name_plural, count, started)
+        return pks
+
+    def report(self, label, count, started):
+        self.total += count
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'  {label}: {count:,} rows in {elapsed:.2f}s ({count / elapsed if elapsed else 0:,.0f} rows/s)')
+
+    def step(self, label, func):
+        started = time.perf_counter()
+        func()
+        self.stdout.write(f'  {label} took {time.perf_counter() - started:.2f}s')
+
+    def brands(self, count):
+        for i in range(count):
+            name = f'{self.rng.choice(FAMILIES)} {i}'
+            yield Brand(
+                name=name, slug=f'{self.prefix}-brand-{i}', description=f'{name} watchmaker.',
+                founded_year=self.rng.randint(1750, 2015), country=self.rng.choice(COUNTRIES),
+            )
+
+    def categories(self, count):
+        for i in range(count):
+            yield Category(name=f'Collection {i}', slug=f'{self.prefix}-category-{i}')
+
+    def watches(self, count, brand_ids, category_ids):
+        rng = self.rng
+        for i in range(count):
+            price = Decimal(round(MIN_PRICE * (MAX_PRICE / MIN_PRICE) ** rng.random(), -3))
+            material, dial = rng.choice(MATERIALS), rng.choice(DIALS)
+            name = f'{rng.choice(FAMILIES)} {rng.choice(FAMILIES)} {rng.randint(30, 46)} {i}'
+            yield Watch(
+                name=name,
+                slug=f'{self.prefix}-watch-{i}',
+                brand_id=rng.choice(brand_ids),
+                category_id=rng.choice(category_ids) if rng.random() < 0.9 else None,
+                description=f'{name} in {material.lower()} with a {dial.lower()} dial.',
+                price=price,
+                original_price=(price * Decimal('1.1')).quantize(CENTS) if rng.random() < 0.2 else None,
+                case_material=material,
+                case_diameter=f'{rng.randint(30, 46)} mm',
+                movement=rng.choice(MOVEMENTS),
+                water_resistance=rng.choice(WATER_RESISTANCE),
+                strap_material=rng.choice(STRAPS),
+                dial_color=dial,
+                crystal=rng.choice(CRYSTALS),
+                power_reserve=f'Approx. {rng.randint(38, 120)} hours',
+                reference_number=f'{rng.randint(1000, 99999)}-{rng.randint(100, 999)}',
+                stock=rng.choice([0, 1, 2, 3, 5, 10, 25]),
+                is_featured=rng.random() < 0.02,
+                is_new_arrival=rng.random() < 0.05,
+                is_bestseller=rng.random() < 0.03,
+                is_active=rng.random() < 0.97,
+            )
+
+    def users(self, count):
+        # Hashing once keeps user generation from being dominated by PBKDF2
+        password = make_password('password')
+        for i in range(count):
+            username = f'{self.prefix}_user{i}'
+            yield User(username=username, email=f'{username}@example.com', password=password,
+                       first_name=f'User{i}', last_name=self.prefix.title())
+
+    def pairs(self, count, user_ids, watch_ids):
+        """About ``count`` distinct (user, watch) pairs, spread over users, without remembering them all."""
+        for user_id, n in zip(user_ids, spread(count, len(user_ids))):
+            for watch_id in self.rng.sample(watch_ids, min(n, len(watch_ids))):
+                yield user_id, watch_id
+
+    def reviews(self, count, user_ids, watch_ids):
+        rng = self.rng
+        for user_id, watch_id in self.pairs(count, user_ids, watch_ids):
+            yield Review(
+                user_id=user_id, watch_id=watch_id, rating=rng.choices(range(1, 6), weights=(1, 1, 3, 6, 9))[0],
+                title=rng.choice(REVIEW_TITLES), comment='Generated review. ' * rng.randint(1, 6),
+            )
+
+    def wishlists(self, count, user_ids, watch_ids):
+        for user_id, watch_id in self.pairs(count, user_ids, watch_ids):
+            yield Wishlist(user_id=user_id, watch_id=watch_id)
+
+    def carts(self, count, user_ids, watch_ids):
+        """Half the carts belong to users (one each at most), the rest to anonymous sessions."""
+        user_carts = min(count // 2, len(user_ids))
+        started = time.perf_counter()
+        carts = items = 0
+        for batch in batched(range(count), self.batch_size):
+            lines = []
+            with transaction.atomic():
+                objs = Cart.objects.bulk_create([
+                    Cart(user_id=user_ids[i]) if i < user_carts else Cart(session_key=f'{self.prefix}-session-{i}')
+                    for i in batch
+                ])
+                for cart in objs:
+                    for watch_id in self.rng.sample(watch_ids, min(self.rng.randint(1, 3), len(watch_ids))):
+                        lines.append(CartItem(cart=cart, watch_id=watch_id, quantity=self.rng.randint(1, 2)))
+                CartItem.objects.bulk_create(lines)
+            carts += len(objs)
+            items += len(lines)
+        self.report('carts', carts, started)
+        self.report('cart items', items, started)
+
+    def orders(self, count, user_ids, watch_ids):
+        """Orders with 1-4 lines each; totals and summaries computed as checkout would."""
+        rng = self.rng
+        started = time.perf_counter()
+        orders = items = 0
+        prices = {}
+        for batch in batched(range(count), self.batch_size):
+            planned = [[(rng.choice(watch_ids), rng.randint(1, 2)) for _ in range(rng.randint(1, 4))] for _ in batch]
+            needed = {watch_id for lines in planned for watch_id, _ in lines} - prices.keys()
+            for pk, name, brand, price in Watch.objects.filter(pk__in=needed).values_list(
+                    'pk', 'name', 'brand__name', 'price').iterator():
+                prices[pk] = (name, brand, price)
+            # Keep the lookup bounded: only the most recent batch's watches are reused
+            prices = {pk: prices[pk] for lines in planned for pk, _ in lines}
+
+            objs, lines_by_order = [], []
+            for i, lines in zip(batch, planned):
+                summary = CartSummary(sum(q for _, q in lines), sum(prices[w][2] * q for w, q in lines))
+                city, state = rng.choice(CITIES)
+                objs.append(Order(
+                    order_number=f'{self.prefix.upper()}-{i:08d}', user_id=rng.choice(user_ids),
+                    full_name=f'Customer {i}', email=f'customer{i}@example.com', phone='9800000000',
+                    address_line1=f'{rng.randint(1, 999)} Generated Road', city=city, state=state,
+                    postal_code=f'{rng.randint(110000, 855000)}', subtotal=summary.subtotal, tax=summary.tax,
+                    total=summary.total, item_count=summary.total_items,
+                    item_summary=Order.summarize((f'{prices[w][1]} {prices[w][0]}', q) for w, q in lines),
+                    status=rng.choice(STATUSES),
+                ))
+                lines_by_order.append(lines)
+            with transaction.atomic():
+                Order.objects.bulk_create(objs)
+                order_items = [
+                    OrderItem(order=order, watch_id=w, watch_name=f'{prices[w][1]} {prices[w][0]}', watch_brand=prices[w][1],
+                              price=prices[w][2], quantity=q)
+                    for order, lines in zip(objs, lines_by_order) for w, q in lines
+                ]
+                OrderItem.objects.bulk_create(order_items)
+            orders += len(objs)
+            items += len(order_items)
+        self.report('orders', orders, started)
+        self.report('order items', items, started)
@@ -0,0 +1,75 @@
+import json
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from store import benchmarks, loadtest
+
+
+class Command(BaseCommand):
+    help = ('Drives the WSGI app in-process with concurrent shopper journeys and reports throughput, '
+            'latency per URL, errors and SQLite lock contention')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent shoppers per process')
+        parser.add_argument('--processes', type=int, default=1, help='Forked processes, each with --threads shoppers')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+        parser.add_argument('--journeys', type=int, help='Journeys per thread; overrides --duration')
+        parser.add_argument('--checkout-ratio', type=float, default=0.3,
+                            help='Share of journeys that log in and place an order')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--size', default='small', choices=list(benchmarks.SIZES),
+                            help='Dataset to generate in a throwaway database')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Run against the configured database instead (it will get orders and carts)')
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['processes'] < 1:
+            raise CommandError('--threads and --processes must be at least 1.')
+        if options['current_db']:
+            # Query logging under DEBUG would skew the numbers and grow memory
+            database = override_settings(DEBUG=False)
+        else:
+            self.stdout.write(f'Generating the {options["size"]} dataset...')
+            database = benchmarks.throwaway_database(options['size'], stdout=self.stdout)
+
+        with database or nullcontext():
+            self.stdout.write(
+                f'Running {options["threads"] * options["processes"]} shoppers '
+                f'({options["processes"]} x {options["threads"]})...'
+            )
+            try:
+                report = loadtest.run(
+                    threads=options['threads'], processes=options['processes'], duration=options['duration'],
+                    journeys=options['journeys'], seed=options['seed'], checkout_ratio=options['checkout_ratio'],
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'options': {key: options[key] for key in (
+                    'threads', 'processes', 'duration', 'journeys', 'checkout_ratio', 'seed', 'size', 'current_db',
+                )}, **report}, f, indent=2)
+            self.stdout.write(f'Wrote {options["output"]}')
+
+    def print_report(self, report):
+        self.stdout.write(
+            f'\n{report["journeys"]} journeys, {report["requests"]} requests in {report["duration_s"]}s '
+            f'at concurrency {report["concurrency"]}: {report["throughput_rps"]} req/s'
+        )
+        self.stdout.write(f'  {"url":28} {"requests":>8} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"lock ms":>8}')
+        for name, stats in report['urls'].items():
+            self.stdout.write(
+                f'  {name:28} {stats["requests"]:8} {stats["errors"]:7} {stats["p50_ms"]:8.1f} '
+                f'{stats["p95_ms"]:8.1f} {stats["p99_ms"]:8.1f} {stats["lock_wait_ms"]:8.0f}'
+            )
+        errors = ', '.join(f'{kind}: {count}' for kind, count in sorted(report['errors'].items())) or 'none'
+        style = self.style.SUCCESS if not report['errors'] else self.style.WARNING
+        self.stdout.write(style(
+            f'Error rate {report["error_rate"]:.2%} ({errors}); "database is locked" errors: '
+            f'{report["locked_errors"]}; writes that waited for the lock: {report["lock_waits"]} '
+            f'(p95 {report["lock_wait_p95_ms"]} ms)'
+        ))
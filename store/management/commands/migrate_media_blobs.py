@@ -0,0 +1,111 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from store import images
+from store.catalog import bump_version
+from store.storage import BLOBS_DIR, file_fields, is_blob, reference_counts
+
+
+class Command(BaseCommand):
+    help = 'Moves uploaded files into the content-addressed blob store and deletes unreferenced blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--keep-originals', action='store_true',
+                            help='Leave the old files in place after their rows have moved to blobs')
+        parser.add_argument('--min-age', type=int, default=60,
+                            help='Minutes a blob must have existed before it can be collected; '
+                                 'protects uploads whose row has not been saved yet')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        renamed = self.migrate(options)
+        removed, freed = self.collect(options)
+        if renamed and not options['dry_run']:
+            bump_version()
+        elapsed = time.perf_counter() - started
+        prefix = 'Dry run: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}{len(renamed)} files moved into blobs, {removed} unreferenced blobs '
+            f'({freed / 1024:.0f} KB) collected in {elapsed:.2f}s.'
+        ))
+
+    def migrate(self, options):
+        """Store each referenced non-blob file once and repoint every row at its blob. Returns {old: new}."""
+        renamed = {}
+        for name in sorted(reference_counts()):
+            if is_blob(name):
+                continue
+            if not default_storage.exists(name):
+                self.stderr.write(f'Missing file, left as is: {name}')
+                continue
+            if options['dry_run']:
+                renamed[name] = None
+                continue
+            with default_storage.open(name, 'rb') as f:
+                renamed[name] = default_storage.save(name, File(f))
+        if not renamed or options['dry_run']:
+            return renamed
+
+        for model, fields in file_fields().items():
+            # Catalog images keep a preview keyed on the file name; other file fields have none
+            has_previews = model._meta.label in images.IMAGE_FIELDS
+            columns = [*fields, 'image_previews'] if has_previews else fields
+            query = Q()
+            for field in fields:
+                query |= Q(**{f'{field}__in': list(renamed)})
+            changed = []
+            for instance in model.objects.filter(query).only('pk', *columns):
+                previews = dict(instance.image_previews or {}) if has_previews else {}
+                for field in fields:
+                    old = getattr(instance, field).name
+                    if old in renamed:
+                        setattr(instance, field, renamed[old])
+                        # Same bytes, so the preview carries over under the new name
+                        if previews.get(field, {}).get('source') == old:
+                            previews[field] = dict(previews[field], source=renamed[old])
+                if has_previews:
+                    instance.image_previews = previews
+                changed.append(instance)
+            with transaction.atomic():
+                model.objects.bulk_update(changed, columns, batch_size=500)
+
+        manifest = images.read_manifest()
+        for old, new in renamed.items():
+            if old in manifest:
+                manifest.setdefault(new, manifest[old])
+        images.write_manifest(manifest)
+
+        if not options['keep_originals']:
+            referenced = reference_counts()
+            for old in renamed:
+                if not referenced[old]:
+                    default_storage.delete(old)
+        return renamed
+
+    def collect(self, options):
+        """Delete blobs that no file field references and that are older than --min-age."""
+        root = os.path.join(settings.MEDIA_ROOT, BLOBS_DIR)
+        referenced = reference_counts()
+        cutoff = time.time() - options['min_age'] * 60
+        removed = freed = 0
+        for dirpath, _, filenames in os.walk(root, topdown=False):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                stat = os.stat(path)
+                if referenced[name] or stat.st_mtime > cutoff:
+                    continue
+                removed += 1
+                freed += stat.st_size
+                if not options['dry_run']:
+                    os.remove(path)
+            if dirpath != root and not options['dry_run'] and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        return removed, freed
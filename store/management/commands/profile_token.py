@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from store import profiler
+
+
+class Command(BaseCommand):
+    help = f'Prints a signed token that makes a request carrying it in the {profiler.HEADER} header get profiled'
+
+    def handle(self, *args, **options):
+        self.stdout.write(profiler.make_token())
+        self.stderr.write(f'Valid for {settings.PROFILE_TOKEN_MAX_AGE} seconds. Profiles go to {settings.PROFILE_DIR}.')
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from store import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the SQLite FTS5 full-text index used by catalog search'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('The full-text search index requires the SQLite database backend.')
+        started = time.perf_counter()
+        indexed = search.rebuild_index()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} watches in {elapsed:.2f}s.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+from store.models import Review, Watch
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored rating sum, count and average for every watch'
+
+    def handle(self, *args, **options):
+        reviews = Review.objects.filter(watch=OuterRef('pk')).order_by().values('watch')
+        rating_sum = reviews.annotate(total=Sum('rating')).values('total')
+        review_count = reviews.annotate(count=Count('id')).values('count')
+
+        updated = Watch.objects.update(
+            rating_sum=Coalesce(Subquery(rating_sum, output_field=IntegerField()), 0),
+            review_count=Coalesce(Subquery(review_count, output_field=IntegerField()), 0),
+        )
+        Watch.objects.update(avg_rating=Case(
+            When(review_count=0, then=Value(0.0)),
+            default=Round(Cast(F('rating_sum'), FloatField()) / F('review_count'), 1),
+            output_field=FloatField(),
+        ))
+        self.stdout.write(self.style.SUCCESS(f'Recomputed ratings for {updated} watches.'))
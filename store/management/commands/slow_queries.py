@@ -0,0 +1,72 @@
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from store import slowqueries
+from store.benchmarks import percentile
+
+SORT_KEYS = {'total': 'total_ms', 'count': 'count', 'max': 'max_ms', 'p95': 'p95_ms'}
+
+
+class Command(BaseCommand):
+    help = 'Groups the sampled slow queries by fingerprint, with their plans, flags and call sites'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=str(settings.SLOW_QUERY_LOG))
+        parser.add_argument('--sort', choices=SORT_KEYS, default='total')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--flag', choices=['full_scan', 'temp_btree'], help='Only queries whose plan has this flag')
+        parser.add_argument('--json', action='store_true', help='Print the groups as JSON')
+
+    def handle(self, *args, **options):
+        groups = {}
+        for entry in slowqueries.read(options['log']):
+            group = groups.setdefault(entry['fingerprint'], {
+                'fingerprint': entry['fingerprint'], 'sql': entry['sql'], 'timings': [],
+                'flags': set(), 'call_sites': Counter(), 'plan': None, 'slowest': 0.0,
+            })
+            group['timings'].append(entry['ms'])
+            group['flags'].update(entry['flags'])
+            if entry['stack']:
+                group['call_sites'][entry['stack'][-1]] += 1
+            if entry['ms'] >= group['slowest']:
+                group['slowest'], group['plan'] = entry['ms'], entry['plan']
+
+        rows = []
+        for group in groups.values():
+            if options['flag'] and options['flag'] not in group['flags']:
+                continue
+            timings = sorted(group['timings'])
+            rows.append({
+                'fingerprint': group['fingerprint'],
+                'count': len(timings),
+                'total_ms': round(sum(timings), 1),
+                'p95_ms': round(percentile(timings, 95), 1),
+                'max_ms': round(timings[-1], 1),
+                'flags': sorted(group['flags']),
+                'call_sites': [site for site, _ in group['call_sites'].most_common(3)],
+                'sql': group['sql'],
+                'plan': group['plan'],
+            })
+        rows.sort(key=lambda row: row[SORT_KEYS[options['sort']]], reverse=True)
+        rows = rows[:options['top']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        if not rows:
+            self.stdout.write(f'No slow queries in {options["log"]}.')
+            return
+        for row in rows:
+            flags = f'  [{", ".join(row["flags"])}]' if row['flags'] else ''
+            self.stdout.write(self.style.SUCCESS(
+                f'{row["fingerprint"]}  {row["count"]}x  total {row["total_ms"]} ms  '
+                f'p95 {row["p95_ms"]} ms  max {row["max_ms"]} ms{flags}'
+            ))
+            self.stdout.write(f'  {row["sql"]}')
+            for detail in row['plan'] or ():
+                self.stdout.write(f'    plan: {detail}')
+            for site in row['call_sites']:
+                self.stdout.write(f'    from: {site}')
+            self.stdout.write('')
@@ -0,0 +1,265 @@
+"""
+Per-view request metrics: count, latency histogram, database queries and
+time, template render time and response size, keyed by resolved URL name.
+
+Counters live in a dict per process behind one lock, updated once per
+request. With METRICS_DIR set, each process also writes a snapshot there at
+most every METRICS_FLUSH_INTERVAL seconds and /metrics sums every snapshot,
+so several workers report one total. Snapshots are named per process start,
+so a recycled pid never overwrites an earlier worker's counters; those not
+rewritten for METRICS_SNAPSHOT_MAX_AGE seconds (dead workers, or workers idle
+that long) are left out and deleted, which Prometheus sees as a counter reset.
+"""
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNRESOLVED = '<unresolved>'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Sums per (view, status class); the histogram is a list of per-bucket counts plus +Inf
+COUNTERS = ('requests', 'latency_sum', 'queries', 'db_seconds', 'template_seconds', 'response_bytes')
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = [0.0]
+_local = threading.local()
+
+
+def _new_snapshot_name():
+    return f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+
+
+_snapshot_name = [_new_snapshot_name()]
+
+
+def _forked():
+    # A forked worker starts its own counters under its own name
+    _stats.clear()
+    _last_flush[0] = 0.0
+    _snapshot_name[0] = _new_snapshot_name()
+
+
+os.register_at_fork(after_in_child=_forked)
+
+
+class RequestTimings:
+    __slots__ = ('queries', 'db_seconds', 'template_seconds', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+def record(view, status, seconds, queries, db_seconds, template_seconds, response_bytes):
+    key = (view, f'{status // 100}xx')
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = {name: 0 for name in COUNTERS}
+            entry['buckets'] = [0] * (len(BUCKETS) + 1)
+        entry['requests'] += 1
+        entry['latency_sum'] += seconds
+        entry['queries'] += queries
+        entry['db_seconds'] += db_seconds
+        entry['template_seconds'] += template_seconds
+        entry['response_bytes'] += response_bytes
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry['buckets'][i] += 1
+                break
+        else:
+            entry['buckets'][-1] += 1
+
+
+def snapshot():
+    """This process's counters as {"view|status": entry}, safe to serialize."""
+    with _lock:
+        return {f'{view}|{status}': dict(entry, buckets=list(entry['buckets'])) for (view, status), entry in _stats.items()}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+    _last_flush[0] = 0.0
+
+
+def flush(force=False):
+    """Write this process's snapshot to METRICS_DIR, at most every METRICS_FLUSH_INTERVAL seconds."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush[0] < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush[0] = now
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _snapshot_name[0])
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+
+def collect():
+    """Counters summed over every process that has written to METRICS_DIR, or just this one."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return snapshot()
+    flush(force=True)
+    cutoff = time.time() - settings.METRICS_SNAPSHOT_MAX_AGE
+    totals = {}
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+                continue
+            if not filename.endswith('.json'):
+                continue
+            with open(path) as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for key, entry in stats.items():
+            total = totals.get(key)
+            if total is None:
+                totals[key] = dict(entry, buckets=list(entry['buckets']))
+                continue
+            for name in COUNTERS:
+                total[name] += entry[name]
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], entry['buckets'])]
+    return totals
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(stats):
+    """Prometheus text exposition format."""
+    rows = sorted((key.split('|', 1), entry) for key, entry in stats.items())
+    lines = []
+
+    def family(name, kind, help_text, values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(values)
+
+    def labels(view, status, **extra):
+        pairs = {'view': view, 'status': status, **extra}
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs.items()) + '}'
+
+    family('django_view_requests_total', 'counter', 'Requests by resolved URL name and status class.',
+           [f'django_view_requests_total{labels(v, s)} {e["requests"]}' for (v, s), e in rows])
+
+    histogram = []
+    for (view, status), entry in rows:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, entry['buckets']):
+            cumulative += count
+            histogram.append(f'django_view_latency_seconds_bucket{labels(view, status, le=str(bound))} {cumulative}')
+        histogram.append(f'django_view_latency_seconds_bucket{labels(view, status, le="+Inf")} {entry["requests"]}')
+        histogram.append(f'django_view_latency_seconds_sum{labels(view, status)} {entry["latency_sum"]:.6f}')
+        histogram.append(f'django_view_latency_seconds_count{labels(view, status)} {entry["requests"]}')
+    family('django_view_latency_seconds', 'histogram', 'Time from the first middleware to the response.', histogram)
+
+    for name, key, kind, help_text, fmt in (
+        ('django_view_db_queries_total', 'queries', 'counter', 'Database queries executed.', '{}'),
+        ('django_view_db_seconds_total', 'db_seconds', 'counter', 'Time spent executing queries.', '{:.6f}'),
+        ('django_view_template_seconds_total', 'template_seconds', 'counter', 'Time spent rendering templates.',
+         '{:.6f}'),
+        ('django_view_response_bytes_total', 'response_bytes', 'counter', 'Response body bytes.', '{}'),
+    ):
+        family(name, kind, help_text, [f'{name}{labels(v, s)} {fmt.format(e[key])}' for (v, s), e in rows])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Goes first in MIDDLEWARE so the latency covers every other middleware too."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        _local.timings = timings
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else UNRESOLVED
+        size = int(response.get('Content-Length', 0)) if response.streaming else len(response.content)
+        record(view, response.status_code, elapsed, timings.queries, timings.db_seconds,
+               timings.template_seconds, size)
+        flush()
+        return response
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timings = getattr(_local, 'timings', None)
+        # Only the outermost render counts; nested render_to_string calls are inside it
+        if timings is None or timings.rendering:
+            return super().render(context, request)
+        timings.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_seconds += time.perf_counter() - started
+            timings.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for MetricsMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint: a bearer METRICS_TOKEN, or a staff session."""
+    token = settings.METRICS_TOKEN
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    allowed = (token and supplied and hmac.compare_digest(supplied, token)) or \
+        (request.user.is_authenticated and request.user.is_staff)
+    if not allowed:
+        raise PermissionDenied
+    return HttpResponse(render(collect()), content_type=CONTENT_TYPE)
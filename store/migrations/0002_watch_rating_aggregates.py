@@ -0,0 +1,42 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:06
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    Watch = apps.get_model('store', 'Watch')
+    Review = apps.get_model('store', 'Review')
+    stats = Review.objects.values('watch_id').annotate(total=Sum('rating'), count=Count('id'))
+    for row in stats:
+        Watch.objects.filter(pk=row['watch_id']).update(
+            rating_sum=row['total'],
+            review_count=row['count'],
+            avg_rating=round(row['total'] / row['count'], 1),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watch',
+            name='avg_rating',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='watch',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='watch',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+CREATE_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS store_watch_fts USING fts5(
+    name, brand, category, description, reference_number, specs,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+POPULATE_SQL = """
+INSERT INTO store_watch_fts (rowid, name, brand, category, description, reference_number, specs)
+SELECT w.id, w.name, b.name, COALESCE(c.name, ''), w.description, w.reference_number,
+       w.case_material || ' ' || w.case_diameter || ' ' || w.movement || ' ' || w.water_resistance || ' ' ||
+       w.strap_material || ' ' || w.dial_color || ' ' || w.crystal || ' ' || w.power_reserve
+FROM store_watch w
+JOIN store_brand b ON b.id = w.brand_id
+LEFT JOIN store_category c ON c.id = w.category_id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS store_watch_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_watch_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_watch_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watch',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
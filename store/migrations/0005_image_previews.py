@@ -0,0 +1,28 @@
+# Generated by Django 5.2.11 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_watch_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='brand',
+            name='image_previews',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='image_previews',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='watch',
+            name='image_previews',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Count, Sum
 from django.urls import reverse
 from django.utils.text import slugify
 
@@ -8,6 +9,8 @@ class Brand(models.Model):
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
     logo = models.ImageField(upload_to='brands/', blank=True, null=True)
+    # {field name: {source, color, placeholder}}; see store.images.refresh_previews
+    image_previews = models.JSONField(default=dict, blank=True, editable=False)
     founded_year = models.IntegerField(blank=True, null=True)
     country = models.CharField(max_length=100, blank=True)
 
@@ -31,6 +34,7 @@ class Category(models.Model):
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    image_previews = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -46,6 +50,9 @@ class Category(models.Model):
 
 
 class Watch(models.Model):
+    # Maintained by cart.reservations and the Review signals; plain saves never write them
+    DERIVED_FIELDS = frozenset({'reserved', 'rating_sum', 'review_count', 'avg_rating'})
+
     name = models.CharField(max_length=300)
     slug = models.SlugField(unique=True)
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='watches')
@@ -56,6 +63,7 @@ class Watch(models.Model):
     image = models.ImageField(upload_to='watches/', blank=True, null=True)
     image_2 = models.ImageField(upload_to='watches/', blank=True, null=True)
     image_3 = models.ImageField(upload_to='watches/', blank=True, null=True)
+    image_previews = models.JSONField(default=dict, blank=True, editable=False)
 
     # Specifications
     case_material = models.CharField(max_length=200, blank=True)
@@ -69,6 +77,14 @@ class Watch(models.Model):
     reference_number = models.CharField(max_length=100, blank=True)
 
     stock = models.IntegerField(default=10)
+    # Units under an active cart hold; maintained by cart.reservations
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+
+    # Denormalized review aggregates, kept in sync by the Review signals in store.signals
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    avg_rating = models.FloatField(default=0, editable=False, db_index=True)
+
     is_featured = models.BooleanField(default=False)
     is_new_arrival = models.BooleanField(default=False)
     is_bestseller = models.BooleanField(default=False)
@@ -86,6 +102,11 @@ class Watch(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(f"{self.brand.name}-{self.name}")
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back a stale hold count or review aggregate from an instance loaded earlier
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name not in self.DERIVED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -97,20 +118,24 @@ class Watch(models.Model):
             return int(((self.original_price - self.price) / self.original_price) * 100)
         return 0
 
-    @property
-    def avg_rating(self):
-        reviews = self.reviews.all()
-        if reviews:
-            return round(sum(r.rating for r in reviews) / len(reviews), 1)
-        return 0
+    def refresh_rating(self):
+        stats = Review.objects.filter(watch_id=self.pk).aggregate(total=Sum('rating'), count=Count('id'))
+        self.rating_sum = stats['total'] or 0
+        self.review_count = stats['count']
+        self.avg_rating = round(self.rating_sum / self.review_count, 1) if self.review_count else 0
+        Watch.objects.filter(pk=self.pk).update(
+            rating_sum=self.rating_sum,
+            review_count=self.review_count,
+            avg_rating=self.avg_rating,
+        )
 
     @property
-    def review_count(self):
-        return self.reviews.count()
+    def available_stock(self):
+        return max(self.stock - self.reserved, 0)
 
     @property
     def in_stock(self):
-        return self.stock > 0
+        return self.available_stock > 0
 
 
 class Review(models.Model):
@@ -130,6 +155,12 @@ class Review(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.watch.name} ({self.rating}★)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_watch_id = instance.__dict__.get('watch_id')
+        return instance
+
 
 class Wishlist(models.Model):
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='wishlist')
@@ -0,0 +1,112 @@
+import base64
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise InvalidCursor(token)
+    return direction, values
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a fixed ordering. The ordering must end in a unique
+    column (normally pk) so every row has a distinct position, which lets each
+    page be fetched with an indexed range condition instead of an OFFSET.
+    """
+
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.per_page = per_page
+        self.model = queryset.model
+
+    def _order_by(self, reverse=False):
+        return [('-' if desc != reverse else '') + name for name, desc in self.ordering]
+
+    def _key(self, obj):
+        values = []
+        for name, _ in self.ordering:
+            value = getattr(obj, 'pk' if name == 'pk' else self._field(name).attname)
+            values.append(value if isinstance(value, (int, float, type(None))) else str(value))
+        return values
+
+    def _field(self, name):
+        return self.model._meta.pk if name == 'pk' else self.model._meta.get_field(name)
+
+    def _seek(self, values, reverse=False):
+        if len(values) != len(self.ordering):
+            raise InvalidCursor(values)
+        try:
+            values = [self._field(name).to_python(value) for (name, _), value in zip(self.ordering, values)]
+        except Exception:
+            raise InvalidCursor(values)
+
+        condition = Q()
+        equal = Q()
+        for (name, desc), value in zip(self.ordering, values):
+            lookup = 'lt' if desc != reverse else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def page(self, cursor=None):
+        direction, values = decode_cursor(cursor) if cursor else ('next', None)
+        reverse = direction == 'prev'
+
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows)
+
+        first, last = encode_cursor('prev', self._key(rows[0])), encode_cursor('next', self._key(rows[-1]))
+        if reverse:
+            return KeysetPage(rows, next_cursor=last, prev_cursor=first if has_more else None)
+        return KeysetPage(rows, next_cursor=last if has_more else None, prev_cursor=first if values else None)
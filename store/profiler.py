@@ -0,0 +1,174 @@
+"""
+On-demand profiling of single requests. A request carrying a signed token in
+the X-Profile header (or the _profile query parameter) runs under cProfile and
+a stack sampler. Both results are written to PROFILE_DIR: a collapsed-stack
+file that flamegraph.pl and speedscope read directly, a pstats file and a JSON
+summary with the URL name, timings and query count. Only the newest
+PROFILE_KEEP profiles are kept. Tokens come from ``manage.py profile_token``.
+"""
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.utils import timezone
+
+from .metrics import UNRESOLVED, RequestTimings
+
+HEADER = 'X-Profile'
+QUERY_PARAM = '_profile'
+SALT = 'store.profiler'
+# Profile names: <timestamp>-<url name>-<random>, safe to use as file names
+NAME = re.compile(r'^\d{8}T\d{12}-[\w.-]+-[0-9a-f]{8}$')
+SUFFIXES = ('.json', '.collapsed', '.pstats')
+
+# One profile at a time: cProfile hooks are per thread, but concurrent profiles would skew each other
+_busy = threading.Lock()
+
+
+def make_token():
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def token_is_valid(token):
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class StackSampler(threading.Thread):
+    """Records the target thread's Python stack every ``interval`` seconds, as collapsed-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+        self.root = str(settings.BASE_DIR)
+
+    def label(self, code):
+        filename = code.co_filename
+        if filename.startswith(self.root):
+            filename = os.path.relpath(filename, self.root)
+        elif 'site-packages' in filename:
+            filename = filename.split('site-packages' + os.sep, 1)[1]
+        return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+
+def profile_names():
+    """Stored profile names, newest first."""
+    try:
+        files = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted({name[:-len('.json')] for name in files if name.endswith('.json')}, reverse=True)
+
+
+def load(name):
+    with open(os.path.join(settings.PROFILE_DIR, f'{name}.json')) as f:
+        return dict(json.load(f), name=name)
+
+
+def prune():
+    for name in profile_names()[settings.PROFILE_KEEP:]:
+        for suffix in SUFFIXES:
+            try:
+                os.remove(os.path.join(settings.PROFILE_DIR, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def save(profile, sampler, summary):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r'[^\w.-]+', '_', summary['url_name'])
+    name = f'{timezone.now():%Y%m%dT%H%M%S%f}-{slug}-{uuid.uuid4().hex[:8]}'
+    path = os.path.join(settings.PROFILE_DIR, name)
+    profile.dump_stats(f'{path}.pstats')
+    with open(f'{path}.collapsed', 'w') as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    # The summary goes last: it is what marks a profile as complete
+    with open(f'{path}.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    prune()
+    return name
+
+
+def _stored_path(request):
+    """The request's path and query string, without the profiling token."""
+    params = request.GET.copy()
+    params.pop(QUERY_PARAM, None)
+    query = params.urlencode()
+    return f'{request.path}?{query}' if query else request.path
+
+
+class ProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = request.headers.get(HEADER) or request.GET.get(QUERY_PARAM)
+        if not token or not token_is_valid(token) or not _busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request)
+        finally:
+            _busy.release()
+
+    def profile(self, request):
+        timings = RequestTimings()
+        sampler = StackSampler(threading.get_ident(), settings.PROFILE_INTERVAL)
+        profile = cProfile.Profile()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        sampler.start()
+        try:
+            with connections['default'].execute_wrapper(timings):
+                profile.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profile.disable()
+                    wall, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        finally:
+            sampler.stop()
+        match = getattr(request, 'resolver_match', None)
+        name = save(profile, sampler, {
+            'created_at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': _stored_path(request),
+            'url_name': match.view_name if match else UNRESOLVED,
+            'status': response.status_code,
+            'wall_ms': round(wall * 1000, 2),
+            'cpu_ms': round(cpu * 1000, 2),
+            'queries': timings.queries,
+            'db_ms': round(timings.db_seconds * 1000, 2),
+            'samples': sum(sampler.stacks.values()),
+            'interval_ms': settings.PROFILE_INTERVAL * 1000,
+        })
+        response[f'{HEADER}-Id'] = name
+        return response
@@ -0,0 +1,196 @@
+"""
+Query budgets per URL name. Each page is rendered against a small and a large
+fixture; it fails its budget if it runs more queries than declared for that
+size, or more queries on the large fixture than on the small one, which is
+how N+1 patterns show up. Failures name the repeated SQL fingerprints with the
+template lines and code that issued them.
+"""
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from accounts.models import Address
+from cart.models import Cart, CartItem, Order, OrderItem
+from cart.reservations import hold
+from .models import Brand, Category, Review, Watch, Wishlist
+from .slowqueries import call_site, fingerprint, normalize
+
+# Rows per collection: watches, reviews per watch, cart lines, orders, items per order, addresses
+SIZES = {'small': 2, 'large': 10}
+
+# Most queries allowed per URL name and size. Every page must also run as many
+# queries on the large fixture as on the small one.
+BUDGETS = {
+    'store:home': {'small': 5, 'large': 5},
+    'store:watch_list': {'small': 5, 'large': 5},
+    'store:watch_detail': {'small': 9, 'large': 9},
+    'store:search': {'small': 5, 'large': 5},
+    'cart:cart': {'small': 6, 'large': 6},
+    'cart:checkout': {'small': 14, 'large': 14},
+    'cart:order_history': {'small': 5, 'large': 5},
+    'cart:order_detail': {'small': 6, 'large': 6},
+    'accounts:profile': {'small': 6, 'large': 6},
+}
+
+# The column list, which makes repeated SELECTs hard to tell apart in a report
+_COLUMNS = re.compile(r'^SELECT .*? FROM')
+# Frames in this module are skipped when reporting where a query came from
+HARNESS = os.path.relpath(__file__, settings.BASE_DIR)
+
+
+class Fixture:
+    """A catalog, a reviewing crowd and one shopper with a cart, orders and addresses, grown in place."""
+
+    def __init__(self):
+        self.brands = [Brand.objects.create(name=f'Budget Brand {i}') for i in range(2)]
+        self.category = Category.objects.create(name='Budget Category')
+        self.shopper = User.objects.create_user('budget_shopper', password='pw')
+        self.cart = Cart.objects.create(user=self.shopper)
+        self.watches = []
+        self.reviewers = []
+        self.orders = []
+
+    def grow(self, rows):
+        while len(self.reviewers) < rows:
+            self.reviewers.append(User.objects.create_user(f'budget_reviewer{len(self.reviewers)}'))
+        while len(self.watches) < rows:
+            i = len(self.watches)
+            watch = Watch.objects.create(
+                brand=self.brands[i % len(self.brands)], category=self.category, name=f'Budget Watch {i}',
+                description='A watch for counting queries.', price=Decimal(100000 + i), stock=50,
+                is_featured=True, is_new_arrival=True, is_bestseller=True,
+            )
+            self.watches.append(watch)
+            CartItem.objects.create(cart=self.cart, watch=watch)
+            hold(self.cart, watch, 1)
+            Wishlist.objects.create(user=self.shopper, watch=watch)
+        for watch in self.watches:
+            for reviewer in self.reviewers[watch.reviews.count():rows]:
+                Review.objects.create(watch=watch, user=reviewer, rating=4, title='Fine', comment='Keeps time.')
+        while len(self.orders) < rows:
+            order = Order.objects.create(
+                user=self.shopper, full_name='Budget Shopper', email='shopper@example.com', phone='9800000000',
+                address_line1='1 Budget Street', city='Mumbai', state='Maharashtra', postal_code='400001',
+                subtotal=Decimal(0), tax=Decimal(0), total=Decimal(0),
+            )
+            self.orders.append(order)
+        for order in self.orders:
+            for watch in self.watches[order.items.count():rows]:
+                OrderItem.objects.create(order=order, watch=watch, watch_name=f'{watch.brand.name} {watch.name}',
+                                         watch_brand=watch.brand.name, price=watch.price)
+        for i in range(self.shopper.addresses.count(), rows):
+            Address.objects.create(user=self.shopper, full_name='Budget Shopper', phone='9800000000',
+                                   address_line1=f'{i} Budget Street', city='Mumbai', state='Maharashtra',
+                                   postal_code='400001', is_default=i == 0)
+
+    def pages(self):
+        """(URL name, client, path) for every budgeted page."""
+        anonymous = Client()
+        shopper = Client()
+        shopper.force_login(self.shopper)
+        yield 'store:home', anonymous, reverse('store:home')
+        yield 'store:watch_list', anonymous, reverse('store:watch_list')
+        yield 'store:watch_detail', shopper, self.watches[0].get_absolute_url()
+        yield 'store:search', anonymous, f'{reverse("store:search")}?q=budget'
+        yield 'cart:cart', shopper, reverse('cart:cart')
+        yield 'cart:checkout', shopper, reverse('cart:checkout')
+        yield 'cart:order_history', shopper, reverse('cart:order_history')
+        yield 'cart:order_detail', shopper, reverse('cart:order_detail', args=[self.orders[0].order_number])
+        yield 'accounts:profile', shopper, reverse('accounts:profile')
+
+
+def template_line():
+    """'template name:line' of the innermost template node being rendered, if any."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            token = getattr(node, 'token', None)
+            if token is not None:
+                return f'{node.origin.template_name or node.origin.name}:{token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+class QueryLog:
+    """Execute wrapper recording each query's fingerprint, template line and call site."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        normalized = normalize(sql)
+        sites = [site for site in call_site() if not site.startswith(HARNESS)]
+        self.queries.append((fingerprint(normalized), normalized, template_line(), sites[-1] if sites else None))
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        """[(count, fingerprint, sql, Counter of origins)] for each fingerprint run more than once, most first."""
+        counts = Counter(query[0] for query in self.queries)
+        sql, origins = {}, defaultdict(Counter)
+        for key, normalized, line, site in self.queries:
+            sql[key] = normalized
+            origins[key][line or site] += 1
+        return [(count, key, sql[key], origins[key]) for key, count in counts.most_common() if count > 1]
+
+
+def measure(func):
+    """Run ``func`` with a cold cache and return its QueryLog."""
+    cache.clear()
+    log = QueryLog()
+    with connection.execute_wrapper(log):
+        func()
+    return log
+
+
+def run(budgets=BUDGETS, sizes=SIZES):
+    """{URL name: {size: QueryLog}}, rendering every page at each size in turn on one growing fixture."""
+    fixture = Fixture()
+    results = defaultdict(dict)
+    for size, rows in sizes.items():
+        fixture.grow(rows)
+        for name, client, path in fixture.pages():
+            if name not in budgets:
+                continue
+
+            def get():
+                response = client.get(path)
+                if response.status_code != 200:
+                    raise AssertionError(f'GET {path} returned {response.status_code}')
+            results[name][size] = measure(get)
+    return results
+
+
+def describe(log, limit=5):
+    lines = []
+    for count, key, sql, origins in log.repeated()[:limit]:
+        lines.append(f'    {count}x {key} {_COLUMNS.sub("SELECT ... FROM", sql, count=1)}')
+        lines.extend(f'        {n}x from {origin}' for origin, n in origins.most_common(3))
+    return lines
+
+
+def check(results, budgets=BUDGETS):
+    """Failure messages for every page over its budget or whose query count grows with the fixture."""
+    failures = []
+    for name, by_size in results.items():
+        sizes = list(by_size)
+        for size, log in by_size.items():
+            allowed = budgets[name][size]
+            if len(log.queries) > allowed:
+                failures.append(f'{name} ({size}): {len(log.queries)} queries, budget {allowed}')
+                failures.extend(describe(log))
+        smallest, largest = by_size[sizes[0]], by_size[sizes[-1]]
+        if len(largest.queries) > len(smallest.queries):
+            failures.append(f'{name}: {len(smallest.queries)} queries ({sizes[0]}) -> '
+                            f'{len(largest.queries)} ({sizes[-1]}), grows with the rows')
+            failures.extend(describe(largest))
+    return failures
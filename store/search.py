@@ -0,0 +1,181 @@
+import re
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .pagination import InvalidCursor, KeysetPage, decode_cursor, encode_cursor
+
+FTS_TABLE = 'store_watch_fts'
+
+# Column weights for bm25(), in table column order
+COLUMN_WEIGHTS = {
+    'name': 10.0,
+    'brand': 8.0,
+    'category': 4.0,
+    'description': 1.0,
+    'reference_number': 6.0,
+    'specs': 2.0,
+}
+
+SPEC_FIELDS = [
+    'case_material', 'case_diameter', 'movement', 'water_resistance',
+    'strap_material', 'dial_color', 'crystal', 'power_reserve',
+]
+
+INDEXED_WATCH_FIELDS = {'name', 'brand', 'category', 'description', 'reference_number', *SPEC_FIELDS}
+
+CREATE_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    {', '.join(COLUMN_WEIGHTS)},
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+DROP_SQL = f'DROP TABLE IF EXISTS {FTS_TABLE}'
+
+POPULATE_SQL = f"""
+INSERT INTO {FTS_TABLE} (rowid, {', '.join(COLUMN_WEIGHTS)})
+SELECT w.id, w.name, b.name, COALESCE(c.name, ''), w.description, w.reference_number,
+       {" || ' ' || ".join(f'w.{field}' for field in SPEC_FIELDS)}
+FROM store_watch w
+JOIN store_brand b ON b.id = w.brand_id
+LEFT JOIN store_category c ON c.id = w.category_id
+"""
+
+BM25 = f"bm25({FTS_TABLE}, {', '.join(str(weight) for weight in COLUMN_WEIGHTS.values())})"
+
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def index_watches(watch_ids):
+    watch_ids = list(watch_ids)
+    if not watch_ids or not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({_placeholders(watch_ids)})', watch_ids)
+        cursor.execute(f'{POPULATE_SQL} WHERE w.id IN ({_placeholders(watch_ids)})', watch_ids)
+
+
+def remove_watches(watch_ids):
+    watch_ids = list(watch_ids)
+    if not watch_ids or not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({_placeholders(watch_ids)})', watch_ids)
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_SQL)
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(POPULATE_SQL)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 expression: every word must match, and the last
+    one may be a prefix. Quoting each term keeps FTS5 operators in user input
+    from being interpreted.
+    """
+    terms = re.findall(r'\w+', query.lower())
+    if not terms:
+        return ''
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _render_snippet(snippet):
+    html = escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+    return mark_safe(html)
+
+
+def count_matches(query):
+    match = build_match_query(query)
+    if not match:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT count(*) FROM {FTS_TABLE} JOIN store_watch w ON w.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s AND w.is_active',
+            [match],
+        )
+        return cursor.fetchone()[0]
+
+
+def search_page(query, queryset, cursor=None, per_page=24):
+    """
+    Return a KeysetPage of watches matching ``query`` ordered by bm25 relevance,
+    with a highlighted ``search_snippet`` attached to each watch. Pages seek on
+    (score, id) so deep pages cost the same as the first one.
+    """
+    match = build_match_query(query)
+    if not match:
+        return KeysetPage([])
+
+    direction, values = decode_cursor(cursor) if cursor else ('next', None)
+    reverse = direction == 'prev'
+    op, order = ('<', 'DESC') if reverse else ('>', 'ASC')
+
+    sql = (
+        f'SELECT id, score FROM ('
+        f'SELECT {FTS_TABLE}.rowid AS id, {BM25} AS score FROM {FTS_TABLE} '
+        f'JOIN store_watch w ON w.id = {FTS_TABLE}.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s AND w.is_active)'
+    )
+    params = [match]
+    if values is not None:
+        try:
+            score, pk = float(values[0]), int(values[1])
+        except (IndexError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        sql += f' WHERE score {op} %s OR (score = %s AND id {op} %s)'
+        params += [score, score, pk]
+    sql += f' ORDER BY score {order}, id {order} LIMIT %s'
+    params.append(per_page + 1)
+
+    with connection.cursor() as db:
+        db.execute(sql, params)
+        rows = db.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+    if not rows:
+        return KeysetPage([])
+
+    ids = [row[0] for row in rows]
+    with connection.cursor() as db:
+        db.execute(
+            f"SELECT rowid, snippet({FTS_TABLE}, -1, %s, %s, '…', 16) FROM {FTS_TABLE} "
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid IN ({_placeholders(ids)})',
+            [SNIPPET_START, SNIPPET_END, match, *ids],
+        )
+        snippets = dict(db.fetchall())
+
+    watches = queryset.in_bulk(ids)
+    page = []
+    for watch_id in ids:
+        watch = watches.get(watch_id)
+        if watch is not None:
+            watch.search_snippet = _render_snippet(snippets.get(watch_id, ''))
+            page.append(watch)
+
+    first = encode_cursor('prev', list(rows[0][::-1]))
+    last = encode_cursor('next', list(rows[-1][::-1]))
+    if reverse:
+        return KeysetPage(page, next_cursor=last, prev_cursor=first if has_more else None)
+    return KeysetPage(page, next_cursor=last if has_more else None, prev_cursor=first if values else None)
@@ -0,0 +1,104 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import images, search, slowqueries, suggest
+from .catalog import bump_version
+from .context_processors import CATEGORIES_CACHE_KEY
+from .models import Brand, Category, Review, Watch
+
+
+@receiver(post_save, sender=Watch)
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def refresh_image_previews(sender, instance, raw=False, **kwargs):
+    # After the save, so new uploads have been stored under their final names
+    if not raw and images.refresh_previews(instance):
+        sender.objects.filter(pk=instance.pk).update(image_previews=instance.image_previews)
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Watch(pk=instance.watch_id).refresh_rating()
+    previous = getattr(instance, '_loaded_watch_id', None)
+    if previous and previous != instance.watch_id:
+        Watch(pk=previous).refresh_rating()
+    instance._loaded_watch_id = instance.watch_id
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    Watch(pk=instance.watch_id).refresh_rating()
+
+
+@receiver(post_save, sender=Watch)
+def index_watch(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if not update_fields or search.INDEXED_WATCH_FIELDS.intersection(update_fields):
+        search.index_watches([instance.pk])
+    if not update_fields or suggest.INDEXED_WATCH_FIELDS.intersection(update_fields):
+        suggest.watch_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Watch)
+def unindex_watch(sender, instance, **kwargs):
+    search.remove_watches([instance.pk])
+    suggest.watch_removed(instance.pk)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def reindex_related_watches(sender, instance, raw=False, created=False, **kwargs):
+    if raw or created:
+        return
+    search.index_watches(instance.watches.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Brand)
+def update_brand_suggestions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        suggest.brand_changed(instance)
+
+
+@receiver(post_delete, sender=Brand)
+def remove_brand_suggestions(sender, instance, **kwargs):
+    suggest.brand_removed(instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_watches(sender, instance, **kwargs):
+    instance._indexed_watch_ids = list(instance.watches.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorized_watches(sender, instance, **kwargs):
+    search.index_watches(getattr(instance, '_indexed_watch_ids', []))
+
+
+@receiver(post_save, sender=Watch)
+@receiver(post_delete, sender=Watch)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_catalog_version(sender, **kwargs):
+    # Bump after commit so no reader can cache pre-commit data under the new version
+    transaction.on_commit(bump_version)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def forget_nav_categories(sender, **kwargs):
+    transaction.on_commit(lambda: cache.delete(CATEGORIES_CACHE_KEY))
+
+
+@receiver(connection_created)
+def sample_slow_queries(sender, connection, **kwargs):
+    slowqueries.install(connection)
@@ -0,0 +1,169 @@
+"""
+Slow-query sampling. Every database connection gets an execute wrapper; a
+statement slower than SLOW_QUERY_MS is, with probability
+SLOW_QUERY_SAMPLE_RATE, written to the SLOW_QUERY_LOG JSONL file with its
+normalized SQL, the project frames that issued it, the shape of its
+parameters and, on SQLite, its EXPLAIN QUERY PLAN. ``manage.py slow_queries``
+groups the log by fingerprint.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import traceback
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.utils import timezone
+
+# Statements EXPLAIN QUERY PLAN can describe without executing them
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+STACK_DEPTH = 8
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+_local = threading.local()
+_logger = logging.getLogger(__name__)
+_logger.propagate = False
+_handler_lock = threading.Lock()
+_handler_key = [None]
+
+
+def normalize(sql):
+    """The statement with literals and placeholders as ``?`` and IN lists collapsed, so variants group together."""
+    sql = _STRING.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBER.sub('?', sql)
+    sql = _LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def params_shape(params, many):
+    """Parameter types rather than values, so logs hold no customer data."""
+    if many:
+        rows = list(params or [])
+        return {'rows': len(rows), 'types': [type(value).__name__ for value in rows[0]] if rows else []}
+    if isinstance(params, dict):
+        return {'types': {key: type(value).__name__ for key, value in params.items()}}
+    return {'types': [type(value).__name__ for value in params or ()]}
+
+
+def call_site():
+    """The innermost project frames (not Django, not site-packages) that led to the query."""
+    root = str(settings.BASE_DIR)
+    frames = [
+        f'{os.path.relpath(frame.filename, root)}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(root) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return frames[-STACK_DEPTH:]
+
+
+def query_plan(connection, sql, params):
+    if connection.vendor != 'sqlite' or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    # A cursor of our own, outside the execute wrappers and the debug query log
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[3] for row in cursor.fetchall()]
+    except Exception as e:
+        return [f'unavailable: {e}']
+    finally:
+        cursor.close()
+
+
+def plan_flags(plan):
+    """'full_scan' for a table read without an index, 'temp_btree' for a sort or grouping that needs one."""
+    flags = set()
+    for detail in plan or ():
+        if detail.startswith('SCAN ') and ' USING ' not in detail and not detail.startswith('SCAN CONSTANT'):
+            flags.add('full_scan')
+        if 'USE TEMP B-TREE' in detail:
+            flags.add('temp_btree')
+    return sorted(flags)
+
+
+def _log():
+    """The logger, with a rotating handler for the current SLOW_QUERY_LOG settings."""
+    key = (os.path.abspath(settings.SLOW_QUERY_LOG), settings.SLOW_QUERY_LOG_BYTES, settings.SLOW_QUERY_LOG_BACKUPS)
+    if _handler_key[0] != key:
+        with _handler_lock:
+            if _handler_key[0] != key:
+                path, max_bytes, backups = key
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                for old in _logger.handlers:
+                    _logger.removeHandler(old)
+                    old.close()
+                _logger.addHandler(RotatingFileHandler(
+                    path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True,
+                ))
+                _logger.setLevel(logging.INFO)
+                _handler_key[0] = key
+    return _logger
+
+
+def sample(execute, sql, params, many, context):
+    threshold = settings.SLOW_QUERY_MS
+    if threshold is None or getattr(_local, 'sampling', False):
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    elapsed = (time.perf_counter() - started) * 1000
+    if elapsed < threshold or random.random() >= settings.SLOW_QUERY_SAMPLE_RATE:
+        return result
+
+    _local.sampling = True
+    try:
+        connection = context['connection']
+        normalized = normalize(sql)
+        plan = None if many else query_plan(connection, sql, params)
+        _log().info(json.dumps({
+            'at': timezone.now().isoformat(),
+            'ms': round(elapsed, 3),
+            'fingerprint': fingerprint(normalized),
+            'sql': normalized,
+            'database': connection.alias,
+            'params': params_shape(params, many),
+            'stack': call_site(),
+            'plan': plan,
+            'flags': plan_flags(plan),
+        }))
+    except Exception:
+        # Sampling must never break the query that was sampled
+        pass
+    finally:
+        _local.sampling = False
+    return result
+
+
+def install(connection):
+    # First, so the execute_wrapper() context managers pushed and popped around it stay balanced
+    if sample not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, sample)
+
+
+def read(path):
+    """Samples from the log and its rotated backups, oldest first."""
+    paths = [f'{path}.{i}' for i in range(settings.SLOW_QUERY_LOG_BACKUPS, 0, -1)] + [str(path)]
+    for name in paths:
+        try:
+            with open(name, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
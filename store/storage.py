@@ -0,0 +1,91 @@
+import hashlib
+import os
+from collections import Counter
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Count, FileField
+
+BLOBS_DIR = 'blobs'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_digest(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    return f'{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOBS_DIR}/')
+
+
+def file_fields():
+    """{model: [field names]} for every FileField stored in a ContentAddressedStorage, whatever its app."""
+    fields = {}
+    for model in apps.get_models():
+        names = [
+            field.name for field in model._meta.concrete_fields
+            if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+        ]
+        if names:
+            fields[model] = names
+    return fields
+
+
+def reference_counts():
+    """How many file fields point at each stored name."""
+    counts = Counter()
+    for model, fields in file_fields().items():
+        for field in fields:
+            rows = model.objects.filter(**{f'{field}__gt': ''}).order_by().values_list(field)
+            for name, count in rows.annotate(count=Count('pk')):
+                counts[name] += count
+    return counts
+
+
+def references(name):
+    return sum(
+        model.objects.filter(**{field: name}).count()
+        for model, fields in file_fields().items() for field in fields
+    )
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every upload under the SHA-256 of its content, so identical images
+    share one file however many times and under whatever names they are
+    uploaded. A blob is only deleted once no file field references it.
+    """
+
+    def _save(self, name, content):
+        target = blob_name(content_digest(content), name)
+        if self.exists(target):
+            try:
+                # Fresh again, so a collection running before this upload's row is saved keeps it
+                os.utime(self.path(target))
+                return target
+            except FileNotFoundError:
+                # Collected in the meantime; store it again
+                pass
+        saved = super()._save(target, content)
+        if saved != target:
+            # Another process stored the same content in the meantime
+            super().delete(saved)
+        return target
+
+    def delete(self, name):
+        # FieldFile.delete() calls this while its own row still points at the blob
+        if is_blob(name) and references(name) > 1:
+            return
+        super().delete(name)
@@ -0,0 +1,230 @@
+import re
+import threading
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+
+from .models import Brand, Watch
+
+TOP_K = 8
+
+INDEXED_WATCH_FIELDS = {'name', 'brand', 'reference_number', 'slug', 'is_active'}
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def suffix_keys(text):
+    """'Rolex Submariner 41' -> 'rolex submariner 41', 'submariner 41', '41'"""
+    words = normalize(text).split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class Entry:
+    __slots__ = ('key', 'kind', 'label', 'slug', 'popularity')
+
+    def __init__(self, key, kind, label, slug, popularity):
+        self.key = key
+        self.kind = kind
+        self.label = label
+        self.slug = slug
+        self.popularity = popularity
+
+    def rank(self):
+        return (-self.popularity, self.label)
+
+    def url(self):
+        if self.kind == 'brand':
+            return reverse('store:watch_list') + f'?brand={self.slug}'
+        return reverse('store:watch_detail', kwargs={'slug': self.slug})
+
+    def as_dict(self):
+        return {'type': self.kind, 'label': self.label, 'url': self.url()}
+
+
+class Node:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = set()
+        # Cached best TOP_K entries for this subtree; None when it must be recomputed
+        self.top = []
+
+
+class PrefixIndex:
+    """
+    A character trie over suggestion keys. Each node caches the TOP_K most
+    popular entries of its subtree, so a lookup only walks the prefix. Inserts
+    merge into the cached lists along the path; removals just drop the cache on
+    affected nodes and let the next lookup refill it.
+    """
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.root = Node()
+        self.keys = {}
+        self.lock = threading.RLock()
+
+    def _path(self, key, create=False):
+        node = self.root
+        path = [node]
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return path, None
+                child = node.children[char] = Node()
+            node = child
+            path.append(node)
+        return path, node
+
+    def add(self, entry, keys):
+        with self.lock:
+            self.remove(entry.key)
+            self.keys[entry.key] = (entry, keys)
+            for key in keys:
+                path, node = self._path(key, create=True)
+                node.entries.add(entry)
+                for step in path:
+                    if step.top is not None:
+                        step.top = sorted({*step.top, entry}, key=Entry.rank)[:self.k]
+
+    def load(self, items):
+        """Bulk insert for the initial build; top lists are filled lazily on lookup."""
+        with self.lock:
+            for entry, keys in items:
+                self.keys[entry.key] = (entry, keys)
+                for key in keys:
+                    self._path(key, create=True)[1].entries.add(entry)
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                node.top = None
+                stack.extend(node.children.values())
+
+    def remove(self, entry_key):
+        with self.lock:
+            entry, keys = self.keys.pop(entry_key, (None, ()))
+            for key in keys:
+                path, node = self._path(key)
+                if node is None:
+                    continue
+                node.entries.discard(entry)
+                for step in path:
+                    if step.top is not None and entry in step.top:
+                        step.top = None
+
+    def _collect(self, node):
+        found = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.top is not None and len(current.top) < self.k:
+                # A short cached list means it already holds the whole subtree
+                found.update(current.top)
+                continue
+            found.update(current.entries)
+            stack.extend(current.children.values())
+        return sorted(found, key=Entry.rank)[:self.k]
+
+    def lookup(self, prefix, limit=None):
+        _, node = self._path(normalize(prefix))
+        if node is None:
+            return []
+        top = node.top
+        if top is None:
+            with self.lock:
+                top = node.top = self._collect(node)
+        return top[:limit or self.k]
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def _watch_entry(pk, name, brand_name, reference_number, slug, popularity):
+    entry = Entry(('watch', pk), 'watch', f'{brand_name} {name}', slug, popularity)
+    keys = suffix_keys(f'{brand_name} {name}')
+    if reference_number:
+        keys.add(normalize(reference_number))
+    return entry, keys
+
+
+def _brand_entry(pk, name, slug, popularity):
+    entry = Entry(('brand', pk), 'brand', name, slug, popularity)
+    return entry, suffix_keys(name)
+
+
+def _watch_rows(**filters):
+    return Watch.objects.filter(is_active=True, **filters).values_list(
+        'pk', 'name', 'brand__name', 'reference_number', 'slug', 'review_count',
+    )
+
+
+def _brand_popularity():
+    # A brand ranks at least as high as its most reviewed model
+    active = Q(watches__is_active=True)
+    return Count('watches', filter=active) + Coalesce(Sum('watches__review_count', filter=active), 0)
+
+
+def build_index():
+    index = PrefixIndex()
+    brands = Brand.objects.annotate(popularity=_brand_popularity())
+    index.load(_brand_entry(*row) for row in brands.values_list('pk', 'name', 'slug', 'popularity'))
+    index.load(_watch_entry(*row) for row in _watch_rows())
+    return index
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _index = build_index()
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def suggest(prefix, limit=None):
+    if not normalize(prefix):
+        return []
+    return [entry.as_dict() for entry in get_index().lookup(prefix, limit)]
+
+
+# Incremental maintenance, called from store.signals. Nothing happens until
+# the index has been built in this process.
+
+def watch_changed(watch_id):
+    if _index is None:
+        return
+    rows = list(_watch_rows(pk=watch_id))
+    if rows:
+        _index.add(*_watch_entry(*rows[0]))
+    else:
+        _index.remove(('watch', watch_id))
+
+
+def watch_removed(watch_id):
+    if _index is not None:
+        _index.remove(('watch', watch_id))
+
+
+def brand_changed(brand):
+    if _index is None:
+        return
+    popularity = Brand.objects.filter(pk=brand.pk).aggregate(popularity=_brand_popularity())['popularity']
+    _index.add(*_brand_entry(brand.pk, brand.name, brand.slug, popularity))
+    for row in _watch_rows(brand=brand):
+        _index.add(*_watch_entry(*row))
+
+
+def brand_removed(brand_id):
+    if _index is not None:
+        _index.remove(('brand', brand_id))
@@ -1,7 +1,12 @@
 from django import template
+from django.utils.html import format_html
+
+from store import images
 
 register = template.Library()
 
+CARD_SIZES = '(max-width: 600px) 50vw, (max-width: 1024px) 33vw, 300px'
+
 
 @register.filter
 def currency_inr(value):
@@ -39,3 +44,49 @@ def mul(value, arg):
         return float(value) * float(arg)
     except (ValueError, TypeError):
         return 0
+
+
+@register.simple_tag(takes_context=True)
+def url_replace(context, **kwargs):
+    params = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        if value is None:
+            params.pop(key, None)
+        else:
+            params[key] = str(value)
+    return params.urlencode()
+
+
+@register.simple_tag
+def preview_style(image):
+    """style attribute painting the image's placeholder and dominant colour behind an <img>."""
+    preview = images.preview_for(image) if image else None
+    if preview is None:
+        return ''
+    return format_html(
+        ' style="background-color:{};background-image:url({});background-size:cover"',
+        preview['color'], preview['placeholder'],
+    )
+
+
+@register.simple_tag
+def responsive_image(image, alt='', sizes=CARD_SIZES, loading='lazy'):
+    """
+    <picture> with WebP and JPEG srcsets from build_image_derivatives. Falls
+    back to the original file until its derivatives have been built. The img
+    is painted with the image's blurred placeholder and dominant colour while
+    it loads.
+    """
+    if not image:
+        return ''
+    style = preview_style(image)
+    sets = images.srcsets(image.name)
+    if sets is None:
+        return format_html('<img src="{}" alt="{}" loading="{}"{}>', image.url, alt, loading, style)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" loading="{}" decoding="async"{}>'
+        '</picture>',
+        sets['webp'], sizes, sets['fallback'], sets['jpeg'], sizes, sets['width'], sets['height'], alt, loading,
+        style,
+    )
@@ -1,3 +1,1124 @@
-from django.test import TestCase
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.template import Context, Template
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from PIL import Image
+
+from cart.models import Cart, CartSummary, Order
+
+from . import (
+    benchmarks, facets, images, loadtest, metrics, profiler, querybudget, search, slowqueries, storage, suggest,
+)
+from .facets import compute_facets
+from .models import Brand, Category, Review, Watch
+from .views import immutable_media
+
+
+def make_watch(brand, name, **kwargs):
+    kwargs.setdefault('price', Decimal('100000'))
+    kwargs.setdefault('description', f'{name} description')
+    return Watch.objects.create(brand=brand, name=name, **kwargs)
+
+
+class RatingAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name='Rolex')
+        cls.category = Category.objects.create(name='Dive')
+        cls.watch = make_watch(cls.brand, 'Submariner', category=cls.category)
+        cls.other = make_watch(cls.brand, 'Datejust', category=cls.category)
+        cls.alice = User.objects.create_user('alice', password='pw')
+        cls.bob = User.objects.create_user('bob', password='pw')
+
+    def review(self, user, rating, watch=None):
+        return Review.objects.create(watch=watch or self.watch, user=user, rating=rating, title='t', comment='c')
+
+    def test_create_and_delete_keep_aggregates(self):
+        first = self.review(self.alice, 5)
+        self.review(self.bob, 2)
+        self.watch.refresh_from_db()
+        self.assertEqual((self.watch.rating_sum, self.watch.review_count, self.watch.avg_rating), (7, 2, 3.5))
+
+        first.delete()
+        self.watch.refresh_from_db()
+        self.assertEqual((self.watch.rating_sum, self.watch.review_count, self.watch.avg_rating), (2, 1, 2.0))
+
+    def test_edit_moves_rating_between_watches(self):
+        review = self.review(self.alice, 4)
+        review = Review.objects.get(pk=review.pk)
+        review.watch = self.other
+        review.rating = 3
+        review.save()
+        self.watch.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.watch.review_count, self.watch.avg_rating), (0, 0))
+        self.assertEqual((self.other.review_count, self.other.avg_rating), (1, 3.0))
+
+    def test_saving_a_stale_instance_keeps_aggregates(self):
+        stale = Watch.objects.get(pk=self.watch.pk)
+        self.review(self.alice, 5)
+        stale.price = Decimal('120000')
+        stale.save()
+        self.watch.refresh_from_db()
+        self.assertEqual((self.watch.rating_sum, self.watch.review_count, self.watch.avg_rating), (5, 1, 5.0))
+        self.assertEqual(self.watch.price, Decimal('120000'))
+
+    def test_add_review_view_updates_aggregates(self):
+        self.client.force_login(self.alice)
+        url = reverse('store:add_review', kwargs={'slug': self.watch.slug})
+        self.client.post(url, {'rating': 4, 'title': 'Great', 'comment': 'Lovely'})
+        self.watch.refresh_from_db()
+        self.assertEqual((self.watch.review_count, self.watch.avg_rating), (1, 4.0))
+
+    def test_recompute_ratings_command(self):
+        self.review(self.alice, 5)
+        self.review(self.bob, 4)
+        Watch.objects.update(rating_sum=0, review_count=0, avg_rating=0)
+        call_command('recompute_ratings', stdout=StringIO())
+        self.watch.refresh_from_db()
+        self.assertEqual((self.watch.rating_sum, self.watch.review_count, self.watch.avg_rating), (9, 2, 4.5))
+
+    def test_rating_sort_uses_stored_column(self):
+        self.review(self.alice, 5, watch=self.other)
+        self.review(self.alice, 3)
+        response = self.client.get(reverse('store:watch_list'), {'sort': 'rating'})
+        self.assertEqual(list(response.context['watches']), [self.other, self.watch])
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = Brand.objects.create(name='Omega')
+        for i in range(30):
+            # Repeat prices and names so tie-breaking on pk is exercised
+            make_watch(brand, f'Model {i % 7}-{i}', price=Decimal(1000 + (i % 5) * 100))
+
+    def walk(self, sort='newest', url=None, **extra):
+        url = url or reverse('store:watch_list')
+        seen, cursor = [], None
+        while True:
+            params = {'sort': sort, 'format': 'json', **extra}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(url, params).json()
+            seen.append(data['count'])
+            cursor = data['next_cursor']
+            if not cursor:
+                return seen
+
+    def test_pages_cover_every_sort_without_gaps(self):
+        from .views import SORT_ORDERS, WATCHES_PER_PAGE
+        for sort in SORT_ORDERS:
+            with self.subTest(sort=sort):
+                self.assertEqual(self.walk(sort), [WATCHES_PER_PAGE, 30 - WATCHES_PER_PAGE])
+
+    def test_next_and_previous_pages_match_full_ordering(self):
+        expected = list(Watch.objects.order_by('price', 'pk'))
+        first = self.client.get(reverse('store:watch_list'), {'sort': 'price_low'}).context['watches']
+        self.assertEqual(list(first), expected[:24])
+        self.assertFalse(first.has_previous)
+
+        second = self.client.get(reverse('store:watch_list'), {'sort': 'price_low', 'cursor': first.next_cursor}).context['watches']
+        self.assertEqual(list(second), expected[24:])
+        self.assertFalse(second.has_next)
+
+        back = self.client.get(reverse('store:watch_list'), {'sort': 'price_low', 'cursor': second.prev_cursor}).context['watches']
+        self.assertEqual(list(back), expected[:24])
+
+    def test_ranked_search_pages(self):
+        self.assertEqual(self.walk(url=reverse('store:search'), q='model'), [24, 6])
+
+    def test_garbage_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('store:search'), {'q': 'Model', 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['watches']), 24)
+        self.assertEqual(response.context['total_count'], 30)
+
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rolex = Brand.objects.create(name='Rolex')
+        cls.omega = Brand.objects.create(name='Omega')
+        cls.dive = Category.objects.create(name='Dive')
+        cls.submariner = make_watch(cls.rolex, 'Submariner', category=cls.dive, reference_number='M126610LN',
+                                    description='A diving watch with a ceramic bezel.')
+        cls.speedmaster = make_watch(cls.omega, 'Speedmaster', movement='Calibre 3861',
+                                     description='The moonwatch, worn on every lunar mission.')
+
+    def results(self, q):
+        return list(self.client.get(reverse('store:search'), {'q': q}).context['watches'])
+
+    def test_matches_across_fields_ranked_by_relevance(self):
+        self.assertEqual(self.results('rolex'), [self.submariner])
+        self.assertEqual(self.results('m1266'), [self.submariner])
+        self.assertEqual(self.results('calibre 3861'), [self.speedmaster])
+        self.assertEqual(self.results('dive'), [self.submariner])
+
+        heritage = make_watch(self.omega, 'Seamaster Moon', description='Nothing else.')
+        self.assertEqual(self.results('moon'), [heritage, self.speedmaster])
+
+    def test_snippet_is_highlighted_and_escaped(self):
+        make_watch(self.omega, 'Constellation', description='<b>lunar</b> phase display')
+        watches = self.results('lunar')
+        snippets = {w.name: str(w.search_snippet) for w in watches}
+        self.assertIn('<mark>lunar</mark>', snippets['Speedmaster'])
+        self.assertIn('&lt;b&gt;<mark>lunar</mark>&lt;/b&gt;', snippets['Constellation'])
+
+    def test_signals_keep_index_in_sync(self):
+        self.rolex.name = 'Tudor'
+        self.rolex.save()
+        self.assertEqual(self.results('tudor'), [self.submariner])
+        self.assertEqual(self.results('rolex'), [])
+
+        self.dive.delete()
+        self.assertEqual(self.results('dive'), [])
+
+        self.speedmaster.delete()
+        self.assertEqual(self.results('moonwatch'), [])
+
+    def test_operators_in_query_are_treated_as_text(self):
+        response = self.client.get(reverse('store:search'), {'q': 'sub* OR "NEAR('})
+        self.assertEqual(response.status_code, 200)
+
+    def test_rebuild_command(self):
+        from . import search
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.results('submariner'), [self.submariner])
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rolex = Brand.objects.create(name='Rolex')
+        cls.patek = Brand.objects.create(name='Patek Philippe')
+        cls.submariner = make_watch(cls.rolex, 'Submariner Date', reference_number='126610LN', review_count=5)
+        cls.sky = make_watch(cls.rolex, 'Sky-Dweller', review_count=9)
+        cls.nautilus = make_watch(cls.patek, 'Nautilus 5711')
+
+    def setUp(self):
+        suggest.reset_index()
+        self.addCleanup(suggest.reset_index)
+
+    def labels(self, q, **params):
+        response = self.client.get(reverse('store:suggest'), {'q': q, **params})
+        return [s['label'] for s in response.json()['suggestions']]
+
+    def test_prefix_matches_brands_names_and_references(self):
+        self.assertEqual(self.labels('rol'), ['Rolex', 'Rolex Sky-Dweller', 'Rolex Submariner Date'])
+        self.assertEqual(self.labels('s'), ['Rolex Sky-Dweller', 'Rolex Submariner Date'])
+        self.assertEqual(self.labels('1266'), ['Rolex Submariner Date'])
+        self.assertEqual(self.labels('phil'), ['Patek Philippe', 'Patek Philippe Nautilus 5711'])
+        self.assertEqual(self.labels('rol', limit=1), ['Rolex'])
+        self.assertEqual(self.labels(''), [])
+
+    def test_index_follows_catalog_changes(self):
+        self.labels('x')
+        with self.assertNumQueries(0):
+            self.labels('nau')
+
+        self.nautilus.name = 'Aquanaut'
+        self.nautilus.save()
+        self.assertEqual(self.labels('nau'), [])
+        self.assertEqual(self.labels('aqua'), ['Patek Philippe Aquanaut'])
+
+        self.patek.name = 'Patek'
+        self.patek.save()
+        self.assertEqual(self.labels('patek'), ['Patek', 'Patek Aquanaut'])
+
+        self.sky.is_active = False
+        self.sky.save()
+        self.assertEqual(self.labels('s'), ['Rolex Submariner Date'])
+
+        self.submariner.delete()
+        self.assertEqual(self.labels('s'), [])
+
+    def test_top_k_by_popularity(self):
+        index = suggest.PrefixIndex(k=3)
+        index.load(
+            (suggest.Entry(('watch', i), 'watch', f'Model {i}', f'model-{i}', i), {f'model {i}'})
+            for i in range(20)
+        )
+        self.assertEqual([e.popularity for e in index.lookup('mod')], [19, 18, 17])
+        index.remove(('watch', 19))
+        index.add(suggest.Entry(('watch', 50), 'watch', 'Model 50', 'model-50', 50), {'model 50'})
+        self.assertEqual([e.popularity for e in index.lookup('mod')], [50, 18, 17])
+        self.assertEqual([e.popularity for e in index.lookup('model 1')], [18, 17, 16])
+
+
+class FacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rolex = Brand.objects.create(name='Rolex')
+        cls.omega = Brand.objects.create(name='Omega')
+        cls.dive = Category.objects.create(name='Dive')
+        cls.dress = Category.objects.create(name='Dress')
+        make_watch(cls.rolex, 'Submariner', category=cls.dive, price=Decimal('900000'))
+        make_watch(cls.rolex, 'Datejust', category=cls.dress, price=Decimal('700000'))
+        make_watch(cls.omega, 'Seamaster', category=cls.dive, price=Decimal('400000'))
+        make_watch(cls.omega, 'Speedmaster', price=Decimal('600000'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_each_facet_ignores_its_own_filter(self):
+        facets = compute_facets(brand_id=self.rolex.pk, category_id=self.dive.pk)
+        self.assertEqual(facets['brands'], {self.rolex.pk: 1, self.omega.pk: 1})
+        self.assertEqual(facets['categories'], {self.dive.pk: 1, self.dress.pk: 1})
+        self.assertEqual(facets['total'], 1)
+
+        facets = compute_facets(min_price=Decimal('500000'))
+        self.assertEqual(facets['brands'], {self.rolex.pk: 2, self.omega.pk: 1})
+        self.assertEqual([b['count'] for b in facets['price']], [1, 3, 0, 0, 0, 0])
+        self.assertEqual(facets['total'], 3)
+
+    def test_cube_is_grouped_by_price_bucket(self):
+        make_watch(self.rolex, 'Daytona', category=self.dive, price=Decimal('950000.50'))
+        cube = facets.get_cube()
+        self.assertIn((self.rolex.pk, self.dive.pk, 1, 2), cube)
+        self.assertEqual(len(cube), 4)
+
+    def test_free_form_prices_are_counted_exactly_and_not_cached(self):
+        expected = compute_facets(min_price=Decimal('350000'), max_price=Decimal('750000'))
+        self.assertEqual(expected['total'], 3)
+        self.assertEqual(expected['brands'], {self.rolex.pk: 1, self.omega.pk: 2})
+        # The histogram ignores the price filter and still comes from the cube
+        self.assertEqual([b['count'] for b in expected['price']], [1, 3, 0, 0, 0, 0])
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(facets.get_facets(min_price=Decimal('350000'), max_price=Decimal('750000')), expected)
+            facets.get_facets(min_price=Decimal('350001'), max_price=Decimal('750000'))
+        # The cube once, then one grouped COUNT per free-form range
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_histogram_links_are_served_from_the_cube(self):
+        response = self.client.get(reverse('store:watch_list'))
+        bucket = response.context['price_histogram'][1]
+        self.assertContains(response, 'min_price=500000&amp;max_price=999999.99')
+        self.assertEqual(facets.bucket_span(bucket['min'], bucket['max_price']), (1, 1))
+        self.assertIsNone(facets.bucket_span(Decimal('500000'), Decimal('999999')))
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('store:watch_list'),
+                                       {'min_price': bucket['min'], 'max_price': bucket['max_price']})
+        self.assertEqual(response.context['total_count'], 3)
+
+    def test_sidebar_is_served_from_cache_until_catalog_changes(self):
+        url = reverse('store:watch_list')
+        response = self.client.get(url, {'brand': 'omega'})
+        counts = {b.name: b.facet_count for b in response.context['brands']}
+        self.assertEqual(counts, {'Omega': 2, 'Rolex': 2})
+        self.assertEqual(response.context['total_count'], 2)
+
+        # brands, categories and the page; no facet or navbar queries on a repeat view
+        with self.assertNumQueries(3):
+            self.client.get(url, {'brand': 'omega'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_watch(self.omega, 'Aqua Terra', price=Decimal('500000'))
+        response = self.client.get(url, {'brand': 'omega'})
+        self.assertEqual(response.context['total_count'], 3)
+
+    def test_navbar_categories_are_cached_until_a_category_changes(self):
+        self.client.get(reverse('store:watch_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Pilot')
+        self.assertContains(self.client.get(reverse('store:home')), '?category=pilot')
+
+    def test_bad_filters_do_not_error(self):
+        response = self.client.get(reverse('store:watch_list'), {'brand': 'nope', 'min_price': 'abc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_count'], 0)
+
+
+class HomeFragmentCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name='Rolex')
+        cls.category = Category.objects.create(name='Dive')
+        cls.watch = make_watch(cls.brand, 'Submariner', category=cls.category, is_featured=True)
+        cls.user = User.objects.create_user('alice', password='pw')
+
+    def setUp(self):
+        cache.clear()
+
+    def catalog_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('store:home'))
+        tables = ('"store_watch"', '"store_brand"', '"store_review"')
+        return response, [q['sql'] for q in ctx.captured_queries if any(t in q['sql'] for t in tables)]
+
+    def test_repeat_views_run_no_catalog_queries(self):
+        response, queries = self.catalog_queries()
+        self.assertContains(response, 'Submariner')
+        self.assertTrue(queries)
+
+        response, queries = self.catalog_queries()
+        self.assertContains(response, 'Submariner')
+        self.assertEqual(queries, [])
+
+    def test_cached_fragments_hold_no_csrf_token(self):
+        first, second = Client(enforce_csrf_checks=True), Client(enforce_csrf_checks=True)
+        first.get(reverse('store:home'))
+        response = second.get(reverse('store:home'))
+        self.assertContains(response, reverse('cart:add_to_cart', args=[self.watch.pk]))
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+        self.assertNotIn(first.cookies['csrftoken'].value, response.content.decode())
+
+    def test_catalog_changes_refresh_fragments(self):
+        self.catalog_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(watch=self.watch, user=self.user, rating=4, title='t', comment='c')
+        response, queries = self.catalog_queries()
+        self.assertTrue(queries)
+        self.assertContains(response, '<span>(1)</span>', html=False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.watch.name = 'Sea-Dweller'
+            self.watch.save()
+        self.assertContains(self.client.get(reverse('store:home')), 'Sea-Dweller')
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(images.reset_manifest_cache)
+        os.makedirs(os.path.join(self.media, 'watches'))
+        os.makedirs(os.path.join(self.media, 'brands'))
+        Image.new('RGB', (1000, 800), (120, 30, 30)).save(os.path.join(self.media, 'watches', 'big.jpg'))
+        Image.new('RGBA', (300, 300), (0, 0, 255, 128)).save(os.path.join(self.media, 'brands', 'logo.png'))
+
+    def build(self, *args):
+        out = StringIO()
+        call_command('build_image_derivatives', '--workers=1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_builds_every_width_and_format_under_hashed_names(self):
+        self.assertIn('Built 2 images, 0 unchanged', self.build())
+        manifest = images.read_manifest()
+        self.assertEqual(sorted(manifest), ['brands/logo.png', 'watches/big.jpg'])
+        self.assertEqual(manifest['watches/big.jpg']['widths'], [240, 480, 800])
+        self.assertEqual(manifest['brands/logo.png']['widths'], [240, 300])
+
+        entry = manifest['watches/big.jpg']
+        with Image.open(os.path.join(self.media, images.derivative_name(entry['hash'], 480, 'webp'))) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (480, 384)))
+        logo = manifest['brands/logo.png']
+        with Image.open(os.path.join(self.media, images.derivative_name(logo['hash'], 300, 'jpeg'))) as image:
+            self.assertEqual((image.format, image.mode), ('JPEG', 'RGB'))
+
+    def test_unchanged_sources_are_skipped_and_changed_ones_rebuilt(self):
+        self.build()
+        self.assertIn('Built 0 images, 2 unchanged', self.build())
+
+        # Touched but identical content still counts as unchanged after hashing
+        path = os.path.join(self.media, 'watches', 'big.jpg')
+        os.utime(path, ns=(0, 0))
+        self.assertIn('Built 0 images, 2 unchanged', self.build())
+
+        old_hash = images.read_manifest()['watches/big.jpg']['hash']
+        Image.new('RGB', (1000, 800), (0, 90, 0)).save(path)
+        self.assertIn('Built 1 images, 1 unchanged', self.build('--prune'))
+        self.assertNotEqual(images.read_manifest()['watches/big.jpg']['hash'], old_hash)
+        self.assertFalse(os.path.exists(os.path.join(self.media, images.derivative_name(old_hash, 240, 'jpeg'))))
+
+    def test_template_tag_emits_srcset_and_falls_back_to_the_original(self):
+        brand = Brand.objects.create(name='Rolex')
+        watch = make_watch(brand, 'Submariner', image='watches/big.jpg')
+        template = Template('{% load store_tags %}{% responsive_image watch.image alt=watch.name %}')
+
+        html = template.render(Context({'watch': watch}))
+        self.assertTrue(html.startswith('<img src="/media/watches/big.jpg" alt="Submariner" loading="lazy" style="'))
+
+        self.build()
+        html = template.render(Context({'watch': watch}))
+        digest = images.read_manifest()['watches/big.jpg']['hash']
+        self.assertIn(f'<source type="image/webp" srcset="/media/{images.derivative_name(digest, 240, "webp")} 240w, ', html)
+        self.assertIn(f'src="/media/{images.derivative_name(digest, 800, "jpeg")}"', html)
+        self.assertIn('sizes="(max-width: 600px) 50vw', html)
+
+
+class ImagePreviewTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(images.reset_manifest_cache)
+        os.makedirs(os.path.join(self.media, 'watches'))
+        self.save_image('watches/red.jpg', (200, 30, 30))
+        self.brand = Brand.objects.create(name='Rolex')
+
+    def save_image(self, name, color):
+        image = Image.new('RGB', (400, 300), color)
+        # A smaller patch of another colour must not win the dominant colour
+        image.paste((20, 20, 200), (0, 0, 100, 100))
+        image.save(os.path.join(self.media, name))
+
+    def test_save_computes_previews_only_when_the_image_changes(self):
+        watch = make_watch(self.brand, 'Submariner', image='watches/red.jpg')
+        watch.refresh_from_db()
+        preview = watch.image_previews['image']
+        self.assertEqual(preview['source'], 'watches/red.jpg')
+        red, green, blue = (int(preview['color'][i:i + 2], 16) for i in (1, 3, 5))
+        self.assertTrue(red > 150 and green < 80 and blue < 80, preview['color'])
+        self.assertTrue(preview['placeholder'].startswith('data:image/webp;base64,'))
+        self.assertLess(len(preview['placeholder']), 400)
+
+        with CaptureQueriesContext(connection) as queries:
+            watch.name = 'Submariner Date'
+            watch.save()
+        self.assertFalse([q for q in queries if 'SET "image_previews"' in q['sql']])
+
+        self.save_image('watches/green.jpg', (30, 160, 30))
+        watch.image = 'watches/green.jpg'
+        watch.save()
+        watch.refresh_from_db()
+        self.assertEqual(watch.image_previews['image']['source'], 'watches/green.jpg')
+
+        watch.image = None
+        watch.save()
+        watch.refresh_from_db()
+        self.assertEqual(watch.image_previews, {})
+
+    def test_template_tags_paint_the_placeholder(self):
+        watch = make_watch(self.brand, 'Submariner', image='watches/red.jpg')
+        watch.refresh_from_db()
+        html = Template('{% load store_tags %}{% responsive_image watch.image alt=watch.name %}').render(
+            Context({'watch': watch})
+        )
+        preview = watch.image_previews['image']
+        self.assertIn(f'style="background-color:{preview["color"]};background-image:url({preview["placeholder"]})', html)
+
+        # A preview made for another file is ignored
+        watch.image = 'watches/other.jpg'
+        html = Template('{% load store_tags %}{% preview_style watch.image %}').render(Context({'watch': watch}))
+        self.assertEqual(html, '')
+
+    def test_backfill_command_fills_missing_previews(self):
+        watch = make_watch(self.brand, 'Submariner', image='watches/red.jpg')
+        Watch.objects.filter(pk=watch.pk).update(image_previews={})
+        make_watch(self.brand, 'Datejust')
+
+        out = StringIO()
+        call_command('build_image_previews', stdout=out)
+        self.assertIn('Updated previews for 1 of 3 rows', out.getvalue())
+        watch.refresh_from_db()
+        self.assertEqual(watch.image_previews['image']['source'], 'watches/red.jpg')
+
+        out = StringIO()
+        call_command('build_image_previews', stdout=out)
+        self.assertIn('Updated previews for 0 of 3 rows', out.getvalue())
+
+
+class ImageServer(BaseHTTPRequestHandler):
+    """Serves JPEGs by path with an ETag, answering 304 when it matches."""
+    files = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = f'"{len(body)}-{body[-8:].hex()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadImagesTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        ImageServer.files = {'/sub.jpg': self.jpeg((10, 20, 200)), '/day.jpg': self.jpeg((200, 200, 20))}
+        ImageServer.requests = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ImageServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+
+        brand = Brand.objects.create(name='Rolex')
+        self.sub = make_watch(brand, 'Submariner')
+        self.day = make_watch(brand, 'Daytona')
+        self.urls = os.path.join(self.media, 'urls.json')
+        with open(self.urls, 'w') as f:
+            json.dump({
+                self.sub.slug: f'{base}/sub.jpg',
+                self.day.slug: f'{base}/day.jpg',
+                'rolex-missing': f'{base}/missing.jpg',
+            }, f)
+
+    def jpeg(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (120, 80), color).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def download(self):
+        out = StringIO()
+        call_command('download_images', f'--urls={self.urls}', '--workers=4', stdout=out)
+        return out.getvalue()
+
+    def test_downloads_concurrently_then_skips_unchanged_images(self):
+        with CaptureQueriesContext(connection) as queries:
+            output = self.download()
+        self.assertIn('Watch not found: rolex-missing', output)
+        self.assertIn('Downloaded 2, 0 unchanged, 0 failed, 2 watches updated', output)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "store_watch"')]), 1)
+
+        self.sub.refresh_from_db()
+        self.assertTrue(self.sub.image.name.startswith('blobs/'))
+        self.assertIn('image', self.sub.image_previews)
+        with open(os.path.join(self.media, self.sub.image.name), 'rb') as f:
+            self.assertEqual(f.read(), ImageServer.files['/sub.jpg'])
+        self.assertEqual(os.listdir(os.path.join(self.media, 'watches')), ['.downloads.json'])
+
+        ImageServer.files['/day.jpg'] = self.jpeg((20, 150, 20))
+        self.assertIn('Downloaded 1, 1 unchanged, 0 failed, 1 watches updated', self.download())
+        self.day.refresh_from_db()
+        self.assertNotEqual(self.day.image_previews['image']['color'], self.sub.image_previews['image']['color'])
+
+    def test_failures_are_reported_and_retried_next_run(self):
+        del ImageServer.files['/day.jpg']
+        output = self.download()
+        self.assertIn('Downloaded 1, 0 unchanged, 1 failed', output)
+        self.assertIn('✗ Daytona', output)
+
+        ImageServer.files['/day.jpg'] = self.jpeg((200, 200, 20))
+        self.assertIn('Downloaded 1, 1 unchanged, 0 failed', self.download())
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(images.reset_manifest_cache)
+        self.brand = Brand.objects.create(name='Rolex')
+
+    def jpeg(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (60, 40), color).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def blob_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(d, f), self.media).replace(os.sep, '/')
+            for d, _, files in os.walk(os.path.join(self.media, storage.BLOBS_DIR)) for f in files
+        )
+
+    def test_identical_uploads_share_one_blob_and_deletes_respect_references(self):
+        santos = make_watch(self.brand, 'Santos')
+        tank = make_watch(self.brand, 'Tank')
+        santos.image.save('dress.PNG', ContentFile(self.jpeg((90, 60, 30))))
+        tank.image.save('another-name.png', ContentFile(self.jpeg((90, 60, 30))))
+        self.assertEqual(santos.image.name, tank.image.name)
+        self.assertRegex(santos.image.name, r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(self.blob_files(), [santos.image.name])
+
+        # Still referenced by the tank, so the file stays
+        name = santos.image.name
+        santos.image.delete()
+        self.assertTrue(default_storage.exists(name))
+        tank.image.delete()
+        self.assertFalse(default_storage.exists(name))
+
+    def test_blobs_are_served_with_immutable_cache_headers(self):
+        watch = make_watch(self.brand, 'Santos')
+        watch.image.save('dress.jpg', ContentFile(self.jpeg((90, 60, 30))))
+        # The media routes are only mounted with DEBUG, so call the view directly
+        response = immutable_media(RequestFactory().get(watch.image.url), watch.image.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], storage.IMMUTABLE_CACHE_CONTROL)
+
+    def test_migrate_command_dedups_existing_files_and_collects_orphans(self):
+        os.makedirs(os.path.join(self.media, 'watches'))
+        for name in ('fixed_dress.png', 'copy_of_dress.png'):
+            with open(os.path.join(self.media, 'watches', name), 'wb') as f:
+                f.write(self.jpeg((90, 60, 30)))
+        santos = make_watch(self.brand, 'Santos', image='watches/fixed_dress.png')
+        tank = make_watch(self.brand, 'Tank', image='watches/fixed_dress.png', image_2='watches/copy_of_dress.png')
+        orphan = default_storage.save('orphan.jpg', ContentFile(self.jpeg((0, 0, 0))))
+        os.utime(os.path.join(self.media, orphan), (0, 0))
+        santos.refresh_from_db()
+        preview = santos.image_previews['image']
+
+        out = StringIO()
+        call_command('migrate_media_blobs', stdout=out)
+        self.assertIn('2 files moved into blobs, 1 unreferenced blobs', out.getvalue())
+
+        santos.refresh_from_db()
+        tank.refresh_from_db()
+        blob = santos.image.name
+        self.assertTrue(storage.is_blob(blob))
+        self.assertEqual({tank.image.name, tank.image_2.name}, {blob})
+        self.assertEqual(santos.image_previews['image'], dict(preview, source=blob))
+        self.assertEqual(self.blob_files(), [blob])
+        self.assertEqual(os.listdir(os.path.join(self.media, 'watches')), [])
+
+    def test_upload_matching_an_old_unreferenced_blob_protects_it_from_collection(self):
+        blob = default_storage.save('orphan.jpg', ContentFile(self.jpeg((0, 0, 0))))
+        os.utime(os.path.join(self.media, blob), (0, 0))
+        # An upload of the same content, whose row is not saved yet
+        self.assertEqual(default_storage.save('upload.jpg', ContentFile(self.jpeg((0, 0, 0)))), blob)
+
+        out = StringIO()
+        call_command('migrate_media_blobs', stdout=out)
+        self.assertIn('0 unreferenced blobs', out.getvalue())
+        self.assertTrue(default_storage.exists(blob))
+
+    def test_file_fields_outside_the_catalog_count_as_references(self):
+        profile = User.objects.create_user('alice', password='pw').profile
+        profile.avatar.save('me.jpg', ContentFile(self.jpeg((10, 20, 30))))
+        avatar = profile.avatar.name
+        os.utime(os.path.join(self.media, avatar), (0, 0))
+        watch = make_watch(self.brand, 'Santos')
+        watch.image.save('dress.jpg', ContentFile(self.jpeg((10, 20, 30))))
+        self.assertEqual(storage.reference_counts()[avatar], 2)
+
+        os.makedirs(os.path.join(self.media, 'avatars'))
+        with open(os.path.join(self.media, 'avatars', 'legacy.jpg'), 'wb') as f:
+            f.write(self.jpeg((200, 0, 0)))
+        legacy = User.objects.create_user('bob', password='pw').profile
+        legacy.avatar = 'avatars/legacy.jpg'
+        legacy.save()
+
+        out = StringIO()
+        call_command('migrate_media_blobs', '--min-age=0', stdout=out)
+        self.assertIn('1 files moved into blobs, 0 unreferenced blobs', out.getvalue())
+        self.assertTrue(default_storage.exists(avatar))
+        legacy.refresh_from_db()
+        self.assertTrue(storage.is_blob(legacy.avatar.name))
+        self.assertTrue(default_storage.exists(legacy.avatar.name))
+
+        # Still referenced by the avatar once the watch lets go of it
+        watch.image.delete()
+        self.assertTrue(default_storage.exists(avatar))
+
+
+class GenerateCatalogTests(TestCase):
+    def generate(self, prefix, seed=7):
+        out = StringIO()
+        call_command(
+            'generate_catalog', f'--prefix={prefix}', f'--seed={seed}', '--brands=3', '--categories=2',
+            '--watches=40', '--users=6', '--reviews=50', '--wishlists=10', '--carts=4', '--orders=9',
+            '--batch-size=7', stdout=out,
+        )
+        return out.getvalue()
+
+    def test_generates_consistent_rows_in_batches(self):
+        output = self.generate('a')
+        self.assertIn('Watches: 40 rows', output)
+        self.assertIn('reviews: 50 rows', output)
+        self.assertIn('rows/s', output)
+        self.assertEqual(User.objects.filter(username__startswith='a_user', profile__isnull=False).count(), 6)
+
+        watch = Watch.objects.filter(review_count__gt=0).first()
+        ratings = list(watch.reviews.values_list('rating', flat=True))
+        self.assertEqual((watch.rating_sum, watch.review_count), (sum(ratings), len(ratings)))
+
+        self.assertEqual(Cart.objects.filter(user__isnull=False).count(), 2)
+        for order in Order.objects.prefetch_related('items'):
+            items = list(order.items.all())
+            self.assertEqual(order.subtotal, sum(item.line_total for item in items))
+            self.assertEqual(order.item_count, sum(item.quantity for item in items))
+            # Rounded and named as place_order does
+            summary = CartSummary(order.item_count, order.subtotal)
+            self.assertEqual((order.tax, order.total), (summary.tax, summary.total))
+            for item in items:
+                self.assertEqual(item.watch_name, f'{item.watch_brand} {item.watch.name}')
+        self.assertGreater(search.count_matches(watch.name), 0)
+
+        with self.assertRaises(CommandError):
+            self.generate('a')
+
+    def test_same_seed_generates_the_same_catalog(self):
+        self.generate('a')
+        self.generate('b')
+        self.generate('c', seed=8)
+
+        def catalog(prefix):
+            return list(
+                Watch.objects.filter(slug__startswith=f'{prefix}-').order_by('pk')
+                .values_list('name', 'price', 'stock', 'rating_sum')
+            )
+        self.assertEqual(catalog('a'), catalog('b'))
+        self.assertNotEqual(catalog('a'), catalog('c'))
+
+
+class BenchmarkTests(TestCase):
+    def test_cases_record_timings_queries_and_memory(self):
+        benchmarks.populate({'brands': 2, 'categories': 2, 'watches': 30, 'users': 5, 'reviews': 40,
+                             'wishlists': 0, 'carts': 0, 'orders': 0}, stdout=StringIO())
+        results = benchmarks.run(iterations=3)
+        self.assertIn('watch_list sort=price_high', results)
+        self.assertIn('store_tags filters', results)
+        # Every run places an order: the cart is refilled between runs, untimed
+        self.assertEqual(Order.objects.count(), benchmarks.WARMUP + 2 + 3)
+        self.assertGreater(results['checkout POST']['queries'], 0)
+        detail = results['watch_detail']
+        self.assertEqual(detail['iterations'], 3)
+        self.assertGreater(detail['queries'], 0)
+        self.assertGreater(detail['peak_kib'], 0)
+        self.assertLessEqual(detail['p50_ms'], detail['p95_ms'])
+        self.assertLessEqual(detail['p95_ms'], detail['p99_ms'])
+
+    def test_compare_flags_extra_queries_and_slowdowns_beyond_threshold(self):
+        baseline = {'small': {
+            'home': {'p50_ms': 10.0, 'queries': 3},
+            'search': {'p50_ms': 10.0, 'queries': 4},
+            'filters': {'p50_ms': 0.01, 'queries': 0},
+        }}
+        results = {'small': {
+            'home': {'p50_ms': 12.0, 'queries': 3},
+            'search': {'p50_ms': 14.0, 'queries': 5},
+            'filters': {'p50_ms': 0.05, 'queries': 0},
+            'new case': {'p50_ms': 1.0, 'queries': 1},
+        }}
+        self.assertEqual(benchmarks.compare(results, baseline, threshold=0.25), [
+            'small / search: 4 -> 5 queries',
+            'small / search: p50 10.00 -> 14.00 ms (+40%)',
+        ])
+        self.assertEqual(benchmarks.percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(benchmarks.percentile(list(range(1, 101)), 99), 99)
+
+
+class LoadTestTests(TransactionTestCase):
+    def test_concurrent_journeys_keep_their_own_sessions_and_check_out(self):
+        brand = Brand.objects.create(name='Rolex')
+        for name in ('Submariner', 'Daytona', 'Explorer'):
+            make_watch(brand, name, stock=50)
+
+        report = loadtest.run(threads=1, journeys=3, checkout_ratio=1.0)
+        self.assertEqual(report['journeys'], 3)
+        # home, list, detail, search, add, cart, checkout GET and POST per journey
+        self.assertEqual(report['requests'], 24)
+        self.assertEqual(report['errors'], {})
+        self.assertEqual(report['urls']['cart:add_to_cart']['requests'], 3)
+        self.assertEqual(Order.objects.filter(user__username=f'{loadtest.SHOPPER_PREFIX}0').count(), 3)
+
+    def test_concurrent_browsing_reports_lock_errors_separately(self):
+        brand = Brand.objects.create(name='Rolex')
+        make_watch(brand, 'Submariner', stock=50)
+
+        report = loadtest.run(threads=3, journeys=2, checkout_ratio=0.0)
+        self.assertEqual(report['requests'], 36)
+        # The in-memory test database has no busy timeout, so contended writes may fail, but only as locks.
+        self.assertLessEqual(set(report['errors']), {'locked'})
+        self.assertEqual(report['locked_errors'], report['errors'].get('locked', 0))
+        # One anonymous cart per successful journey, never shared between sessions
+        self.assertLessEqual(Cart.objects.filter(user__isnull=True).count(), 6)
+        self.assertEqual(Cart.objects.filter(session_key__isnull=True).count(), 0)
+
+    def test_locked_session_save_is_reported_as_locked(self):
+        brand = Brand.objects.create(name='Rolex')
+        watch = make_watch(brand, 'Submariner', stock=50)
+
+        def lock_sessions(execute, sql, params, many, context):
+            if sql.startswith('UPDATE "django_session"'):
+                raise OperationalError('database table is locked: django_session')
+            return execute(sql, params, many, context)
+
+        from config.wsgi import application
+        samples = []
+        session = loadtest.Session(application, samples)
+        session.request('GET', '/')
+        with connection.execute_wrapper(lock_sessions):
+            status, _ = session.request('POST', f'/cart/add/{watch.pk}/', {'quantity': 1}, ajax=True)
+        # Django answers a session it could not save with SessionInterrupted, a plain 400
+        self.assertEqual(status, 400)
+        self.assertEqual(samples[-1][2], 'locked')
+
+
+@override_settings(METRICS_TOKEN='scrape-secret', METRICS_DIR=None)
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        brand = Brand.objects.create(name='Rolex')
+        self.watch = make_watch(brand, 'Submariner')
+
+    def scrape(self, **headers):
+        return self.client.get(reverse('metrics'), headers=headers)
+
+    def test_records_requests_queries_templates_and_size_per_view(self):
+        self.client.get(self.watch.get_absolute_url())
+        response = self.client.get(self.watch.get_absolute_url())
+        self.client.get('/no-such-page/')
+
+        stats = metrics.snapshot()
+        detail = stats['store:watch_detail|2xx']
+        self.assertEqual(detail['requests'], 2)
+        self.assertEqual(sum(detail['buckets']), 2)
+        self.assertGreater(detail['queries'], 0)
+        self.assertGreater(detail['db_seconds'], 0)
+        self.assertGreater(detail['template_seconds'], 0)
+        self.assertLessEqual(detail['template_seconds'], detail['latency_sum'])
+        self.assertEqual(detail['response_bytes'], 2 * len(response.content))
+        self.assertEqual(stats[f'{metrics.UNRESOLVED}|4xx']['requests'], 1)
+
+    def test_endpoint_requires_the_token_or_staff(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(authorization='Bearer wrong').status_code, 403)
+        self.client.force_login(User.objects.create_user('shopper', password='pw'))
+        self.assertEqual(self.scrape().status_code, 403)
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        self.assertEqual(self.scrape().status_code, 200)
+
+    def test_prometheus_text_format(self):
+        self.client.get(self.watch.get_absolute_url())
+        response = self.scrape(authorization='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE django_view_latency_seconds histogram', body)
+        self.assertIn('django_view_requests_total{view="store:watch_detail",status="2xx"} 1', body)
+        self.assertIn('django_view_latency_seconds_bucket{view="store:watch_detail",status="2xx",le="+Inf"} 1', body)
+        self.assertIn('django_view_latency_seconds_count{view="store:watch_detail",status="2xx"} 1', body)
+        self.assertIn('django_view_db_queries_total{view="store:watch_detail"', body)
+        self.assertIn('django_view_template_seconds_total{view="store:watch_detail"', body)
+        self.assertIn('django_view_response_bytes_total{view="store:watch_detail"', body)
+        escaped = metrics.render({'a"b\\c|2xx': metrics.snapshot()['store:watch_detail|2xx']})
+        self.assertIn('django_view_requests_total{view="a\\"b\\\\c",status="2xx"} 1', escaped)
+
+    def test_counters_are_summed_across_processes_through_the_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other = {'store:home|2xx': {
+            'requests': 3, 'latency_sum': 0.3, 'queries': 12, 'db_seconds': 0.01, 'template_seconds': 0.1,
+            'response_bytes': 3000, 'buckets': [0, 0, 0, 0, 3] + [0] * (len(metrics.BUCKETS) - 4),
+        }}
+        with open(os.path.join(directory, '99999999-0a1b2c3d.json'), 'w') as f:
+            json.dump(other, f)
+        # A worker that died long ago: left out of the totals and cleaned up
+        dead = os.path.join(directory, '99999998-4e5f6a7b.json')
+        with open(dead, 'w') as f:
+            json.dump(other, f)
+        os.utime(dead, (0, 0))
+
+        with self.settings(METRICS_DIR=directory):
+            self.client.get(reverse('store:home'))
+            totals = metrics.collect()
+        own = [name for name in os.listdir(directory) if name.startswith(f'{os.getpid()}-')]
+        self.assertEqual(len(own), 1)
+        self.assertFalse(os.path.exists(dead))
+        self.assertEqual(totals['store:home|2xx']['requests'], 4)
+        self.assertEqual(totals['store:home|2xx']['queries'], 12 + metrics.snapshot()['store:home|2xx']['queries'])
+        self.assertEqual(sum(totals['store:home|2xx']['buckets']), 4)
+
+
+    def test_a_forked_worker_starts_its_own_snapshot(self):
+        self.client.get(reverse('store:home'))
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write, json.dumps([metrics._snapshot_name[0], metrics.snapshot()]).encode())
+            os._exit(0)
+        os.close(write)
+        os.waitpid(pid, 0)
+        with os.fdopen(read) as f:
+            name, stats = json.load(f)
+        self.assertTrue(name.startswith(f'{pid}-'))
+        self.assertNotEqual(name, metrics._snapshot_name[0])
+        self.assertEqual(stats, {})
+
+class SlowQueryTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.log = os.path.join(directory, 'slow.jsonl')
+        # Every query counts as slow
+        overrides = self.settings(SLOW_QUERY_MS=0.0, SLOW_QUERY_SAMPLE_RATE=1.0, SLOW_QUERY_LOG=self.log)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.brand = Brand.objects.create(name='Rolex')
+
+    def samples(self, fragment):
+        return [entry for entry in slowqueries.read(self.log) if fragment in entry['sql']]
+
+    def test_samples_capture_plan_flags_stack_and_parameter_shape(self):
+        self.assertIn(slowqueries.sample, connection.execute_wrappers)
+        list(Watch.objects.filter(description__in=['a', 'b', 'c']).order_by('description'))
+
+        entry = self.samples('"store_watch"."description" IN (...)')[-1]
+        self.assertIn('full_scan', entry['flags'])
+        self.assertIn('temp_btree', entry['flags'])
+        self.assertTrue(any(detail.startswith('SCAN') for detail in entry['plan']))
+        self.assertEqual(entry['params'], {'types': ['str', 'str', 'str']})
+        self.assertTrue(entry['stack'][-1].startswith('store/tests.py:'))
+        self.assertNotIn("'a'", json.dumps(entry))
+
+        list(Watch.objects.filter(pk=1))
+        by_pk = self.samples('WHERE "store_watch"."id" = ?')[-1]
+        self.assertEqual(by_pk['flags'], [])
+
+    def test_fingerprint_ignores_literals_and_list_lengths(self):
+        self.assertEqual(
+            slowqueries.normalize("SELECT * FROM t WHERE a IN (%s, %s) AND b = 'x''y' LIMIT 21"),
+            'SELECT * FROM t WHERE a IN (...) AND b = ? LIMIT ?',
+        )
+        self.assertEqual(
+            slowqueries.normalize('SELECT * FROM t WHERE a IN (%s, %s, %s)   AND b = %s LIMIT 5'),
+            slowqueries.normalize("SELECT * FROM t WHERE a IN (1, 2) AND b = 'z' LIMIT 21"),
+        )
+
+    def test_log_rotates_within_its_bound(self):
+        with self.settings(SLOW_QUERY_LOG_BYTES=4096, SLOW_QUERY_LOG_BACKUPS=2):
+            for i in range(60):
+                Watch.objects.filter(pk=i).exists()
+            files = os.listdir(os.path.dirname(self.log))
+            self.assertEqual(sorted(files), ['slow.jsonl', 'slow.jsonl.1', 'slow.jsonl.2'])
+            self.assertTrue(all(os.path.getsize(os.path.join(os.path.dirname(self.log), name)) <= 4096 * 2
+                                for name in files))
+            self.assertTrue(self.samples('store_watch'))
+
+    def test_command_groups_by_fingerprint(self):
+        for name in ('Submariner', 'Daytona', 'Explorer'):
+            Watch.objects.filter(name=name).count()
+        out = StringIO()
+        call_command('slow_queries', '--log', self.log, '--json', '--flag', 'full_scan', stdout=out)
+        rows = json.loads(out.getvalue())
+        counts = [row for row in rows if 'COUNT(*)' in row['sql'] and '"store_watch"."name" = ?' in row['sql']]
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(counts[0]['count'], 3)
+        self.assertEqual(counts[0]['flags'], ['full_scan'])
+        self.assertTrue(counts[0]['call_sites'][0].startswith('store/tests.py:'))
+
+        out = StringIO()
+        call_command('slow_queries', '--log', self.log, stdout=out)
+        self.assertIn('plan: SCAN store_watch', out.getvalue())
+
+
+class QueryBudgetTests(TestCase):
+    def test_pages_stay_within_budget_and_do_not_grow_with_rows(self):
+        results = querybudget.run()
+        self.assertEqual(set(results), set(querybudget.BUDGETS))
+        failures = querybudget.check(results)
+        if failures:
+            self.fail('\n'.join(failures))
+
+    def test_n_plus_one_is_reported_with_fingerprints_and_template_lines(self):
+        template = Template('{% for watch in watches %}\n{{ watch.brand.name }}{% endfor %}')
+        brands = [Brand.objects.create(name=f'Brand {i}') for i in range(6)]
+        for brand in brands:
+            make_watch(brand, f'{brand.name} Watch')
+
+        def render(count):
+            return querybudget.measure(lambda: template.render(Context({'watches': Watch.objects.all()[:count]})))
+
+        results = {'listing': {'small': render(2), 'large': render(6)}}
+        failures = querybudget.check(results, budgets={'listing': {'small': 5, 'large': 5}})
+        self.assertEqual(failures[0], 'listing (large): 7 queries, budget 5')
+        self.assertRegex(failures[1], r'^    6x [0-9a-f]{12} SELECT \.\.\. FROM "store_brand" WHERE "store_brand"\."id" = \? LIMIT \?$')
+        self.assertEqual(failures[2], '        6x from <unknown source>:2')
+        self.assertIn('listing: 3 queries (small) -> 7 (large), grows with the rows', failures)
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        overrides = self.settings(PROFILE_DIR=self.directory, PROFILE_KEEP=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        brand = Brand.objects.create(name='Rolex')
+        for name in ('Submariner', 'Daytona'):
+            make_watch(brand, name)
+
+    def profile(self, url=None, **params):
+        return self.client.get(url or reverse('store:watch_list'), params,
+                               headers={profiler.HEADER: profiler.make_token()})
+
+    def test_signed_header_profiles_the_request(self):
+        response = self.profile(sort='rating')
+        name = response[f'{profiler.HEADER}-Id']
+        self.assertEqual(profiler.profile_names(), [name])
+
+        summary = profiler.load(name)
+        self.assertEqual(summary['url_name'], 'store:watch_list')
+        self.assertEqual(summary['path'], '/watches/?sort=rating')
+        self.assertEqual(summary['status'], 200)
+        self.assertGreater(summary['queries'], 0)
+        self.assertGreater(summary['wall_ms'], 0)
+
+        stats = pstats.Stats(os.path.join(self.directory, f'{name}.pstats'))
+        self.assertTrue(any(func == 'watch_list' and path.endswith(os.path.join('store', 'views.py'))
+                            for path, _, func in stats.stats))
+        with open(os.path.join(self.directory, f'{name}.collapsed')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines), summary['samples'])
+
+    def test_unsigned_or_expired_tokens_are_ignored(self):
+        self.client.get(reverse('store:watch_list'), headers={profiler.HEADER: 'profile:forged:token'})
+        self.client.get(reverse('store:watch_list'), {profiler.QUERY_PARAM: 'nonsense'})
+        with self.settings(PROFILE_TOKEN_MAX_AGE=-1):
+            self.profile()
+        self.assertEqual(profiler.profile_names(), [])
+
+        self.client.get(reverse('store:watch_list'), {'sort': 'rating', profiler.QUERY_PARAM: profiler.make_token()})
+        summary = profiler.load(profiler.profile_names()[0])
+        self.assertEqual(summary['url_name'], 'store:watch_list')
+        # The token is a credential; it stays out of the stored summary
+        self.assertEqual(summary['path'], '/watches/?sort=rating')
+
+    def test_only_the_newest_profiles_are_kept(self):
+        names = [self.profile()[f'{profiler.HEADER}-Id'] for _ in range(3)]
+        self.assertEqual(profiler.profile_names(), names[:0:-1])
+        self.assertEqual(len(os.listdir(self.directory)), 2 * len(profiler.SUFFIXES))
+
+    def test_admin_page_lists_profiles_for_staff(self):
+        name = self.profile()[f'{profiler.HEADER}-Id']
+        self.assertEqual(self.client.get(reverse('profile_list')).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('staff', password='pw', is_staff=True))
+        response = self.client.get(reverse('profile_list'))
+        self.assertContains(response, 'store:watch_list')
+        self.assertContains(response, reverse('profile_download', args=[name, 'collapsed']))
+
+        download = self.client.get(reverse('profile_download', args=[name, 'pstats']))
+        self.assertEqual(download['Content-Disposition'], f'attachment; filename="{name}.pstats"')
+        self.assertEqual(self.client.get(reverse('profile_download', args=[name, 'py'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('profile_download', args=['..', 'json'])).status_code, 404)
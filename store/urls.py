@@ -9,4 +9,5 @@ urlpatterns = [
     path('watches/<slug:slug>/', views.watch_detail, name='watch_detail'),
     path('watches/<slug:slug>/review/', views.add_review, name='add_review'),
     path('search/', views.search, name='search'),
+    path('search/suggest/', views.suggest, name='suggest'),
 ]
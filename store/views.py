@@ -1,19 +1,69 @@
+import os
+
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Q, Avg
+from django.db.models import Count, Q
+from django.template.loader import render_to_string
 from .models import Watch, Brand, Category, Review
+from .catalog import get_version
+from .facets import get_facets, parse_price
+from .pagination import KeysetPaginator, InvalidCursor
+from . import search as search_index
+from . import suggest as suggest_index
+from . import profiler
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, JsonResponse
 from django.views.decorators.http import require_POST
+from django.views.static import serve as static_serve
+from django.conf import settings
+from .storage import IMMUTABLE_CACHE_CONTROL
+
+WATCHES_PER_PAGE = 24
+
+SORT_ORDERS = {
+    'newest': ('-created_at', '-pk'),
+    'price_low': ('price', 'pk'),
+    'price_high': ('-price', '-pk'),
+    'name': ('name', 'pk'),
+    'rating': ('-avg_rating', '-review_count', '-pk'),
+}
+
+
+def paginate_watches(request, watches, sort):
+    paginator = KeysetPaginator(watches, SORT_ORDERS[sort], per_page=WATCHES_PER_PAGE)
+    try:
+        return paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return paginator.page()
+
+
+def watch_page_json(request, page):
+    next_url = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_url = f'{request.path}?{params.urlencode()}'
+    return JsonResponse({
+        'html': render_to_string('store/includes/watch_cards.html', {'watches': page}, request=request),
+        'count': len(page),
+        'next_cursor': page.next_cursor,
+        'next_url': next_url,
+    })
 
 
 def home(request):
-    featured = Watch.objects.filter(is_featured=True, is_active=True)[:8]
-    new_arrivals = Watch.objects.filter(is_new_arrival=True, is_active=True)[:8]
-    bestsellers = Watch.objects.filter(is_bestseller=True, is_active=True)[:8]
+    # Every section is cached as a rendered fragment keyed on catalog_version, so
+    # these querysets are only evaluated when the catalog has changed.
+    watches = Watch.objects.filter(is_active=True).select_related('brand')
+    featured = watches.filter(is_featured=True)[:8]
+    new_arrivals = watches.filter(is_new_arrival=True)[:8]
+    bestsellers = watches.filter(is_bestseller=True)[:8]
     brands = Brand.objects.all()[:6]
-    categories = Category.objects.all()
+    categories = Category.objects.annotate(watch_count=Count('watches'))
 
     context = {
+        'catalog_version': get_version(),
         'featured': featured,
         'new_arrivals': new_arrivals,
         'bestsellers': bestsellers,
@@ -24,54 +74,68 @@ def home(request):
 
 
 def watch_list(request):
-    watches = Watch.objects.filter(is_active=True)
-    brands = Brand.objects.all()
-    categories = Category.objects.all()
+    watches = Watch.objects.filter(is_active=True).select_related('brand')
+    brands = list(Brand.objects.all())
+    categories = list(Category.objects.all())
 
     # Filters
     brand_slug = request.GET.get('brand')
     category_slug = request.GET.get('category')
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
+    min_price = parse_price(request.GET.get('min_price'))
+    max_price = parse_price(request.GET.get('max_price'))
     sort = request.GET.get('sort', 'newest')
+    if sort not in SORT_ORDERS:
+        sort = 'newest'
+
+    brand = next((b for b in brands if b.slug == brand_slug), None)
+    category = next((c for c in categories if c.slug == category_slug), None)
 
     if brand_slug:
-        watches = watches.filter(brand__slug=brand_slug)
+        watches = watches.filter(brand=brand) if brand else watches.none()
     if category_slug:
-        watches = watches.filter(category__slug=category_slug)
-    if min_price:
+        watches = watches.filter(category=category) if category else watches.none()
+    if min_price is not None:
         watches = watches.filter(price__gte=min_price)
-    if max_price:
+    if max_price is not None:
         watches = watches.filter(price__lte=max_price)
 
-    if sort == 'price_low':
-        watches = watches.order_by('price')
-    elif sort == 'price_high':
-        watches = watches.order_by('-price')
-    elif sort == 'name':
-        watches = watches.order_by('name')
-    elif sort == 'rating':
-        watches = watches.annotate(avg_rating=Avg('reviews__rating')).order_by('-avg_rating')
+    page = paginate_watches(request, watches, sort)
+    if request.GET.get('format') == 'json':
+        return watch_page_json(request, page)
+
+    if (brand_slug and brand is None) or (category_slug and category is None):
+        facets = None
+        total_count = 0
     else:
-        watches = watches.order_by('-created_at')
+        facets = get_facets(brand and brand.pk, category and category.pk, min_price, max_price)
+        total_count = facets['total']
+        for b in brands:
+            b.facet_count = facets['brands'].get(b.pk, 0)
+        for c in categories:
+            c.facet_count = facets['categories'].get(c.pk, 0)
+        tallest = max(bucket['count'] for bucket in facets['price']) or 1
+        for bucket in facets['price']:
+            bucket['percent'] = round(100 * bucket['count'] / tallest)
 
     context = {
-        'watches': watches,
+        'watches': page,
+        'total_count': total_count,
         'brands': brands,
         'categories': categories,
+        'price_histogram': facets['price'] if facets else [],
         'current_brand': brand_slug,
         'current_category': category_slug,
         'current_sort': sort,
-        'min_price': min_price or '',
-        'max_price': max_price or '',
+        'min_price': min_price if min_price is not None else '',
+        'max_price': max_price if max_price is not None else '',
     }
     return render(request, 'store/watch_list.html', context)
 
 
 def watch_detail(request, slug):
     watch = get_object_or_404(Watch, slug=slug, is_active=True)
-    related = Watch.objects.filter(brand=watch.brand, is_active=True).exclude(pk=watch.pk)[:4]
-    reviews = watch.reviews.all()[:10]
+    related = Watch.objects.filter(brand=watch.brand_id, is_active=True).exclude(pk=watch.pk).select_related('brand')[:4]
+    reviews = watch.reviews.select_related('user')[:10]
     user_reviewed = False
     if request.user.is_authenticated:
         user_reviewed = Review.objects.filter(watch=watch, user=request.user).exists()
@@ -87,22 +151,45 @@ def watch_detail(request, slug):
 
 def search(request):
     query = request.GET.get('q', '')
-    watches = Watch.objects.filter(is_active=True)
-    if query:
-        watches = watches.filter(
-            Q(name__icontains=query) |
-            Q(brand__name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(category__name__icontains=query)
-        )
+    watches = Watch.objects.filter(is_active=True).select_related('brand')
+
+    if query and search_index.is_available():
+        try:
+            page = search_index.search_page(query, watches, request.GET.get('cursor'), per_page=WATCHES_PER_PAGE)
+        except InvalidCursor:
+            page = search_index.search_page(query, watches, per_page=WATCHES_PER_PAGE)
+        total_count = search_index.count_matches(query)
+    else:
+        if query:
+            watches = watches.filter(
+                Q(name__icontains=query) |
+                Q(brand__name__icontains=query) |
+                Q(description__icontains=query) |
+                Q(category__name__icontains=query)
+            )
+        page = paginate_watches(request, watches, 'newest')
+        total_count = watches.count()
+
+    if request.GET.get('format') == 'json':
+        return watch_page_json(request, page)
 
     context = {
-        'watches': watches,
+        'watches': page,
+        'total_count': total_count,
         'query': query,
     }
     return render(request, 'store/search_results.html', context)
 
 
+def suggest(request):
+    try:
+        limit = min(int(request.GET.get('limit', suggest_index.TOP_K)), suggest_index.TOP_K)
+    except ValueError:
+        limit = suggest_index.TOP_K
+    query = request.GET.get('q', '')
+    return JsonResponse({'query': query, 'suggestions': suggest_index.suggest(query, limit)})
+
+
 @login_required
 @require_POST
 def add_review(request, slug):
@@ -122,3 +209,28 @@ def add_review(request, slug):
         comment=comment,
     )
     return JsonResponse({'success': True, 'message': 'Review added successfully!'})
+
+
+def immutable_media(request, path):
+    """Serve content-addressed media (blobs and derivatives), which never change once written."""
+    response = static_serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@staff_member_required
+def profile_list(request):
+    profiles = [profiler.load(name) for name in profiler.profile_names()]
+    context = dict(admin.site.each_context(request), title='Request profiles', profiles=profiles,
+                   token=profiler.make_token(), header=profiler.HEADER, query_param=profiler.QUERY_PARAM)
+    return render(request, 'admin/store/profiles.html', context)
+
+
+@staff_member_required
+def profile_download(request, name, suffix):
+    if not profiler.NAME.match(name) or f'.{suffix}' not in profiler.SUFFIXES:
+        raise Http404
+    path = os.path.join(settings.PROFILE_DIR, f'{name}.{suffix}')
+    if not os.path.exists(path):
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.{suffix}')